@@ -0,0 +1,161 @@
+import os
+import numpy as np
+
+# map AASPI data_format / hdrfmt values to numpy dtypes
+_FORMATS = {"xdr_float": ">f4", "native_float": "=f4",
+            "xdr_int": ">i4", "native_int": "=i4"}
+
+
+def read_aaspi_header(header_path):
+    """ Parse an AASPI/SEP style header file.
+
+    Every whitespace separated key=value token is kept, later values override
+    earlier ones. Quotes are stripped from keys and values.
+
+    Parameters
+    ----------
+    header_path: str
+        Path to the .H or .H@@ header file.
+
+    Returns
+    -------
+    dict
+        Header values as strings.
+    """
+    hdr = {}
+    with open(header_path) as f:
+        for line in f:
+            for item in line.split():
+                if "=" in item:
+                    key, value = item.split('=', 1)
+                    hdr[key.replace('"', '').replace("'", "")] = \
+                        value.replace('"', '').replace("'", "")
+    return hdr
+
+
+class AaspiDataset:
+    """ Read only view of an AASPI volume and its trace idents.
+
+    The .H and hff idents headers are parsed once and the @ and @@@ binaries
+    are memory mapped as (n3, n2, n1) arrays. All slices are zero copy views
+    into the files.
+
+    Parameters
+    ----------
+    header_path: str
+        Path to the AASPI .H header file.
+    """
+
+    def __init__(self, header_path):
+        self.header_path = header_path
+        self.dirname = os.path.dirname(os.path.abspath(header_path))
+        self.hdr = read_aaspi_header(header_path)
+
+        self.n1, self.n2, self.n3 = (int(self.hdr.get(f'n{i}', 1))
+                                     for i in (1, 2, 3))
+        self.o1, self.o2, self.o3 = (float(self.hdr.get(f'o{i}', 0))
+                                     for i in (1, 2, 3))
+        self.d1, self.d2, self.d3 = (float(self.hdr.get(f'd{i}', 1))
+                                     for i in (1, 2, 3))
+
+        self.binary_path = self._path(self.hdr['in'])
+        self.data = np.memmap(self.binary_path, mode='r',
+                              dtype=_FORMATS[self.hdr.get('data_format',
+                                                          'xdr_float')],
+                              shape=(self.n3, self.n2, self.n1))
+
+        self.hff = None
+        self.idents = None
+        if 'hff' in self.hdr:
+            self.hff_path = self._path(self.hdr['hff'])
+            self.hff = read_aaspi_header(self.hff_path)
+            self.idents_binary_path = self._path(self.hff['in'])
+            nh = int(self.hff['n1'])
+            fmt = self.hff.get('hdrfmt1', 'xdr_int')
+            self.idents = np.memmap(self.idents_binary_path, mode='r',
+                                    dtype=_FORMATS[fmt],
+                                    shape=(self.n3, self.n2, nh))
+
+    def _path(self, name):
+        # binaries are named relative to the header file
+        return os.path.join(self.dirname, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Drop the memory maps. Views handed out stay valid until freed. """
+        self.data = None
+        self.idents = None
+
+    @property
+    def shape(self):
+        return self.n3, self.n2, self.n1
+
+    def track(self, i3):
+        """ Return track i3 as an (n2, n1) view. """
+        return self.data[i3]
+
+    def bin(self, i2):
+        """ Return bin i2 of every track as an (n3, n1) view. """
+        return self.data[:, i2]
+
+    def sample(self, i1):
+        """ Return sample i1 of every trace as an (n3, n2) view. """
+        return self.data[:, :, i1]
+
+    def trace(self, i3, i2):
+        """ Return a single trace as an (n1,) view. """
+        return self.data[i3, i2]
+
+    def ident_index(self, name, default=None):
+        """ Return the position of an ident from the hdrkey entries. """
+        if self.hff is not None:
+            for key, value in self.hff.items():
+                if key.startswith('hdrkey') and value == name:
+                    return int(key[len('hdrkey'):]) - 1
+        return default
+
+    def ident(self, name, default=None):
+        """ Return one ident for every trace as an (n3, n2) view. """
+        return self.idents[..., self.ident_index(name, default)]
+
+
+def compare_aaspi(header_a, header_b, atol=0.0):
+    """ Compare two AASPI volumes sample by sample and ident by ident.
+
+    Parameters
+    ----------
+    header_a, header_b: str
+        Paths to the .H headers.
+    atol: float
+        Absolute tolerance for the samples.
+
+    Returns
+    -------
+    list
+        Descriptions of the differences, empty if the volumes match.
+    """
+    diffs = []
+    with AaspiDataset(header_a) as a, AaspiDataset(header_b) as b:
+        for key in ('n1', 'n2', 'n3', 'o1', 'o2', 'o3', 'd1', 'd2', 'd3'):
+            if getattr(a, key) != getattr(b, key):
+                diffs.append(f'{key}: {getattr(a, key)} != {getattr(b, key)}')
+        if diffs:
+            return diffs
+
+        for i3 in range(a.n3):
+            if not np.allclose(a.track(i3), b.track(i3), rtol=0, atol=atol):
+                diffs.append(f'data differs in track {i3}')
+
+        if a.idents is not None and b.idents is not None:
+            names = [v for k, v in a.hff.items() if k.startswith('hdrkey')]
+            for name in names:
+                if b.ident_index(name) is None:
+                    diffs.append(f'ident {name} missing')
+                elif not np.array_equal(a.ident(name), b.ident(name)):
+                    diffs.append(f'ident {name} differs')
+    return diffs
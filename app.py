@@ -6,18 +6,133 @@
 
 import streamlit as st
 import SessionState
-from geoio import GeoIoVolume
 from utils import *
+from checksums import format_checksums
+from instrument import format_report, format_status
+from jobs import ACTIVE_STATES, DONE, FAILED, RUNNING, get_scheduler
+from metadata import aaspi_metadata, vt_metadata
+from browser import (AASPI, DEFAULT_BROWSE_DIR, VT, files_of, format_entry,
+                     list_directory)
+
+
+def browse(session_state, kind=None):
+    """
+    Browse the folders of the server in the sidebar, starting from the folder
+    of the session. kind is VT or AASPI to pick a file of that kind, None to
+    pick a folder. Returns the path picked with the Select button, None
+    otherwise. Listings come from the listing cache, so reruns do not scan
+    the folder again.
+    """
+    folder = st.sidebar.text_input('Folder', session_state.browse_dir)
+    if folder != session_state.browse_dir and os.path.isdir(folder):
+        session_state.browse_dir = os.path.abspath(folder)
+    try:
+        listing = list_directory(session_state.browse_dir)
+    except OSError as e:
+        st.sidebar.error("Cannot list %s: %s" % (session_state.browse_dir, e))
+        session_state.browse_dir = os.path.dirname(session_state.browse_dir)
+        return None
+
+    # keyed on the folder, so the choice starts over in every folder
+    sub = st.sidebar.selectbox('Open folder', ['.', '..'] + listing.dirs,
+                               format_func=lambda name: name + '/',
+                               key='open-%s' % listing.path)
+    if sub != '.':
+        session_state.browse_dir = os.path.normpath(
+            os.path.join(listing.path, sub))
+        listing = list_directory(session_state.browse_dir)
+        st.sidebar.text("Opened %s" % listing.path)
+
+    if kind is None:
+        if st.sidebar.button('Select this folder'):
+            return listing.path
+        return None
+    files = files_of(listing, kind)
+    if not files:
+        st.sidebar.write("No %s files here." % kind)
+        return None
+    f = st.sidebar.selectbox('File', files, format_func=format_entry,
+                             key='file-%s-%s' % (kind, listing.path))
+    if st.sidebar.button('Select'):
+        return f['path']
+    return None
+
+
+def browse_inputs(session_state, targets):
+    """
+    One browser for several inputs. targets maps a label to the
+    (session_state attribute, kind) the browser sets.
+    """
+    st.sidebar.header("**Browse**")
+    label = st.sidebar.radio("Select", list(targets))
+    attr, kind = targets[label]
+    path = browse(session_state, kind)
+    if path:
+        setattr(session_state, attr, path)
+
+
+def show_summary(metadata, path):
+    """
+    Show the summary of an input volume. metadata is vt_metadata or
+    aaspi_metadata, cached so reruns do not open the volume again.
+    """
+    if not path:
+        return
+    try:
+        summary = metadata(path).summary
+    except Exception as e:
+        st.error("Cannot read %s: %s" % (path, e))
+        return
+    st.text('\n'.join('%-16s %s' % item for item in summary.items()))
+
+
+def show_jobs(scheduler):
+    """
+    List the recent conversion jobs of all sessions with their progress, and
+    a cancel button for the queued and running ones. The page does not update
+    by itself, Refresh reruns it.
+    """
+    st.header("**Jobs:**")
+    st.button('Refresh')
+    jobs = scheduler.table.list(limit=20)
+    if not jobs:
+        st.write("No jobs yet.")
+    for job in jobs:
+        st.write("**#%d** %s %s: %s" % (job['id'],
+                                        job['entry']['operation'],
+                                        os.path.basename(str(job['name'])),
+                                        job['state']))
+        if job['state'] == RUNNING and job['total']:
+            st.progress(min(job['done'] / job['total'], 1.0))
+            if job['status']:
+                st.text('%d/%d, %s' % (job['done'], job['total'],
+                                       format_status(job['status'])))
+        elif job['state'] == DONE:
+            result = job['result']
+            st.text('%s, %.1f MB/s, %s' % (result['output'],
+                                           result['mb_per_s'],
+                                           format_report(result)))
+            if 'checksums' in result:
+                st.text(format_checksums(result['checksums']))
+        elif job['state'] == FAILED:
+            st.error(job['error'])
+        if job['state'] in ACTIVE_STATES and \
+                st.button('Cancel', key='cancel-%d' % job['id']):
+            scheduler.cancel(job['id'])
+            st.write("Cancelling job %d" % job['id'])
 
 
 def main():
     """
     This function is the main function for the seismic format conversion utility. 
-    It uses streamlit for the web interface. 
+    It uses streamlit for the web interface. Conversions are submitted to
+    the job scheduler, so they keep running across reruns of this script.
     """
+    scheduler = get_scheduler()
 
     session_state = SessionState.get(
-        inputvt='', inputaaspi='', outputpath='', horizontal_unit='', vertical_unit='')
+        inputvt='', inputaaspi='', outputpath='', horizontal_unit='', vertical_unit='',
+        browse_dir=DEFAULT_BROWSE_DIR)
 
     st.title("Seismic Format Conversion Utility")
     st.info("This is an utility to convert seismic data between vt and aaspi(.H) format!")
@@ -31,75 +146,56 @@ def main():
 
     if selection == 'vt to aaspi':
 
-        if st.sidebar.button('Selct VT File...'):
-            session_state.inputvt = select_vt()
         horizontal_unit = st.sidebar.selectbox(
             "Select the horizontal unit", ['m', 'ft'])
         vertical_unit = st.sidebar.selectbox(
             "Select the vertical unit", ['ms', 's', 'ft', 'm'])
+        incremental = st.sidebar.checkbox(
+            "Only rewrite the traces that changed since the last conversion "
+            "(writes the padded files directly instead of running pad3d)")
+        browse_inputs(session_state, {'VT file': ('inputvt', VT),
+                                      'Output folder': ('outputpath', None)})
         st.write("**The selected input vt is:**", session_state.inputvt)
 
-        st.sidebar.header("**Set Up Output**")
-        if st.sidebar.button('Selct Output Path...'):
-            session_state.outputpath = select_output()
-
         st.write("**The selected output path is:**", session_state.outputpath)
 
         st.write("**The horizon unit is :**", horizontal_unit)
         st.write("**The vertical unit is :**", vertical_unit)
 
-        if session_state.inputvt:
-            vt = GeoIoVolume(session_state.inputvt)
+        show_summary(vt_metadata, session_state.inputvt)
 
-            vt_params = set_vt_params(vt)
-            aaspi_params = set_aaspi_params(vt.get_filename(),
-                                       session_state.outputpath, horizontal_unit,
-                                         vertical_unit)
-        
-      
         if st.button('Convert from VT to AASPI'):
-            progress = st.progress(0)
-            status_text = st.empty()
-            write_aaspi_header(vt_params, aaspi_params)
-            write_aaspi_idents_header(vt_params, aaspi_params)
-            write_aaspi_binaries_from_vt(vt, vt_params, aaspi_params, progress, status_text)
-            status_text.text("Apply pad3d on the volume...")
-            run_pad3d(aaspi_params)
-            msg = {'Operation': 'VT to AASPI',
-                'VT Name': vt.get_filename(),
-                'VT Size': str(os.path.getsize(vt.get_filename())), 
-                'Survey Location': str(vt.get_survey().epsg_code())
-            }
-            track_usage(msg)
-            st.success("Successfully converted!")
+            entry = {'operation': 'vt2aaspi',
+                     'inputvt': session_state.inputvt,
+                     'outputpath': session_state.outputpath,
+                     'horizontal_unit': horizontal_unit,
+                     'vertical_unit': vertical_unit,
+                     'incremental': incremental}
+            if incremental:
+                # pad3d rewrites the output, see convert_vt_to_aaspi
+                entry['pad'] = 'native'
+            job_id = scheduler.submit(entry)
+            st.success("Submitted job %d" % job_id)
     else: 
-        if st.sidebar.button('Selct AASPI File...'):
-            session_state.inputaaspi = select_aaspi()
-
-        if st.sidebar.button('Selct VT File...'):
-            session_state.inputvt = select_vt()
-
-
+        browse_inputs(session_state, {'AASPI file': ('inputaaspi', AASPI),
+                                      'VT file': ('inputvt', VT),
+                                      'Output folder': ('outputpath', None)})
 
         st.write("**The selected input aaspi file is:**", session_state.inputaaspi)
+        show_summary(aaspi_metadata, session_state.inputaaspi)
         st.write("**The selected input vt file is:**", session_state.inputvt)
+        show_summary(vt_metadata, session_state.inputvt)
 
-        st.sidebar.header("**Set Up Output**")
-        if st.sidebar.button('Selct Output Path...'):
-            session_state.outputpath = select_output()
         st.write("**The selected output path is:**", session_state.outputpath)
 
         if st.button('Convert from AASPI to VT'):
-            progress = st.progress(0)
-            status_text = st.empty()
-            write_vt_data(session_state, progress, status_text)
-            inputvt = GeoIoVolume(session_state.inputvt)
-            msg = { 'Operation': 'AASPI to VT',
-                'VT Name': inputvt.get_filename(),
-                'Survey Location': str(inputvt.get_survey().epsg_code())
-            }
-            track_usage(msg)
-            st.success("Successfully converted!")
+            job_id = scheduler.submit({'operation': 'aaspi2vt',
+                                       'inputaaspi': session_state.inputaaspi,
+                                       'inputvt': session_state.inputvt,
+                                       'outputpath': session_state.outputpath})
+            st.success("Submitted job %d" % job_id)
+
+    show_jobs(scheduler)
 
     st.sidebar.title("About")
     st.sidebar.info(
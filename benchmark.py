@@ -0,0 +1,273 @@
+""" Benchmarks for the VT/AASPI conversion.
+
+Usage
+-----
+    python benchmark.py idents --ntrk 500 --nbin 500
+    python benchmark.py write --ntrk 200 --nbin 500 --nsmp 1000
+    python benchmark.py convert --sizes 100x200x500 200x400x1000 \
+        --layouts asc desc --json bench.json
+
+The convert benchmark runs both conversions on synthetic volumes from
+fakegeoio, so it needs neither geoio nor real data.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import fakegeoio
+from chunks import DEFAULT_MEMORY_BUDGET, DEFAULT_WRITE_SIZE, write_at
+from fakegeoio import AffineXform
+from idents import IdentEngine, snap_trunc
+
+# volume layouts for the convert benchmark, passed to fakegeoio.make_volume
+LAYOUTS = {
+    'asc': {},
+    'desc': dict(descending_tracks=True, descending_bins=True),
+    'desc-bins': dict(descending_bins=True),
+    'desc-tracks': dict(descending_tracks=True),
+    'swapped': dict(tracks_along_j=True, descending_bins=True),
+}
+
+def _bench_params(ntrk, nbin, nsmp=100):
+    class _P:
+        pass
+
+    vp, ap = _P(), _P()
+    vp.ftrk, vp.dtrk, vp.ntrk = 1000, 1, ntrk
+    vp.ltrk = vp.ftrk + vp.dtrk * (ntrk - 1)
+    vp.fbin, vp.dbin, vp.nbin, vp.negbin = 2000, 2, nbin, False
+    vp.lbin = vp.fbin + vp.dbin * (nbin - 1)
+    vp.nsmp, vp.dsmp, vp.fsmp = nsmp, 4.0, 0.0
+    vp.lsmp = vp.fsmp + vp.dsmp * (nsmp - 1)
+    vp.trk_dec, vp.bin_dec, vp.smp_dec = 1, 1, 1
+    vp.xform_ijk_tbt = AffineXform([[1, 0, 0, 1000], [0, 2, 0, 2000],
+                                     [0, 0, 4, 0]])
+    vp.xform_ijk_xyz = AffineXform([[12.5, 3.1, 0, 400000],
+                                     [-3.1, 12.5, 0, 6000000],
+                                     [0, 0, 4, 0]])
+    ap.idents = {"cdp_no": 0, "line_no": 1, "muts": 2, "mute": 3, "trid": 4,
+                 "laga": 5, "scalco": 6, "ns": 7, "dt": 8, "cdp_y": 9,
+                 "cdp_x": 10}
+    return vp, ap
+
+
+def bench_idents(ntrk, nbin):
+    """ Compare per-point ident computation with the vectorized engine. """
+    vp, ap = _bench_params(ntrk, nbin)
+    engine = IdentEngine(vp, ap)
+
+    tic = time.perf_counter()
+    per_point = engine._per_point(0, ntrk)
+    t_point = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    for t in range(ntrk):
+        engine.block_idents(t, t + 1)
+    t_track = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    idents = engine.volume_idents()
+    t_volume = time.perf_counter() - tic
+
+    tbt, xyz = per_point
+    for name, values in (("line_no", tbt[..., 0]), ("cdp_no", tbt[..., 1]),
+                         ("cdp_x", xyz[..., 0]), ("cdp_y", xyz[..., 1])):
+        assert np.array_equal(idents[..., ap.idents[name]],
+                              snap_trunc(values)), name
+    ntr = ntrk * nbin
+    print(f'idents {ntrk} x {nbin} = {ntr} traces')
+    for name, t in (('per point', t_point), ('per track', t_track),
+                    ('whole volume', t_volume)):
+        print(f'  {name:<13}: {t:8.3f} s {ntr / t:14.0f} traces/s '
+              f'{t_point / t:8.1f}x')
+
+
+def _write_copying(data, fname):
+    # the original per track chain: copy, flip, byteswap copy, tofile
+    with open(fname, 'wb') as f:
+        for trk in data:
+            dataslice = np.array(trk, dtype=np.float32)
+            np.flip(dataslice, axis=0).byteswap().tofile(f)
+
+
+def _write_in_place(data, fname, write_size):
+    # one reusable big endian buffer filled through a flipped view
+    buf = np.empty(data.shape[1:], dtype='>f4')
+    with open(fname, 'wb', buffering=0) as f:
+        for n, trk in enumerate(data):
+            buf[...] = trk[::-1]
+            write_at(f, n * buf.nbytes, buf, write_size)
+
+
+def bench_write(ntrk, nbin, nsmp, write_size=DEFAULT_WRITE_SIZE):
+    """ Compare the copying output chain with the in place big endian path.
+
+    Tracks are taken from memory and bins are reversed as for a negbin
+    volume, so only the conversion and write cost is measured.
+    """
+    data = np.random.default_rng(0).standard_normal(
+        (ntrk, nbin, nsmp)).astype(np.float32)
+    mb = data.nbytes / 1e6
+    print(f'write {ntrk} x {nbin} x {nsmp} = {mb:.1f} MB')
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, run in (('copying', lambda f: _write_copying(data, f)),
+                          ('in place', lambda f: _write_in_place(
+                              data, f, write_size))):
+            fname = os.path.join(tmp, name.replace(' ', '_'))
+            tracemalloc.start()
+            tic = time.perf_counter()
+            run(fname)
+            t = time.perf_counter() - tic
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(fname, 'rb') as f:
+                results[name] = f.read()
+            print(f'  {name:<9}: {t:8.3f} s {mb / t:9.1f} MB/s '
+                  f'peak {peak / 1e6:8.2f} MB')
+        assert results['copying'] == results['in place']
+
+
+def _import_convert():
+    # the conversion modules import GeoIoVolume from geoio, point them at the
+    # stand-in before they are imported
+    if 'convert' not in sys.modules:
+        sys.modules['geoio'] = fakegeoio
+    import convert
+    if convert.GeoIoVolume is not fakegeoio.GeoIoVolume:
+        raise RuntimeError('geoio was imported before the benchmark could '
+                           'replace it')
+    return convert
+
+
+def bench_convert(sizes, layouts=('asc',), memory_budget=DEFAULT_MEMORY_BUDGET,
+                  pipelined=False, write_size=DEFAULT_WRITE_SIZE, workdir=None,
+                  workers=1, read_order='auto', precision=None):
+    """ Time VT to AASPI and AASPI to VT on synthetic volumes.
+
+    Parameters
+    ----------
+    sizes: list
+        (ntrk, nbin, nsmp) of each volume.
+    layouts: list
+        Names from LAYOUTS.
+    memory_budget, pipelined, write_size, workers, read_order:
+        Passed to the conversions.
+    precision: int, optional
+        Bits per sample of the VT written back, see
+        convert.convert_aaspi_to_vt.
+    workdir: str, optional
+        Directory for the volumes, defaults to a temporary directory. Use a
+        directory on the filesystem of interest.
+
+    Returns
+    -------
+    list
+        One convert._summary dict per conversion, with the volume size and
+        layout added.
+    """
+    convert = _import_convert()
+    results = []
+    print(f'{"layout":<12} {"size":>18} {"direction":<12} {"MB":>9} '
+          f'{"s":>8} {"MB/s":>9} {"traces/s":>11}')
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for ntrk, nbin, nsmp in sizes:
+            for layout in layouts:
+                vt = os.path.join(tmp, f'{layout}_{ntrk}x{nbin}x{nsmp}.vt')
+                vol = fakegeoio.make_volume(vt, ntrk, nbin, nsmp,
+                                            **LAYOUTS[layout])
+                out = os.path.join(tmp, 'out')
+                os.makedirs(out, exist_ok=True)
+                # pad3d needs AASPI, time the streaming padding instead
+                v2a = convert.convert_vt_to_aaspi(
+                    vt, out, pad='native', memory_budget=memory_budget,
+                    workers=workers, pipelined=pipelined,
+                    write_size=write_size, read_order=read_order)
+                a2v = convert.convert_aaspi_to_vt(
+                    v2a['output'], vt, out, pipelined=pipelined,
+                    workers=workers, memory_budget=memory_budget,
+                    precision=precision)
+                # untimed check that the round trip is exact, or within the
+                # reported error of a quantized VT encoded as quantize.py
+                # assumes
+                back = fakegeoio.GeoIoVolume(a2v['output'])
+                if 'quantization' in a2v:
+                    error = np.abs(back.get_float(
+                        (0, 0, 0), np.array(back._data.shape) - 1) - vol._data)
+                    exact = error.max() <= a2v['quantization']['max_error']
+                else:
+                    exact = np.array_equal(back._data, vol._data)
+                if not exact:
+                    raise RuntimeError(f'{layout} {ntrk}x{nbin}x{nsmp} does '
+                                       'not round trip')
+                del back, vol
+                for direction, r in (('vt2aaspi', v2a), ('aaspi2vt', a2v)):
+                    r.update(layout=layout, size=[ntrk, nbin, nsmp])
+                    results.append(r)
+                    print(f'{layout:<12} {f"{ntrk}x{nbin}x{nsmp}":>18} '
+                          f'{direction:<12} {r["bytes"] / 1e6:>9.1f} '
+                          f'{r["seconds"]:>8.2f} {r["mb_per_s"]:>9.1f} '
+                          f'{r["traces_per_s"]:>11.0f}')
+                for name in os.listdir(tmp):
+                    if name != 'out':
+                        os.remove(os.path.join(tmp, name))
+                for name in os.listdir(out):
+                    os.remove(os.path.join(out, name))
+    return results
+
+
+def _size(text):
+    ntrk, nbin, nsmp = (int(n) for n in text.lower().split('x'))
+    return ntrk, nbin, nsmp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('idents', help='ident computation')
+    p.add_argument('--ntrk', type=int, default=200)
+    p.add_argument('--nbin', type=int, default=200)
+    p = sub.add_parser('write', help='big endian output path')
+    p.add_argument('--ntrk', type=int, default=100)
+    p.add_argument('--nbin', type=int, default=500)
+    p.add_argument('--nsmp', type=int, default=1000)
+    p.add_argument('--write-size', type=int, default=DEFAULT_WRITE_SIZE)
+    p = sub.add_parser('convert', help='both conversions on synthetic volumes')
+    p.add_argument('--sizes', type=_size, nargs='+', default=[(100, 200, 500)],
+                   help='NTRKxNBINxNSMP volume sizes')
+    p.add_argument('--layouts', nargs='+', default=['asc', 'desc'],
+                   choices=sorted(LAYOUTS))
+    p.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET)
+    p.add_argument('--write-size', type=int, default=DEFAULT_WRITE_SIZE)
+    p.add_argument('--pipelined', action='store_true')
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--read-order', default='auto',
+                   choices=['auto', 'tracks', 'bins'])
+    p.add_argument('--precision', type=int, choices=[8, 16, 32],
+                   help='bits per sample of the VT written back')
+    p.add_argument('--workdir', help='directory for the synthetic volumes')
+    p.add_argument('--json', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.bench == 'idents':
+        bench_idents(args.ntrk, args.nbin)
+    elif args.bench == 'write':
+        bench_write(args.ntrk, args.nbin, args.nsmp, args.write_size)
+    elif args.bench == 'convert':
+        results = bench_convert(args.sizes, args.layouts, args.memory_budget,
+                                args.pipelined, args.write_size, args.workdir,
+                                args.workers, args.read_order,
+                                args.precision)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
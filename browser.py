@@ -0,0 +1,127 @@
+""" Server side file browser for the web interface.
+
+The web interface runs on a server, so file dialogs would open on the display
+of the server, not in the browser of the user. Instead the app lists the
+directories of the server itself, one at a time as the user opens them.
+
+Listings are read with a single os.scandir pass and kept in a MetadataCache
+keyed on the modification time of the directory, which changes whenever a
+file is added, removed or renamed in it. Reruns of the app and other users
+get the cached listing without touching the filesystem again, so project
+directories on NFS with tens of thousands of files are only scanned when
+they change. File sizes are those of the last scan.
+"""
+import os
+
+from metadata import MetadataCache
+from utils import make_params
+
+VT = 'vt'
+AASPI = 'aaspi'
+
+# file kinds by suffix
+_KINDS = {'.vt': VT, '.H': AASPI}
+
+# files that belong to an AASPI header name.H: the data binary name.H@, the
+# idents header name.H@@ and the idents binary name.H@@@
+AASPI_SIBLINGS = ('@', '@@', '@@@')
+
+# directory the browser starts in
+DEFAULT_BROWSE_DIR = os.environ.get('VT_AASPI_BROWSE_DIR', os.getcwd())
+
+# directories kept in the listing cache
+DEFAULT_LISTING_CACHE_SIZE = 256
+
+
+def _sibling(name):
+    # (header name, suffix) if name is an AASPI sibling file, else None
+    header = name.rstrip('@')
+    suffix = name[len(header):]
+    if header.endswith('.H') and suffix in AASPI_SIBLINGS:
+        return header, suffix
+    return None
+
+
+def load_listing(path):
+    """ Scan a directory.
+
+    Returns a make_params object with path, dirs, the sorted names of the
+    subdirectories, and files, a sorted list of dicts with the name, path,
+    size and kind, VT, AASPI or None, of every file. AASPI siblings are not
+    listed on their own but under siblings, {suffix: size}, of their header,
+    with missing, the suffixes not found, and total_size. Hidden entries and
+    entries that cannot be read are left out.
+    """
+    path = os.path.abspath(path)
+    dirs, files, siblings = [], {}, {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                    continue
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            sibling = _sibling(entry.name)
+            if sibling is not None:
+                siblings.setdefault(sibling[0], {})[sibling[1]] = size
+                continue
+            kind = _KINDS.get(os.path.splitext(entry.name)[1])
+            files[entry.name] = {'name': entry.name,
+                                 'path': os.path.join(path, entry.name),
+                                 'size': size, 'kind': kind}
+
+    for header, found in siblings.items():
+        f = files.get(header)
+        if f is None:
+            # binaries without their header are plain files
+            for suffix, size in found.items():
+                files[header + suffix] = {'name': header + suffix,
+                                          'path': os.path.join(path, header + suffix),
+                                          'size': size, 'kind': None}
+            continue
+        f['siblings'] = found
+    for f in files.values():
+        if f['kind'] == AASPI:
+            found = f.setdefault('siblings', {})
+            f['missing'] = [s for s in AASPI_SIBLINGS if s not in found]
+            f['total_size'] = f['size'] + sum(found.values())
+
+    return make_params(path=path, dirs=sorted(dirs),
+                       files=[files[name] for name in sorted(files)])
+
+
+_listing_cache = MetadataCache(load_listing, DEFAULT_LISTING_CACHE_SIZE)
+
+
+def list_directory(path):
+    """ Cached load_listing, scanned again only when the directory changed. """
+    return _listing_cache.get(path)
+
+
+def files_of(listing, kind=None):
+    """ The files of a listing of kind, VT or AASPI, all files for None. """
+    return [f for f in listing.files if kind is None or f['kind'] == kind]
+
+
+def _size(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1000:
+            return '%.0f %s' % (n, unit) if unit == 'B' else '%.1f %s' % (n, unit)
+        n /= 1000.
+    return '%.1f TB' % n
+
+
+def format_entry(f):
+    """ One line description of a file of a listing. """
+    if f['kind'] != AASPI:
+        return '%s  (%s)' % (f['name'], _size(f['size']))
+    text = '%s  (%s with %s)' % (f['name'], _size(f['total_size']),
+                                 ' '.join(sorted(f['siblings'], key=len)) or
+                                 'no binaries')
+    if f['missing']:
+        text += ', missing ' + ' '.join(f['missing'])
+    return text
@@ -0,0 +1,169 @@
+""" Per trace checksums of AASPI outputs for incremental conversions.
+
+A VT regenerated with a small edit, such as a reprocessed window, only
+changes some of the traces of its AASPI output. An incremental conversion
+keeps the CRC32 of every trace of the data binary next to it and, on the
+next conversion of the VT, compares the checksum of every trace read with
+the stored one. Only the traces that changed are written.
+
+The checksums are only trusted while the binaries are those they were
+computed for: the grid of the conversion must be the same and the size and
+modification time of every binary must be those recorded when the checksums
+were saved. Anything else falls back to a full conversion.
+"""
+import json
+import os
+import zlib
+
+import numpy as np
+
+CHECKSUM_SUFFIX = '.checksums'
+
+
+def trace_checksums(traces):
+    """ (ntr, nb) uint32 CRC32 of the big endian float32 samples of every
+    trace of a (ntr, nb, ns) array, the checksum of the trace in an AASPI
+    binary. """
+    traces = np.ascontiguousarray(traces, dtype='>f4')
+    sums = np.empty(traces.shape[:2], dtype=np.uint32)
+    flat = sums.reshape(-1)
+    for n, trace in enumerate(traces.reshape(flat.size, -1)):
+        flat[n] = zlib.crc32(trace)
+    return sums
+
+
+def true_runs(mask):
+    """ (start, stop) of every run of True in a 1d bool array. """
+    edges = np.flatnonzero(np.diff(np.concatenate(
+        ([False], mask, [False])).view(np.int8)))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _stamps(paths):
+    # size and modification time of every output, None if one is missing
+    try:
+        return {os.path.basename(path): [os.stat(path).st_size,
+                                         os.stat(path).st_mtime_ns]
+                for path in paths}
+    except OSError:
+        return None
+
+
+class TraceChecksums:
+    """ Checksums of every trace of an AASPI data binary.
+
+    Parameters
+    ----------
+    path: str
+        Path of the checksum file, usually the binary name plus
+        CHECKSUM_SUFFIX. None for the checksums of a worker process, which
+        are merged into those of the parent.
+    meta: dict
+        Description of the output grid. Stored checksums are only used with
+        the same meta.
+    shape: tuple
+        (ntrk, nbin) of the output.
+
+    Attributes
+    ----------
+    old: ndarray or None
+        (ntrk, nbin) checksums of the traces in the binary, see load. None
+        writes every trace.
+    sums: ndarray
+        (ntrk, nbin) checksums of the traces of this conversion.
+    hashed, rewritten, skipped: int
+        Traces checksummed, written and left as they were.
+    saved: bool
+        Whether save stored the checksums.
+    """
+
+    def __init__(self, path, meta, shape):
+        self.path = path
+        self.meta = meta
+        self.old = None
+        self.sums = np.zeros(shape, dtype=np.uint32)
+        self.hashed = 0
+        self.rewritten = 0
+        self.skipped = 0
+        self.saved = False
+
+    def load(self, outputs):
+        """ Load the stored checksums if they describe the binaries outputs.
+
+        Returns True if they do, the conversion then only writes the traces
+        whose checksum changed.
+        """
+        try:
+            with np.load(self.path) as f:
+                meta = json.loads(str(f['meta']))
+                sums = f['sums']
+        except (OSError, ValueError, KeyError):
+            return False
+        stamps = meta.pop('outputs', None)
+        if meta != json.loads(json.dumps(self.meta)) or \
+                sums.shape != self.sums.shape or stamps != _stamps(outputs):
+            return False
+        self.old = sums
+        return True
+
+    def update(self, t0, t1, b0, b1, data):
+        """ Checksum the (t1 - t0, b1 - b0, nsmp) traces of a chunk.
+
+        Returns the (t1 - t0, b1 - b0) mask of the traces to write, None to
+        write all of them.
+        """
+        sums = trace_checksums(data)
+        self.sums[t0:t1, b0:b1] = sums
+        self.hashed += sums.size
+        if self.old is None:
+            self.rewritten += sums.size
+            return None
+        changed = sums != self.old[t0:t1, b0:b1]
+        n = int(np.count_nonzero(changed))
+        self.rewritten += n
+        self.skipped += sums.size - n
+        return changed
+
+    def merge(self, region, sums, rewritten, skipped):
+        """ Add the checksums of a region of the output, an index of sums,
+        from a worker process. """
+        self.sums[region] = sums
+        self.hashed += sums.size
+        self.rewritten += rewritten
+        self.skipped += skipped
+
+    def save(self, outputs):
+        """ Store the checksums with the size and modification time of the
+        binaries outputs, once every trace has been checksummed.
+
+        Returns False, storing nothing, if only part of the traces were, as
+        in a resumed conversion.
+        """
+        if self.hashed < self.sums.size:
+            return False
+        meta = dict(self.meta, outputs=_stamps(outputs))
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), sums=self.sums)
+        os.replace(tmp, self.path)
+        self.saved = True
+        return True
+
+    def report(self, nsmp):
+        """ JSON serializable summary of the traces and bytes rewritten and
+        skipped. """
+        return {'incremental': self.old is not None, 'saved': self.saved,
+                'rewritten': self.rewritten, 'skipped': self.skipped,
+                'bytes_rewritten': 4 * nsmp * self.rewritten,
+                'bytes_skipped': 4 * nsmp * self.skipped}
+
+
+def format_checksums(report):
+    """ One line summary of a TraceChecksums report. """
+    kept = ', checksums kept' if report['saved'] else ''
+    if not report['incremental']:
+        return f'full conversion of {report["rewritten"]} traces{kept}'
+    return f'{report["rewritten"]} traces rewritten ' \
+        f'({report["bytes_rewritten"] / 1e6:.1f} MB), ' \
+        f'{report["skipped"]} unchanged ' \
+        f'({report["bytes_skipped"] / 1e6:.1f} MB skipped){kept}'
@@ -0,0 +1,271 @@
+import numpy as np
+
+# default memory budget for one get_float read
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# size of a single write call to the AASPI binaries
+DEFAULT_WRITE_SIZE = 4 * 1024 ** 2
+
+# copies of a chunk held at once - the get_float result and the big endian
+# copy written to disk
+_COPIES = 2
+
+# orders in which a VT can be read, see TrackLayout.read_order
+READ_ORDERS = ('tracks', 'bins')
+
+
+class TrackLayout:
+    """ Map output (track, bin) positions to VT ijk indices.
+
+    Output position t is the t'th track in ascending track order and b the
+    b'th bin in ascending bin order, which is the order of the AASPI files.
+    The VT may store tracks along i or j and in either direction. Decimated
+    output (see utils.set_roi) steps over more than one VT track, bin or
+    sample.
+    """
+
+    def __init__(self, vt_params):
+        vp = vt_params
+        self.vp = vp
+        xform_ijk_tbt = vp.xform_ijk_tbt
+        # output order is always ascending so start from the smallest bin
+        self.bin0 = vp.lbin if vp.negbin else vp.fbin
+
+        def ijk(t, b, s=0):
+            trk, bin_ = vp.ftrk + t * vp.dtrk, self.bin0 + b * vp.dbin
+            return np.rint(xform_ijk_tbt.from_target(
+                (trk, bin_, vp.fsmp + s * vp.dsmp))).astype(np.int64)
+
+        self.origin = ijk(0, 0)
+        dtrk = ijk(1, 0) - self.origin if vp.ntrk > 1 else None
+        dbin = ijk(0, 1) - self.origin if vp.nbin > 1 else None
+        self.smp_stride = int(ijk(0, 0, 1)[2] - self.origin[2]) \
+            if vp.nsmp > 1 else 1
+
+        # one of i or j is the track direction, the other the bin direction
+        if dtrk is not None:
+            self.trk_axis = int(np.argmax(np.abs(dtrk[:2])))
+        elif dbin is not None:
+            self.trk_axis = 1 - int(np.argmax(np.abs(dbin[:2])))
+        else:
+            self.trk_axis = 0
+        self.bin_axis = 1 - self.trk_axis
+        self.trk_step = -1 if dtrk is not None and dtrk[self.trk_axis] < 0 \
+            else 1
+        self.bin_step = -1 if dbin is not None and dbin[self.bin_axis] < 0 \
+            else 1
+        # VT indices per output track and bin, more than one when decimated
+        self.trk_stride = abs(int(dtrk[self.trk_axis])) \
+            if dtrk is not None else 1
+        self.bin_stride = abs(int(dbin[self.bin_axis])) \
+            if dbin is not None else 1
+        self.decimated = (self.trk_stride, self.bin_stride,
+                          self.smp_stride) != (1, 1, 1)
+
+    @property
+    def read_order(self):
+        """ The cheap read order for the storage of the VT.
+
+        VT data is stored with i slowest and k fastest, so whole tracks are
+        sequential reads when tracks run along i. When they run along j, a
+        crossline sorted volume, a track is a strided read across the whole
+        file and the volume is read in bin slabs instead, see
+        plan_bin_chunks. geoio does not expose any brick size, so only the
+        axis order is taken into account.
+        """
+        return 'tracks' if self.trk_axis == 0 else 'bins'
+
+    def box(self, t0, t1, b0, b1):
+        """ Return the (bijk, eijk) corners for a get_float call. """
+        bijk, eijk = [0, 0, 0], [0, 0, 0]
+        for axis, step, lo, hi in (
+                (self.trk_axis, self.trk_step * self.trk_stride, t0, t1),
+                (self.bin_axis, self.bin_step * self.bin_stride, b0, b1)):
+            ends = (self.origin[axis] + step * lo,
+                    self.origin[axis] + step * (hi - 1))
+            bijk[axis], eijk[axis] = int(min(ends)), int(max(ends))
+        bijk[2] = int(self.origin[2])
+        eijk[2] = bijk[2] + self.smp_stride * (self.vp.nsmp - 1)
+        return tuple(bijk), tuple(eijk)
+
+    def to_output(self, data, t0, t1, b0, b1):
+        """ Return a get_float result as a (track, bin, sample) view.
+
+        Tracks and bins are put in ascending order, flipping bins for negbin
+        volumes and tracks for descending track volumes, and decimated
+        traces and samples are skipped. No data is copied, the dtype is left
+        to the assignment into the output buffer.
+        """
+        shape = [0, 0, self.smp_stride * (self.vp.nsmp - 1) + 1]
+        shape[self.trk_axis] = self.trk_stride * (t1 - t0 - 1) + 1
+        shape[self.bin_axis] = self.bin_stride * (b1 - b0 - 1) + 1
+        block = np.asarray(data).reshape(shape)
+        block = block.transpose((self.trk_axis, self.bin_axis, 2))
+        return block[::self.trk_step * self.trk_stride,
+                     ::self.bin_step * self.bin_stride, ::self.smp_stride]
+
+
+def plan_chunks(vt_params, memory_budget=DEFAULT_MEMORY_BUDGET, t_start=0,
+                t_stop=None):
+    """ Split the volume into get_float reads that fit a memory budget.
+
+    Whole tracks are grouped while they fit in the budget. A track that does
+    not fit on its own is split into bin sub-ranges. Chunks are returned in
+    output order i.e. samples fastest, then bins, then tracks, so writing them
+    one after the other gives the AASPI layout.
+
+    Parameters
+    ----------
+    vt_params: _Params
+        Output of set_vt_params.
+    memory_budget: int
+        Upper bound in bytes for the data held for one chunk.
+    t_start, t_stop: int, optional
+        Only plan output tracks t_start..t_stop-1. Defaults to all tracks.
+
+    Returns
+    -------
+    generator
+        (t0, t1, b0, b1) output track and bin ranges, end exclusive.
+    """
+    vp = vt_params
+    t_stop = vp.ntrk if t_stop is None else t_stop
+    # a decimated read also holds the skipped traces and samples
+    skipped = vp.trk_dec * vp.bin_dec * vp.smp_dec - 1
+    trace_bytes = (_COPIES + skipped) * np.dtype(np.float32).itemsize * vp.nsmp
+    max_traces = max(int(memory_budget) // trace_bytes, 1)
+
+    if max_traces >= vp.nbin:
+        ntrk = max_traces // vp.nbin
+        for t0 in range(t_start, t_stop, ntrk):
+            yield t0, min(t0 + ntrk, t_stop), 0, vp.nbin
+    else:
+        for t in range(t_start, t_stop):
+            for b0 in range(0, vp.nbin, max_traces):
+                yield t, t + 1, b0, min(b0 + max_traces, vp.nbin)
+
+
+def plan_bin_chunks(vt_params, memory_budget=DEFAULT_MEMORY_BUDGET, b_start=0,
+                    b_stop=None):
+    """ Split the volume into bin slab get_float reads that fit a memory
+    budget, the counterpart of plan_chunks for read_order 'bins'.
+
+    Whole bins of every track are grouped while they fit in the budget. A bin
+    that does not fit on its own is split into track sub-ranges. Chunks are
+    returned in ascending bin order, each track of a chunk is a contiguous
+    run of the AASPI layout.
+
+    Returns
+    -------
+    generator
+        (t0, t1, b0, b1) output track and bin ranges, end exclusive.
+    """
+    vp = vt_params
+    b_stop = vp.nbin if b_stop is None else b_stop
+    skipped = vp.trk_dec * vp.bin_dec * vp.smp_dec - 1
+    trace_bytes = (_COPIES + skipped) * np.dtype(np.float32).itemsize * vp.nsmp
+    max_traces = max(int(memory_budget) // trace_bytes, 1)
+
+    if max_traces >= vp.ntrk:
+        nbin = max_traces // vp.ntrk
+        for b0 in range(b_start, b_stop, nbin):
+            yield 0, vp.ntrk, b0, min(b0 + nbin, b_stop)
+    else:
+        for b in range(b_start, b_stop):
+            for t0 in range(0, vp.ntrk, max_traces):
+                yield t0, min(t0 + max_traces, vp.ntrk), b, b + 1
+
+
+def write_at(f, offset, array, write_size=DEFAULT_WRITE_SIZE):
+    """ Write a contiguous array at a byte offset of an unbuffered file.
+
+    The array is written in pieces of write_size bytes aligned to multiples of
+    write_size in the file, straight from the array memory.
+    """
+    view = memoryview(array).cast('B')
+    f.seek(offset)
+    pos, end = 0, len(view)
+    while pos < end:
+        n = min(write_size - (offset + pos) % write_size, end - pos)
+        written = f.write(view[pos:pos + n])
+        pos += n if written is None else written
+
+
+def track_plane(ij):
+    """ Describe where the traces of one AASPI track land in the VT.
+
+    Parameters
+    ----------
+    ij: ndarray
+        (n2, 2) VT (i, j) of each trace of the track.
+
+    Returns
+    -------
+    tuple or None
+        (axis, fixed, start, step) if the traces form a contiguous run along
+        ijk axis `axis`, starting at `start` and moving by `step` (+1 or -1),
+        with the other axis fixed at `fixed`. None for irregular tracks.
+    """
+    n = len(ij)
+    for axis in (1, 0):
+        other = 1 - axis
+        if not (ij[:, other] == ij[0, other]).all():
+            continue
+        step = int(ij[1, axis] - ij[0, axis]) if n > 1 else 1
+        if step in (1, -1) and \
+                (ij[:, axis] == ij[0, axis] + step * np.arange(n)).all():
+            return axis, int(ij[0, other]), int(ij[0, axis]), step
+    return None
+
+
+def plan_put_blocks(planes, n2, n1, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Group consecutive AASPI tracks into blocks of adjacent VT planes.
+
+    Parameters
+    ----------
+    planes: list
+        track_plane result for every AASPI track.
+    n2, n1: int
+        Number of bins and samples per AASPI track.
+    memory_budget: int
+        Upper bound in bytes for one block.
+
+    Returns
+    -------
+    generator
+        (i0, i1, plane, track_step) AASPI track ranges, end exclusive. plane
+        is None for an irregular track, which is always alone in its block.
+    """
+    max_tracks = max(int(memory_budget) // (_COPIES * 4 * n1 * n2), 1)
+    i3, n3 = 0, len(planes)
+    while i3 < n3:
+        plane = planes[i3]
+        i1, step = i3 + 1, 1
+        if plane is not None and i1 < n3 and planes[i1] is not None:
+            step = planes[i1][1] - plane[1]
+        if plane is not None and step in (1, -1):
+            while i1 < n3 and i1 - i3 < max_tracks and \
+                    planes[i1] is not None and \
+                    planes[i1][0::2] == plane[0::2] and \
+                    planes[i1][3] == plane[3] and \
+                    planes[i1][1] == plane[1] + step * (i1 - i3):
+                i1 += 1
+        yield i3, i1, plane, step
+        i3 = i1
+
+
+def to_vt_block(data, plane, track_step):
+    """ Orient a (track, bin, sample) block for a single VT put.
+
+    Returns the (ni, nj, nk) block and its (i0, j0) origin.
+    """
+    axis, fixed, start, step = plane
+    ntr, nb = data.shape[:2]
+    block = data[::track_step, ::step]
+    origin = [0, 0]
+    origin[1 - axis] = min(fixed, fixed + track_step * (ntr - 1))
+    origin[axis] = min(start, start + step * (nb - 1))
+    if axis == 0:
+        # bins run along i, tracks along j
+        block = block.transpose((1, 0, 2))
+    return block, origin[0], origin[1]
@@ -0,0 +1,630 @@
+""" Convert seismic volumes between VT and AASPI without the web interface.
+
+Usage
+-----
+    python convert.py vt2aaspi input.vt output_dir --horizontal-unit m
+    python convert.py aaspi2vt input.H survey.vt output_dir
+    python convert.py aaspi2vt input.H survey.vt output_dir --precision 8
+    python convert.py batch manifest.json
+    python convert.py attributes output_dir coherence.vt curvature.vt
+    python convert.py validate-pad small.vt workdir
+    python convert.py --workers 8 verify input.vt output_dir/input.H
+    python convert.py --resume vt2aaspi input.vt output_dir
+    python convert.py --incremental --pad native vt2aaspi input.vt output_dir
+    python convert.py vt2aaspi input.vt output_dir --tracks 1000 1400 \
+        --samples 1000 2000 --decimate 1 1 2
+
+The manifest is a JSON list with one entry per volume, using the same names
+as the web interface, e.g.
+
+    [{"operation": "vt2aaspi", "inputvt": "a.vt", "outputpath": "out",
+      "horizontal_unit": "m", "vertical_unit": "ms"},
+     {"operation": "aaspi2vt", "inputaaspi": "b.H", "inputvt": "a.vt",
+      "outputpath": "out", "samples": [1000, 2000]}]
+
+Every conversion keeps a journal of the tracks written next to its output.
+With --resume an interrupted conversion continues from the journal instead of
+starting over. With --incremental the checksum of every trace is kept too,
+and converting the VT again only rewrites the traces that changed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from geoio import GeoIoVolume
+from aaspi import AaspiDataset, compare_aaspi
+from chunks import DEFAULT_MEMORY_BUDGET, DEFAULT_WRITE_SIZE, READ_ORDERS
+from checksums import format_checksums
+from geometry import format_geometry
+from quantize import PRECISIONS, SCALES, format_quantization
+from stats import AmplitudeStats
+from instrument import Progress, StageTimer, format_report, format_status
+from parallel import write_aaspi_binaries_parallel
+from verify import DEFAULT_MAX_MISMATCHES, format_verify, verify_conversion
+from utils import (aaspi_checksums, aaspi_journal_path, aaspi_names,
+                   aaspi_window, grid_differences, link_idents, run_pad3d,
+                   set_aaspi_params, set_roi, set_vt_params,
+                   write_aaspi_binaries_from_vt, write_aaspi_header,
+                   write_aaspi_idents_header, write_vt_data)
+
+# padding of AASPI outputs, see convert_vt_to_aaspi. Stays pad3d until
+# validate-pad has been run on real volumes and its result recorded, only
+# then can the native padding become the default
+DEFAULT_PAD = 'pad3d'
+
+
+def convert_vt_to_aaspi(inputvt, outputpath, horizontal_unit='m',
+                        vertical_unit='ms', callback=None, pad=DEFAULT_PAD,
+                        memory_budget=DEFAULT_MEMORY_BUDGET, workers=1,
+                        pipelined=False, write_size=DEFAULT_WRITE_SIZE,
+                        resume=False, tracks=None, bins=None, samples=None,
+                        decimation=None, read_order='auto', idents_from=None,
+                        incremental=False, keep_idents=False):
+    """ Convert a VT volume to AASPI format.
+
+    Parameters
+    ----------
+    inputvt: str
+        Path of the VT volume.
+    outputpath: str
+        Directory for the AASPI files.
+    horizontal_unit, vertical_unit: str
+        Units written to the padded header or passed to pad3d.
+    callback: callable, optional
+        Called as callback(done, total, status) with the number of tracks
+        written, throttled and with the rate and ETA in status, see
+        instrument.Progress.
+    pad: str
+        'pad3d' writes the _nopad files and runs the external pad3d on them,
+        'native' writes the final padded files directly while streaming,
+        'none' keeps the _nopad files. Defaults to DEFAULT_PAD.
+    memory_budget: int
+        Upper bound in bytes for one VT read.
+    workers: int
+        Number of worker processes. 1 converts in this process.
+    pipelined: bool
+        Overlap VT reads with AASPI writes in separate threads.
+    write_size: int
+        Size in bytes of a single write to the AASPI binaries.
+    resume: bool
+        Continue an interrupted conversion into outputpath from its journal.
+    tracks, bins, samples: tuple, optional
+        (first, last) track numbers, bin numbers and times or depths to
+        convert, inclusive. Defaults to the whole volume.
+    decimation: tuple, optional
+        Keep every n'th (track, bin, sample).
+    read_order: str
+        Read the VT by 'tracks' or by 'bins'. 'auto' picks the sequential
+        order for the storage of the VT, see chunks.TrackLayout.read_order.
+    idents_from: str, optional
+        Idents binary of a volume of the same survey and region, linked
+        instead of computing and writing the idents again, see
+        convert_vt_batch.
+    incremental: bool
+        Keep the checksum of every trace next to the output, and only write
+        the traces whose checksum changed since the last incremental
+        conversion into outputpath, see checksums.TraceChecksums. Not with
+        pad='pad3d', which rewrites the output.
+    keep_idents: bool
+        With pad='pad3d', keep the _nopad idents binary pad3d otherwise
+        removes, for the other volumes of convert_vt_batch to link.
+
+    Returns
+    -------
+    dict
+        Summary of the conversion, see _summary, with the traces rewritten
+        and skipped under 'checksums' for an incremental conversion.
+    """
+    tic = time.perf_counter()
+    timer = StageTimer()
+    with timer.time('header'):
+        vt = GeoIoVolume(inputvt)
+        vt_params = set_vt_params(vt)
+    if tracks or bins or samples or decimation:
+        vt_params = set_roi(vt_params, tracks, bins, samples, decimation)
+    vp = vt_params
+    if callback is not None:
+        callback = Progress(callback, 4 * vp.nbin * vp.nsmp)
+    aaspi_params = set_aaspi_params(vt.get_filename(), outputpath,
+                                    horizontal_unit, vertical_unit)
+    pad = {True: 'native', False: 'none'}.get(pad, pad)
+    if pad not in ('native', 'pad3d', 'none'):
+        raise ValueError(f'Unknown pad mode: {pad}')
+    padded = pad == 'native'
+    write_idents = idents_from is None
+    checksums = None
+    if incremental:
+        if pad == 'pad3d':
+            raise ValueError('Incremental conversions need pad native or '
+                             'none, pad3d rewrites the output')
+        checksums = aaspi_checksums(vt_params, aaspi_params, padded)
+
+    if workers > 1:
+        times, stats = write_aaspi_binaries_parallel(
+            vt, vt_params, aaspi_params, workers, callback, memory_budget,
+            pipelined, write_size, padded, resume, timer, read_order,
+            write_idents, checksums)
+    else:
+        times, stats = write_aaspi_binaries_from_vt(
+            vt, vt_params, aaspi_params, callback, memory_budget, pipelined,
+            write_size, padded, resume, timer, read_order, write_idents,
+            checksums)
+    if not write_idents:
+        with timer.time('file_write'):
+            link_idents(idents_from, aaspi_params, padded)
+    # headers last so they carry the amplitude range of the data
+    write_aaspi_header(vt_params, aaspi_params, padded, stats)
+    write_aaspi_idents_header(vt_params, aaspi_params, padded)
+    os.remove(aaspi_journal_path(aaspi_params, padded))
+    if pad == 'pad3d':
+        with timer.time('pad3d'):
+            run_pad3d(aaspi_params, keep_idents)
+    output = aaspi_names(aaspi_params, pad != 'none')[0]
+
+    summary = _summary('vt to aaspi', inputvt, os.path.join(outputpath, output),
+                       vp.ntrk * vp.nbin, vp.nsmp,
+                       time.perf_counter() - tic, times, timer, stats)
+    if checksums is not None:
+        summary['checksums'] = checksums.report(vp.nsmp)
+    return summary
+
+
+def convert_vt_batch(inputvts, outputpath, horizontal_unit='m',
+                     vertical_unit='ms', callback=None, pad=DEFAULT_PAD,
+                     memory_budget=DEFAULT_MEMORY_BUDGET, workers=1,
+                     pipelined=False, write_size=DEFAULT_WRITE_SIZE,
+                     resume=False, tracks=None, bins=None, samples=None,
+                     decimation=None, read_order='auto', incremental=False):
+    """ Convert VT volumes of one survey, e.g. the attributes of a seismic
+    volume, to AASPI format.
+
+    The grids and survey transforms of all volumes are checked to be the same
+    first. The idents are then computed and written with the first volume
+    only, the other volumes link its idents binary, see utils.link_idents,
+    so each further volume costs a single stream of its data. The volumes are
+    read one after the other, each sequentially. With pad='pad3d' the
+    volumes share the _nopad idents binary, kept until every volume has been
+    padded, and pad3d still pads each volume.
+
+    Parameters are those of convert_vt_to_aaspi, callback gets the progress
+    of each volume in turn.
+
+    Returns
+    -------
+    list
+        One convert_vt_to_aaspi summary per volume.
+
+    Raises
+    ------
+    ValueError
+        If the volumes do not share one grid.
+    """
+    grids = []
+    for inputvt in inputvts:
+        vp = set_vt_params(GeoIoVolume(inputvt))
+        if tracks or bins or samples or decimation:
+            vp = set_roi(vp, tracks, bins, samples, decimation)
+        grids.append(vp)
+    for inputvt, vp in zip(inputvts[1:], grids[1:]):
+        diffs = grid_differences(grids[0], vp)
+        if diffs:
+            raise ValueError(f'{inputvt} is not on the grid of {inputvts[0]}: '
+                             + ', '.join(diffs))
+
+    results = []
+    idents_from = None
+    # pad3d removes the _nopad idents of a volume once padded, those of the
+    # first are kept for the others to link
+    keep = pad == 'pad3d' and len(inputvts) > 1
+    try:
+        for inputvt in inputvts:
+            results.append(convert_vt_to_aaspi(
+                inputvt, outputpath, horizontal_unit, vertical_unit, callback,
+                pad, memory_budget, workers, pipelined, write_size, resume,
+                tracks, bins, samples, decimation, read_order, idents_from,
+                incremental, keep and idents_from is None))
+            if idents_from is None:
+                first = set_aaspi_params(inputvt, outputpath, horizontal_unit,
+                                         vertical_unit)
+                idents_from = os.path.join(
+                    outputpath, aaspi_names(first, pad == 'native')[3])
+    finally:
+        # unless pad3d failed on the first volume, which leaves its _nopad
+        # header for pad3d to be run again
+        if keep and idents_from is not None and not os.path.exists(
+                os.path.join(outputpath, first.nopad_header_name)):
+            os.remove(idents_from)
+    return results
+
+
+def convert_aaspi_to_vt(inputaaspi, inputvt, outputpath, callback=None,
+                        pipelined=False, resume=False, tracks=None, bins=None,
+                        samples=None, workers=1,
+                        memory_budget=DEFAULT_MEMORY_BUDGET, precision=None,
+                        scale='range', block_put=False):
+    """ Convert an AASPI volume to VT format.
+
+    Parameters
+    ----------
+    inputaaspi: str
+        Path of the AASPI .H header.
+    inputvt: str
+        VT volume supplying the header and survey of the output.
+    outputpath: str
+        Directory for the output VT.
+    callback: callable, optional
+        Called as callback(done, total, status) with the number of tracks
+        written, see convert_vt_to_aaspi.
+    pipelined: bool
+        Overlap AASPI decoding with VT writes in separate threads.
+    resume: bool
+        Continue an interrupted conversion into outputpath from its journal.
+        Raises ValueError if the output VT cannot be journaled, see
+        utils.vt_resumable.
+    tracks, bins, samples: tuple, optional
+        (first, last) track numbers, bin numbers and times or depths to
+        write into the VT, inclusive. Defaults to the whole AASPI volume.
+    workers: int
+        Number of processes decoding the AASPI data. 1 converts in this
+        process. The VT is only ever written by this process.
+    memory_budget: int
+        Upper bound in bytes for the decoded blocks held at once.
+    precision: int, optional
+        Bits per VT sample, 32 for float or 8 and 16 for a quantized VT.
+        Defaults to the sample size of inputvt.
+    scale: str
+        Quantize over the amplitude 'range' of the data or between its
+        'clip' values, see quantize.quantization_range.
+    block_put: bool
+        Put runs of VT planes with a single put instead of one trace at a
+        time. geoio does not document block puts, the first block is read
+        back to check it, see utils.put_block.
+
+    Returns
+    -------
+    dict
+        Summary of the conversion, see _summary, with the geometry report of
+        write_vt_data under 'geometry' and the error of a quantized VT under
+        'quantization'.
+    """
+    tic = time.perf_counter()
+    timer = StageTimer()
+    with timer.time('header'), AaspiDataset(inputaaspi) as aaspi:
+        window = aaspi_window(aaspi, tracks, bins, samples)
+    (t0, t1), (b0, b1), (s0, s1) = window
+    if callback is not None:
+        callback = Progress(callback, 4 * (b1 - b0) * (s1 - s0))
+    stats = AmplitudeStats()
+    report = {}
+    output, times = write_vt_data(inputaaspi, inputvt, outputpath, callback,
+                                  pipelined, resume, tracks, bins, samples,
+                                  timer, stats, report, workers,
+                                  memory_budget, precision, scale, block_put)
+    summary = _summary('aaspi to vt', inputaaspi, output, (t1 - t0) * (b1 - b0),
+                       s1 - s0, time.perf_counter() - tic, times, timer, stats)
+    summary.update(report)
+    return summary
+
+
+def validate_padding(inputvt, workdir, horizontal_unit='m',
+                     vertical_unit='ms'):
+    """ Compare the native padding stage with pad3d on one VT.
+
+    The VT is converted twice under workdir, into native/ and pad3d/. Needs
+    AASPIHOME to point at an AASPI install. Use a small volume.
+
+    Returns
+    -------
+    list
+        Differences found by aaspi.compare_aaspi, empty if they match.
+    """
+    headers = []
+    for pad in ('native', 'pad3d'):
+        outputpath = os.path.join(workdir, pad)
+        os.makedirs(outputpath, exist_ok=True)
+        result = convert_vt_to_aaspi(inputvt, outputpath, horizontal_unit,
+                                     vertical_unit, pad=pad)
+        headers.append(result['output'])
+    return compare_aaspi(*headers)
+
+
+def _summary(operation, input_name, output_name, ntraces, nsamples, seconds,
+             pipeline=None, timer=None, stats=None):
+    # stages, groups and bound come from StageTimer.report, amplitude from
+    # AmplitudeStats.report
+    nbytes = 4 * ntraces * nsamples
+    seconds = max(seconds, 1e-9)
+    summary = {'operation': operation, 'input': input_name,
+               'output': output_name, 'traces': ntraces, 'bytes': nbytes,
+               'seconds': seconds, 'mb_per_s': nbytes / seconds / 1e6,
+               'traces_per_s': ntraces / seconds, 'pipeline': pipeline or {}}
+    summary.update((timer or StageTimer()).report())
+    summary['amplitude'] = (stats or AmplitudeStats()).report()
+    return summary
+
+
+def print_progress(name, stream=sys.stderr):
+    """ Return a progress callback printing the percentage, rate and ETA. """
+
+    def callback(done, total, status):
+        percent = int(100 * done / total) if total else 100
+        stream.write(f'\r{name}: {percent:3d}% {format_status(status):<30}')
+        if done >= total:
+            stream.write('\n')
+        stream.flush()
+
+    return callback
+
+
+def entry_name(entry):
+    """ Input name of a manifest entry, for messages. """
+    if entry.get('operation', 'vt2aaspi') == 'vt2aaspi':
+        return entry.get('inputvt')
+    return entry.get('inputaaspi')
+
+
+def run_entry(entry, callback=None, pad=DEFAULT_PAD,
+              memory_budget=DEFAULT_MEMORY_BUDGET, workers=1, pipelined=False,
+              write_size=DEFAULT_WRITE_SIZE, resume=False, incremental=False):
+    """ Convert the volume of one manifest entry.
+
+    Keys of the entry override the keyword arguments of the same name.
+
+    Returns
+    -------
+    dict
+        The summary of the conversion.
+    """
+    operation = entry.get('operation', 'vt2aaspi')
+    if operation == 'vt2aaspi':
+        return convert_vt_to_aaspi(
+            entry['inputvt'], entry['outputpath'],
+            entry.get('horizontal_unit', 'm'),
+            entry.get('vertical_unit', 'ms'), callback,
+            entry.get('pad', pad), memory_budget,
+            entry.get('workers', workers),
+            entry.get('pipelined', pipelined), write_size,
+            entry.get('resume', resume), entry.get('tracks'),
+            entry.get('bins'), entry.get('samples'),
+            entry.get('decimation'), entry.get('read_order', 'auto'),
+            incremental=entry.get('incremental', incremental))
+    if operation == 'aaspi2vt':
+        return convert_aaspi_to_vt(
+            entry['inputaaspi'], entry['inputvt'],
+            entry['outputpath'], callback,
+            entry.get('pipelined', pipelined),
+            entry.get('resume', resume), entry.get('tracks'),
+            entry.get('bins'), entry.get('samples'),
+            entry.get('workers', workers), memory_budget,
+            entry.get('precision'), entry.get('scale', 'range'),
+            entry.get('block_put', False))
+    raise ValueError(f'Unknown operation: {operation}')
+
+
+def run_manifest(entries, pad=DEFAULT_PAD, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 workers=1, pipelined=False, write_size=DEFAULT_WRITE_SIZE,
+                 resume=False, incremental=False):
+    """ Convert every volume of a manifest one after the other.
+
+    A failed volume is reported and skipped so the rest of the batch still
+    runs.
+
+    Returns
+    -------
+    list
+        One summary dict per entry, with an 'error' key for failures.
+    """
+    results = []
+    for n, entry in enumerate(entries):
+        name = entry_name(entry)
+        callback = print_progress(f'[{n + 1}/{len(entries)}] '
+                                  f'{os.path.basename(str(name))}')
+        try:
+            result = run_entry(entry, callback, pad, memory_budget, workers,
+                               pipelined, write_size, resume, incremental)
+        except Exception as e:
+            print(f'\nERROR: {name}: {e}', file=sys.stderr)
+            result = {'operation': entry.get('operation', 'vt2aaspi'),
+                      'input': name, 'error': str(e)}
+        results.append(result)
+    return results
+
+
+def print_summary(results, stream=sys.stdout):
+    """ Print the per volume throughput of a batch. """
+    stream.write(f'{"input":<40} {"traces":>12} {"MB":>10} {"s":>9} '
+                 f'{"MB/s":>9} {"traces/s":>11}\n')
+    for r in results:
+        name = os.path.basename(str(r['input']))[-40:]
+        if 'error' in r:
+            stream.write(f'{name:<40} FAILED: {r["error"]}\n')
+            continue
+        stream.write(f'{name:<40} {r["traces"]:>12d} {r["bytes"] / 1e6:>10.1f} '
+                     f'{r["seconds"]:>9.1f} {r["mb_per_s"]:>9.1f} '
+                     f'{r["traces_per_s"]:>11.0f}\n')
+        if r['bound']:
+            stream.write(f'{"":<40} {format_report(r)}\n')
+        if 'geometry' in r:
+            stream.write(f'{"":<40} {format_geometry(r["geometry"])}\n')
+        if 'checksums' in r:
+            stream.write(f'{"":<40} {format_checksums(r["checksums"])}\n')
+        if 'quantization' in r:
+            stream.write(f'{"":<40} '
+                         f'{format_quantization(r["quantization"])}\n')
+        amp = r.get('amplitude', {})
+        if amp.get('count'):
+            stream.write(f'{"":<40} amplitude {amp["min"]:.4g} to '
+                         f'{amp["max"]:.4g}, rms {amp["rms"]:.4g}, '
+                         f'99.5% {amp["percentiles"]["99.5"]:.4g}\n')
+
+
+def _add_window_arguments(parser):
+    parser.add_argument('--tracks', type=float, nargs=2,
+                        metavar=('FIRST', 'LAST'), help='track range')
+    parser.add_argument('--bins', type=float, nargs=2,
+                        metavar=('FIRST', 'LAST'), help='bin range')
+    parser.add_argument('--samples', type=float, nargs=2,
+                        metavar=('FIRST', 'LAST'),
+                        help='time or depth range')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert seismic data between vt and aaspi(.H) format.')
+    parser.add_argument('--memory-budget', type=float, default=256,
+                        help='MB held in memory for one read (default 256)')
+    parser.add_argument('--write-size', type=float, default=4,
+                        help='MB per write to the AASPI binaries (default 4)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes (default 1)')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='overlap reads and writes in separate threads')
+    parser.add_argument('--pad', default=DEFAULT_PAD,
+                        choices=['native', 'pad3d', 'none'],
+                        help='pad3d: run ${AASPIHOME}/bin64/pad3d, native: '
+                        'write the padded files directly, none: keep the '
+                        '_nopad files (default %(default)s)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue interrupted conversions from their '
+                        'journals instead of starting over')
+    parser.add_argument('--incremental', action='store_true',
+                        help='vt2aaspi: keep trace checksums with the output '
+                        'and only rewrite the traces that changed since the '
+                        'last incremental conversion')
+    parser.add_argument('--json', help='write the summary to this JSON file')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('vt2aaspi', help='convert a VT to AASPI')
+    p.add_argument('inputvt')
+    p.add_argument('outputpath')
+    p.add_argument('--horizontal-unit', default='m', choices=['m', 'ft'])
+    p.add_argument('--vertical-unit', default='ms',
+                   choices=['ms', 's', 'ft', 'm'])
+    _add_window_arguments(p)
+    p.add_argument('--decimate', type=int, nargs=3,
+                   metavar=('TRACK', 'BIN', 'SAMPLE'),
+                   help='keep every n\'th track, bin and sample')
+    p.add_argument('--read-order', default='auto',
+                   choices=('auto',) + READ_ORDERS,
+                   help='read the VT by tracks or by bins, auto picks the '
+                   'sequential order for its storage (default)')
+
+    p = sub.add_parser('attributes',
+                       help='convert VTs of one survey, computing the idents '
+                       'once')
+    p.add_argument('outputpath')
+    p.add_argument('inputvts', nargs='+')
+    p.add_argument('--horizontal-unit', default='m', choices=['m', 'ft'])
+    p.add_argument('--vertical-unit', default='ms',
+                   choices=['ms', 's', 'ft', 'm'])
+    _add_window_arguments(p)
+    p.add_argument('--decimate', type=int, nargs=3,
+                   metavar=('TRACK', 'BIN', 'SAMPLE'),
+                   help='keep every n\'th track, bin and sample')
+    p.add_argument('--read-order', default='auto',
+                   choices=('auto',) + READ_ORDERS)
+
+    p = sub.add_parser('aaspi2vt', help='convert an AASPI .H to VT')
+    p.add_argument('inputaaspi')
+    p.add_argument('inputvt', help='VT supplying the survey and header')
+    p.add_argument('outputpath')
+    _add_window_arguments(p)
+    p.add_argument('--precision', type=int, choices=PRECISIONS,
+                   help='bits per VT sample, 8 and 16 quantize between the '
+                   'clip values (default: as the survey VT)')
+    p.add_argument('--scale', default='range', choices=SCALES,
+                   help='quantize over the amplitude range of the data or '
+                   'between its clip values (default range)')
+    p.add_argument('--block-put', action='store_true',
+                   help='put runs of VT planes with a single put, checked on '
+                   'the first block (default one trace at a time)')
+
+    p = sub.add_parser('validate-pad',
+                       help='compare native padding with pad3d on a VT')
+    p.add_argument('inputvt')
+    p.add_argument('workdir')
+
+    p = sub.add_parser('verify',
+                       help='compare a VT with an AASPI volume converted to '
+                       'or from it')
+    p.add_argument('inputvt')
+    p.add_argument('inputaaspi')
+    p.add_argument('--tolerance', type=float, default=0.,
+                   help='largest sample difference (default 0, exact)')
+    p.add_argument('--max-mismatches', type=int,
+                   default=DEFAULT_MAX_MISMATCHES,
+                   help='mismatching traces to list (default %(default)s)')
+
+    p = sub.add_parser('batch', help='convert every volume in a manifest')
+    p.add_argument('manifest', help='JSON list of conversions')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'validate-pad':
+        diffs = validate_padding(args.inputvt, args.workdir)
+        for diff in diffs:
+            print(diff)
+        print('native padding matches pad3d' if not diffs
+              else f'{len(diffs)} differences')
+        return 1 if diffs else 0
+
+    if args.command == 'verify':
+        result = verify_conversion(
+            args.inputvt, args.inputaaspi, args.tolerance,
+            args.max_mismatches, args.workers,
+            int(args.memory_budget * 1024 ** 2),
+            print_progress(os.path.basename(args.inputaaspi)))
+        print(format_verify(result))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+        return 0 if result['ok'] else 1
+
+    if args.command == 'attributes':
+        results = convert_vt_batch(
+            args.inputvts, args.outputpath, args.horizontal_unit,
+            args.vertical_unit, print_progress('attributes'), args.pad,
+            int(args.memory_budget * 1024 ** 2), args.workers, args.pipelined,
+            int(args.write_size * 1024 ** 2), args.resume, args.tracks,
+            args.bins, args.samples, args.decimate, args.read_order,
+            args.incremental)
+        print_summary(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == 'batch':
+        with open(args.manifest) as f:
+            entries = json.load(f)
+    elif args.command == 'vt2aaspi':
+        entries = [{'operation': 'vt2aaspi', 'inputvt': args.inputvt,
+                    'outputpath': args.outputpath,
+                    'horizontal_unit': args.horizontal_unit,
+                    'vertical_unit': args.vertical_unit,
+                    'tracks': args.tracks, 'bins': args.bins,
+                    'samples': args.samples, 'decimation': args.decimate,
+                    'read_order': args.read_order}]
+    else:
+        entries = [{'operation': 'aaspi2vt', 'inputaaspi': args.inputaaspi,
+                    'inputvt': args.inputvt, 'outputpath': args.outputpath,
+                    'tracks': args.tracks, 'bins': args.bins,
+                    'samples': args.samples, 'precision': args.precision,
+                    'scale': args.scale, 'block_put': args.block_put}]
+
+    results = run_manifest(entries, pad=args.pad,
+                           memory_budget=int(args.memory_budget * 1024 ** 2),
+                           workers=args.workers, pipelined=args.pipelined,
+                           write_size=int(args.write_size * 1024 ** 2),
+                           resume=args.resume, incremental=args.incremental)
+    print_summary(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any('error' in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+""" Pure NumPy stand-in for the part of geoio used by the conversion.
+
+Volumes are .npy files of shape (ni, nj, nk) with the header, check and
+survey in a JSON file next to them, so they can be reopened by path like a
+VT. Only the calls made by utils.py are provided: get_float, put,
+get_header_info, get_survey, get_filename and the ijk to track/bin/time and
+ijk to xyz transforms.
+
+Volumes with a header bytes_per_sample of 1 or 2 store unsigned codes
+spread linearly between the clip values of the header. This is the encoding
+quantize.py assumes for 8 and 16 bit VTs, not one checked against geoio, so
+round trips through these volumes only check the conversion against that
+assumption.
+
+Used by benchmark.py to measure conversion throughput without geoio or real
+data. It is not a VT reader.
+"""
+import json
+import types
+
+import numpy as np
+
+# code types of volumes by bytes per sample, 4 is float32
+_CODES = {1: np.uint8, 2: np.uint16}
+
+
+class AffineXform:
+    """ An ijk transform given by a 3x4 affine matrix. """
+
+    def __init__(self, matrix):
+        self.m = np.asarray(matrix, dtype=np.float64)
+
+    def to_target(self, ijk):
+        return tuple(self.m[:, :3] @ np.asarray(ijk, dtype=np.float64)
+                     + self.m[:, 3])
+
+    def from_target(self, target):
+        return tuple(np.linalg.solve(self.m[:, :3],
+                                     np.asarray(target, dtype=np.float64)
+                                     - self.m[:, 3]))
+
+
+class Survey:
+    """ Survey holding the ijk to track/bin/time and ijk to xyz matrices. """
+
+    def __init__(self, tbt, xyz):
+        self.tbt = np.asarray(tbt, dtype=np.float64).tolist()
+        self.xyz = np.asarray(xyz, dtype=np.float64).tolist()
+
+    def get_ijk_to_track_bin_time_transform(self):
+        return AffineXform(self.tbt)
+
+    def get_ijk_to_xyz_transform(self):
+        return AffineXform(self.xyz)
+
+
+class GeoIoVolume:
+    """ A volume opened with GeoIoVolume(path) or created with
+    GeoIoVolume(path, header, check, survey), as in geoio. """
+
+    def __init__(self, path, header=None, check=None, survey=None):
+        self.path = path
+        if header is None:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            self.header = types.SimpleNamespace(**meta['header'])
+            self.check = types.SimpleNamespace(**meta['check'])
+            self.survey = Survey(meta['tbt'], meta['xyz'])
+            self._data = np.load(path, mmap_mode='r+')
+            self._set_codes()
+            return
+
+        self.header, self.check, self.survey = header, check, survey
+        with open(path + '.json', 'w') as f:
+            json.dump({'header': vars(header), 'check': vars(check),
+                       'tbt': survey.tbt, 'xyz': survey.xyz}, f)
+        # tracks run along whichever of i or j the track number changes with
+        ni, nj = check.num_tracks, check.num_bins
+        if survey.tbt[0][0] == 0:
+            ni, nj = nj, ni
+        self._data = np.lib.format.open_memmap(
+            path, mode='w+',
+            dtype=_CODES.get(getattr(header, 'bytes_per_sample', 4), np.float32),
+            shape=(ni, nj, check.num_samples))
+        self._set_codes()
+
+    def _set_codes(self):
+        # amplitude of code 0 and the step between codes of a quantized
+        # volume, the encoding assumed by quantize.py
+        self._low = self._step = None
+        if self._data.dtype != np.float32:
+            top = np.iinfo(self._data.dtype).max
+            self._low = np.float32(self.header.min_clip_amp)
+            self._step = np.float32(
+                (self.header.max_clip_amp - self.header.min_clip_amp) / top or 1.)
+
+    def _decode(self, codes):
+        if self._low is None:
+            return np.array(codes)
+        data = np.multiply(codes, self._step, dtype=np.float32)
+        data += self._low
+        return data
+
+    def _encode(self, data):
+        if self._low is None:
+            return data
+        top = np.iinfo(self._data.dtype).max
+        return np.clip(np.rint((data - self._low) / self._step), 0, top)
+
+    def get_filename(self):
+        return self.path
+
+    def get_header_info(self):
+        return self.header, self.check
+
+    def get_survey(self):
+        return self.survey
+
+    def get_float(self, bijk, eijk):
+        """ Return the inclusive ijk box as a new float32 array. """
+        (i0, j0, k0), (i1, j1, k1) = ([int(round(x)) for x in c]
+                                      for c in (bijk, eijk))
+        return self._decode(self._data[i0:i1 + 1, j0:j1 + 1, k0:k1 + 1])
+
+    def put(self, data, i, j):
+        """ Write one trace, or an (ni, nj, nk) block, starting at (i, j). """
+        data = self._encode(np.asarray(data, dtype=np.float32))
+        if data.ndim == 1:
+            self._data[i, j, :len(data)] = data
+        else:
+            ni, nj, nk = data.shape
+            self._data[i:i + ni, j:j + nj, :nk] = data
+
+    def flush(self):
+        self._data.flush()
+
+
+def make_volume(path, ntrk, nbin, nsmp, descending_tracks=False,
+                descending_bins=False, tracks_along_j=False, seed=0):
+    """ Create a volume of random amplitudes.
+
+    Parameters
+    ----------
+    path: str
+        Path of the .npy file, the JSON header goes to path + '.json'.
+    ntrk, nbin, nsmp: int
+        Number of tracks, bins and samples.
+    descending_tracks, descending_bins: bool
+        Store tracks or bins in descending number order.
+    tracks_along_j: bool
+        Store tracks along j and bins along i.
+    seed: int
+        Seed of the random amplitudes.
+
+    Returns
+    -------
+    GeoIoVolume
+    """
+    ftrk, dtrk = (1000 + ntrk - 1, -1) if descending_tracks else (1000, 1)
+    fbin, dbin = (2000 + 2 * (nbin - 1), -2) if descending_bins else (2000, 2)
+    header = types.SimpleNamespace(domain=0, min_clip_amp=-1.,
+                                   max_clip_amp=1.)
+    check = types.SimpleNamespace(
+        num_tracks=ntrk, delta_track=dtrk, first_track=ftrk, num_bins=nbin,
+        delta_bin=dbin, first_bin=fbin, num_samples=nsmp, digi=4.0,
+        zero_time=0.0)
+    if tracks_along_j:
+        tbt = [[0, dtrk, 0, ftrk], [dbin, 0, 0, fbin], [0, 0, 4., 0]]
+    else:
+        tbt = [[dtrk, 0, 0, ftrk], [0, dbin, 0, fbin], [0, 0, 4., 0]]
+    xyz = [[12.5, 3.1, 0, 400000], [-3.1, 12.5, 0, 6000000], [0, 0, 4., 0]]
+
+    vol = GeoIoVolume(path, header, check, Survey(tbt, xyz))
+    rng = np.random.default_rng(seed)
+    for i in range(vol._data.shape[0]):
+        vol._data[i] = rng.standard_normal(vol._data.shape[1:],
+                                           dtype=np.float32)
+    vol.flush()
+    return vol
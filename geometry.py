@@ -0,0 +1,196 @@
+import numpy as np
+
+from chunks import track_plane
+from idents import tbt_to_ijk
+
+# largest distance in ijk from the nearest VT trace for an ident to count as
+# on the grid
+GRID_TOLERANCE = 0.01
+
+# examples of each kind of problem trace kept for the report
+_EXAMPLES = 5
+
+
+def vt_shape(xform_ijk_tbt, check):
+    """ (ni, nj) of a VT, tracks run along i unless the track number changes
+    with j. """
+    origin = np.asarray(xform_ijk_tbt.to_target((0, 0, 0)), dtype=np.float64)
+    along_i = np.asarray(xform_ijk_tbt.to_target((1, 0, 0)),
+                         dtype=np.float64) - origin
+    if along_i[0] != 0:
+        return check.num_tracks, check.num_bins
+    return check.num_bins, check.num_tracks
+
+
+class Geometry:
+    """ Where the traces of an AASPI volume land in a VT survey.
+
+    Built by analyze_geometry from the line_no and cdp_no idents of every
+    trace at once.
+
+    Attributes
+    ----------
+    i, j: ndarray
+        (ntr, nb) int64 VT i and j of every trace, the nearest VT trace for
+        traces off the grid and -1 for traces outside the survey, which are
+        not written.
+    rule: tuple or None
+        (origin, track_step, bin_step) (i, j) vectors if every trace is inside
+        the survey and (i, j) = origin + track * track_step + bin * bin_step.
+    off_grid, out_of_survey, duplicate: ndarray
+        (ntr, nb) bool masks of traces whose idents are between VT traces,
+        outside the survey, or the same VT trace as an earlier trace.
+    missing: int
+        VT traces inside the bounding box of the traces that no trace lands
+        on. Only the traces on the lattice of the steps between the traces
+        count, so a decimated volume is not missing the traces it skips.
+    """
+
+    def __init__(self, i, j, off_grid, out_of_survey):
+        self.off_grid = off_grid
+        self.out_of_survey = out_of_survey
+        self.i, self.j = i, j
+        if out_of_survey.any():
+            i[out_of_survey] = -1
+            j[out_of_survey] = -1
+
+        ntr, nb = i.shape
+        self.rule = None
+        if ntr and nb and not out_of_survey.any():
+            origin = np.array([i[0, 0], j[0, 0]])
+            track_step = np.array([i[-1, 0], j[-1, 0]]) - origin
+            bin_step = np.array([i[0, -1], j[0, -1]]) - origin
+            if (ntr == 1 or not (track_step % (ntr - 1)).any()) and \
+                    (nb == 1 or not (bin_step % (nb - 1)).any()):
+                track_step //= max(ntr - 1, 1)
+                bin_step //= max(nb - 1, 1)
+                t = np.arange(ntr)[:, None]
+                b = np.arange(nb)[None, :]
+                if all((x == o + t * dt + b * db).all() for x, o, dt, db in
+                       zip((i, j), origin, track_step, bin_step)):
+                    self.rule = (origin, track_step, bin_step)
+
+        self.duplicate = np.zeros(i.shape, dtype=bool)
+        inside = ~out_of_survey
+        count = int(inside.sum())
+        if not count:
+            self.missing = 0
+            return
+        if self.rule is not None:
+            lo = np.minimum(origin, origin + (ntr - 1) * track_step) + \
+                np.minimum(0, (nb - 1) * bin_step)
+            hi = np.maximum(origin, origin + (ntr - 1) * track_step) + \
+                np.maximum(0, (nb - 1) * bin_step)
+            step = np.maximum(np.gcd(track_step, bin_step), 1)
+            area = int(np.prod((hi - lo) // step + 1))
+            if track_step[0] * bin_step[1] != track_step[1] * bin_step[0]:
+                # independent steps never land twice on a trace
+                self.missing = area - count
+                return
+        iv, jv = (i, j) if count == i.size else (i[inside], j[inside])
+        lo = np.array([iv.min(), jv.min()])
+        # (i, j) on the lattice of the decimation, 1 for all VT traces
+        iv, jv = iv - lo[0], jv - lo[1]
+        step = np.maximum([np.gcd.reduce(iv, axis=None),
+                           np.gcd.reduce(jv, axis=None)], 1)
+        iv, jv = iv // step[0], jv // step[1]
+        n = np.array([iv.max(), jv.max()]) + 1
+        area = int(np.prod(n))
+        cell = (iv * n[1] + jv).ravel()
+        if area <= 4 * count:
+            distinct = int(np.count_nonzero(np.bincount(cell, minlength=area)))
+        else:
+            distinct = len(np.unique(cell))
+        self.missing = area - distinct
+        if distinct < count:
+            _, first = np.unique(cell, return_index=True)
+            dup = np.ones(count, dtype=bool)
+            dup[first] = False
+            self.duplicate[inside] = dup
+
+    @property
+    def regular(self):
+        return self.rule is not None and not self.duplicate.any()
+
+    def track_ij(self, t):
+        """ (nb, 2) VT (i, j) of the traces of track t. """
+        return np.stack([self.i[t], self.j[t]], axis=-1)
+
+    def planes(self):
+        """ track_plane of every track, from the rule for a regular grid. """
+        ntr, nb = self.i.shape
+        if self.regular:
+            origin, track_step, bin_step = self.rule
+            if nb == 1 or sorted(np.abs(bin_step)) == [0, 1]:
+                axis = 1 if nb == 1 else int(np.flatnonzero(bin_step)[0])
+                step = 1 if nb == 1 else int(bin_step[axis])
+                return [(axis, int(origin[1 - axis] + t * track_step[1 - axis]),
+                         int(origin[axis] + t * track_step[axis]), step)
+                        for t in range(ntr)]
+        bad = self.out_of_survey.any(axis=1)
+        return [None if bad[t] else track_plane(self.track_ij(t))
+                for t in range(ntr)]
+
+    def report(self, tracks=None, bins=None):
+        """ JSON serializable summary. tracks and bins are the (ntr, nb) track
+        and bin numbers of the traces, for the examples. """
+        ntr, nb = self.i.shape
+        report = {'traces': int(ntr * nb), 'regular': self.regular,
+                  'missing': self.missing}
+        for name in ('off_grid', 'out_of_survey', 'duplicate'):
+            mask = getattr(self, name)
+            report[name] = int(np.count_nonzero(mask))
+            t, b = np.nonzero(mask) if report[name] else ((), ())
+            report[name + '_examples'] = [
+                [float(tracks[t_, b_]), float(bins[t_, b_])]
+                if tracks is not None else [int(t_), int(b_)]
+                for t_, b_ in zip(t[:_EXAMPLES], b[:_EXAMPLES])]
+        if self.rule is not None:
+            report['rule'] = {k: v.tolist() for k, v in
+                              zip(('origin', 'track_step', 'bin_step'),
+                                  self.rule)}
+        return report
+
+
+def analyze_geometry(xform_ijk_tbt, trk, bin_, shape, matrix=None,
+                     tolerance=GRID_TOLERANCE):
+    """ Map the track and bin idents of every trace to VT (i, j) at once.
+
+    Parameters
+    ----------
+    xform_ijk_tbt: geoio transform
+        The survey ijk to track/bin/time transform.
+    trk, bin_: array_like
+        (ntr, nb) track (line_no) and bin (cdp_no) idents.
+    shape: tuple
+        (ni, nj) of the VT, see vt_shape.
+    matrix: ndarray, optional
+        Affine matrix of xform_ijk_tbt from idents.affine_matrix. When None
+        every trace goes through from_target, once.
+    tolerance: float
+        Largest ijk distance from a VT trace for an ident on the grid.
+
+    Returns
+    -------
+    Geometry
+    """
+    off_grid = np.zeros(np.shape(trk), dtype=bool)
+    out_of_survey = np.zeros(np.shape(trk), dtype=bool)
+    ij = []
+    for x, n in zip(tbt_to_ijk(xform_ijk_tbt, trk, bin_, matrix), shape):
+        r = np.rint(x)
+        x -= r
+        off_grid |= np.abs(x, out=x) > tolerance
+        out_of_survey |= (r < 0) | (r >= n)
+        ij.append(r.astype(np.int64))
+    return Geometry(ij[0], ij[1], off_grid, out_of_survey)
+
+
+def format_geometry(report):
+    """ One line summary of a Geometry report. """
+    problems = ', '.join(f'{report[name]} {name.replace("_", " ")}'
+                         for name in ('off_grid', 'out_of_survey', 'duplicate',
+                                      'missing') if report[name])
+    kind = 'regular grid' if report['regular'] else 'irregular'
+    return f'{report["traces"]} traces, {kind}' + \
+        (f', {problems}' if problems else '')
@@ -0,0 +1,250 @@
+import numpy as np
+
+# values this close to an integer are taken as that integer before truncation,
+# so an ident computed in another order, or through a probed matrix, does not
+# drop to the integer below
+_SNAP = 1e-6
+
+
+def snap_trunc(values):
+    """ Truncate values toward zero, snapping those within _SNAP of an integer
+    to it first. """
+    values = np.asarray(values, dtype=np.float64)
+    nearest = np.rint(values)
+    return np.trunc(np.where(np.abs(values - nearest) < _SNAP, nearest,
+                             values))
+
+
+def affine_matrix(xform, extent=(1, 1, 1), rtol=1e-9):
+    """ Extract the affine matrix of a geoio ijk transform.
+
+    The transform is probed at the origin and along each ijk unit vector, then
+    checked against the far corners of the volume.
+
+    Parameters
+    ----------
+    xform: geoio transform
+        Any transform with a to_target((i, j, k)) method.
+    extent: tuple
+        Number of points along i, j and k, used to place the check points.
+    rtol: float
+        Relative tolerance used when checking the probed matrix.
+
+    Returns
+    -------
+    ndarray or None
+        A 3x4 matrix M with target = M[:, :3] @ ijk + M[:, 3], or None if the
+        transform is not affine.
+    """
+    origin = np.asarray(xform.to_target((0, 0, 0)), dtype=np.float64)
+    cols = [np.asarray(xform.to_target(e), dtype=np.float64) - origin
+            for e in ((1, 0, 0), (0, 1, 0), (0, 0, 1))]
+    m = np.column_stack(cols + [origin])
+
+    ni, nj, nk = (max(int(n) - 1, 1) for n in extent)
+    for probe in ((ni, nj, nk), (ni, 0, 0), (0, nj, 0), (ni, nj, 0)):
+        expect = np.asarray(xform.to_target(probe), dtype=np.float64)
+        got = m[:, :3] @ np.asarray(probe, dtype=np.float64) + m[:, 3]
+        scale = max(np.abs(expect).max(), 1.0)
+        if np.abs(got - expect).max() > rtol * scale:
+            return None
+    return m
+
+
+class IdentEngine:
+    """ Compute AASPI trace idents for blocks of tracks.
+
+    The survey transforms are reduced to affine matrices once, after which the
+    idents of any block of tracks are a single matrix operation. Transforms
+    that are not affine fall back to per-point to_target calls.
+
+    Tracks and bins are addressed by their output position, i.e. ascending
+    track and ascending bin order as written to the AASPI files.
+    """
+
+    def __init__(self, vt_params, aaspi_params):
+        vp = vt_params
+        self.vp = vp
+        self.idents = aaspi_params.idents
+
+        # output order is always ascending so start from the smallest bin
+        self.bin0 = vp.lbin if vp.negbin else vp.fbin
+
+        extent = (vp.ntrk, vp.nbin, vp.nsmp)
+        self.tbt = affine_matrix(vp.xform_ijk_tbt, extent)
+        self.xyz = affine_matrix(vp.xform_ijk_xyz, extent)
+        self.affine = self.tbt is not None and self.xyz is not None
+
+        # ijk of the first output trace and the ijk step per output track and
+        # per output bin
+        if self.affine:
+            inv = np.linalg.inv(self.tbt[:, :3])
+            self.ijk0 = inv @ (np.array([vp.ftrk, self.bin0, vp.fsmp],
+                                        dtype=np.float64) - self.tbt[:, 3])
+            self.dijk_trk = inv @ np.array([vp.dtrk, 0, 0], dtype=np.float64)
+            self.dijk_bin = inv @ np.array([0, vp.dbin, 0], dtype=np.float64)
+
+        # the idents which are the same for every trace
+        self.template = np.zeros(len(self.idents), dtype='i4')
+        self.template[self.idents.get("muts")] = 0
+        self.template[self.idents.get("mute")] = 0
+        self.template[self.idents.get("trid")] = 1
+        self.template[self.idents.get("laga")] = 0
+        self.template[self.idents.get("scalco")] = 1
+        self.template[self.idents.get("ns")] = vp.nsmp
+        self.template[self.idents.get("dt")] = vp.dsmp
+
+    def block_ijk(self, t0, t1, b0=0, b1=None):
+        """ Return the integer (i, j) of a block of traces as (ntr, nb, 2). """
+        b1 = self.vp.nbin if b1 is None else b1
+        return np.stack(self._block_ij(t0, t1, b0, b1),
+                        axis=-1).astype(np.int64)
+
+    def _block_ij(self, t0, t1, b0, b1):
+        # integer valued (i, j) as (ntr, nb) float grids
+        t = np.arange(t0, t1, dtype=np.float64)[:, None]
+        b = np.arange(b0, b1, dtype=np.float64)[None, :]
+        return [np.rint(self.ijk0[a] + t * self.dijk_trk[a]
+                        + b * self.dijk_bin[a]) for a in (0, 1)]
+
+    def block_idents(self, t0, t1, b0=0, b1=None, out=None):
+        """ Return the idents of output tracks t0..t1-1 and bins b0..b1-1.
+
+        Parameters
+        ----------
+        t0, t1: int
+            First and one past the last output track index.
+        b0, b1: int, optional
+            First and one past the last output bin index. Defaults to all bins.
+        out: ndarray, optional
+            Array of shape (t1 - t0, b1 - b0, len(idents)) to fill in place.
+            May be big endian.
+
+        Returns
+        -------
+        ndarray
+            Idents in ascending track then ascending bin order.
+        """
+        b1 = self.vp.nbin if b1 is None else b1
+        shape = (t1 - t0, b1 - b0, len(self.idents))
+        if out is None:
+            out = np.empty(shape, dtype='i4')
+        out[...] = self.template
+
+        if self.affine:
+            # fill each column straight from the (i, j) grid, no intermediate
+            # per trace arrays
+            i, j = self._block_ij(t0, t1, b0, b1)
+            for name, m, row in (("line_no", self.tbt, 0),
+                                 ("cdp_no", self.tbt, 1),
+                                 ("cdp_x", self.xyz, 0),
+                                 ("cdp_y", self.xyz, 1)):
+                out[..., self.idents.get(name)] = snap_trunc(
+                    i * m[row, 0] + j * m[row, 1] + m[row, 3])
+            return out
+
+        tbt, xyz = self._per_point(t0, t1, b0, b1)
+
+        # track is always line_no, bin is always cdp_no
+        # map x and y to cdp_x and cdp_y
+        out[..., self.idents.get("line_no")] = snap_trunc(tbt[..., 0])
+        out[..., self.idents.get("cdp_no")] = snap_trunc(tbt[..., 1])
+        out[..., self.idents.get("cdp_x")] = snap_trunc(xyz[..., 0])
+        out[..., self.idents.get("cdp_y")] = snap_trunc(xyz[..., 1])
+        return out
+
+    def volume_idents(self):
+        """ Return the idents of the whole volume as (ntrk, nbin, nidents). """
+        return self.block_idents(0, self.vp.ntrk)
+
+    def _per_point(self, t0, t1, b0=0, b1=None):
+        # fallback for transforms which are not affine - one from_target and
+        # two to_target calls per trace of output tracks t0..t1-1 and bins
+        # b0..b1-1
+        vp = self.vp
+        b1 = vp.nbin if b1 is None else b1
+        xform_ijk_tbt, xform_ijk_xyz = vp.xform_ijk_tbt, vp.xform_ijk_xyz
+        tbt = np.empty((t1 - t0, b1 - b0, 3))
+        xyz = np.empty((t1 - t0, b1 - b0, 3))
+        for n, t in enumerate(range(t0, t1)):
+            trk = vp.ftrk + t * vp.dtrk
+            # bins in ascending output order, which also handles negbin
+            for m, b in enumerate(range(b0, b1)):
+                ijk = xform_ijk_tbt.from_target(
+                    (trk, self.bin0 + b * vp.dbin, vp.fsmp))
+                i, j = int(round(ijk[0])), int(round(ijk[1]))
+                tbt[n, m] = xform_ijk_tbt.to_target((i, j, 0))
+                xyz[n, m] = xform_ijk_xyz.to_target((i, j, 0))
+        return tbt, xyz
+
+
+def tbt_to_ijk(xform_ijk_tbt, trk, bin_, matrix=None):
+    """ Map track and bin numbers to fractional VT i and j indices.
+
+    Parameters
+    ----------
+    xform_ijk_tbt: geoio transform
+        The survey ijk to track/bin/time transform.
+    trk, bin_: array_like
+        Track and bin numbers of the same shape.
+    matrix: ndarray, optional
+        Affine matrix of xform_ijk_tbt from affine_matrix. When None every
+        point goes through from_target.
+
+    Returns
+    -------
+    tuple
+        Float i and j arrays of the shape of trk.
+    """
+    trk = np.asarray(trk, dtype=np.float64)
+    bin_ = np.asarray(bin_, dtype=np.float64)
+    if matrix is not None:
+        # time is zero, so only the track and bin columns of the inverse
+        inv = np.linalg.inv(matrix[:, :3])
+        offset = -inv @ matrix[:, 3]
+        ij = []
+        for a in (0, 1):
+            x = trk * inv[a, 0]
+            x += bin_ * inv[a, 1]
+            x += offset[a]
+            ij.append(x)
+        return tuple(ij)
+    ijk = np.array([xform_ijk_tbt.from_target((t, b, 0))
+                    for t, b in zip(trk.ravel(), bin_.ravel())],
+                   dtype=np.float64).reshape(trk.shape + (3,))
+    return ijk[..., 0], ijk[..., 1]
+
+
+def ij_idents(i, j, xform_ijk_tbt, xform_ijk_xyz, tbt=None, xyz=None):
+    """ Return the line_no, cdp_no, cdp_x and cdp_y idents of VT traces, as
+    written by IdentEngine.
+
+    Parameters
+    ----------
+    i, j: array_like
+        Integer VT indices of the traces, of any shape.
+    xform_ijk_tbt, xform_ijk_xyz: geoio transform
+        The survey ijk to track/bin/time and ijk to xyz transforms.
+    tbt, xyz: ndarray, optional
+        Their affine matrices from affine_matrix. When None every trace goes
+        through to_target.
+
+    Returns
+    -------
+    dict
+        Ident name to int64 array of the shape of i.
+    """
+    i = np.asarray(i, dtype=np.float64)
+    j = np.asarray(j, dtype=np.float64)
+    if tbt is not None and xyz is not None:
+        values = [snap_trunc(i * m[row, 0] + j * m[row, 1] + m[row, 3])
+                  for m, row in ((tbt, 0), (tbt, 1), (xyz, 0), (xyz, 1))]
+    else:
+        points = [(xform_ijk_tbt.to_target((a, b, 0)),
+                   xform_ijk_xyz.to_target((a, b, 0)))
+                  for a, b in zip(i.ravel(), j.ravel())]
+        values = [snap_trunc(np.array([p[n][row] for p in points],
+                                      dtype=np.float64)).reshape(i.shape)
+                  for n, row in ((0, 0), (0, 1), (1, 0), (1, 1))]
+    return {name: v.astype(np.int64) for name, v in
+            zip(("line_no", "cdp_no", "cdp_x", "cdp_y"), values)}
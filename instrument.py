@@ -0,0 +1,151 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+# stages grouped by what they wait on, used to tell what bounds a run
+STAGE_GROUPS = {
+    'geoio': ('header', 'vt_read', 'vt_put'),
+    'filesystem': ('aaspi_read', 'file_write', 'checkpoint'),
+    'python': ('idents', 'byteswap', 'stats', 'checksum', 'quantize'),
+    'pad3d': ('pad3d',),
+}
+
+# seconds between live progress updates
+DEFAULT_UPDATE_INTERVAL = 0.5
+
+# seconds of history used for the rolling rate
+DEFAULT_RATE_WINDOW = 10.
+
+
+class StageTimer:
+    """ Seconds, calls and bytes spent in the named stages of a conversion.
+
+    Stages are timed with the time context manager or added with add, from
+    any thread. Timers of several workers are combined with merge.
+
+    The stages used by the conversion are
+    header      parsing VT and AASPI headers
+    vt_read     geoio get_float
+    aaspi_read  reading and decoding the memory mapped AASPI binaries
+    idents      computing idents or VT (i, j) from idents
+    byteswap    byte order conversion and reordering of the samples
+    stats       amplitude statistics
+    checksum    trace checksums of incremental conversions
+    quantize    quantizing samples for an 8 or 16 bit VT
+    file_write  writing the AASPI binaries
+    vt_put      geoio put
+    checkpoint  syncing the outputs for the journal
+    pad3d       the external pad3d
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, name, nbytes=0):
+        """ Time the body of a with statement as stage name. """
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - tic, nbytes)
+
+    def add(self, name, seconds, nbytes=0, calls=1):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {'seconds': 0., 'calls': 0, 'bytes': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+            stage['bytes'] += int(nbytes)
+
+    def merge(self, stages):
+        """ Add the stages of another StageTimer or of its stages dict. """
+        stages = getattr(stages, 'stages', stages)
+        for name, s in stages.items():
+            self.add(name, s['seconds'], s['bytes'], s['calls'])
+        return self
+
+    def report(self):
+        """ Return the stages, their totals per STAGE_GROUPS and the group the
+        run was bound by, as a JSON serializable dict. """
+        stages = {}
+        for name, s in self.stages.items():
+            stages[name] = dict(s, mb_per_s=s['bytes'] / s['seconds'] / 1e6
+                                if s['seconds'] > 0 else 0.)
+        groups = {group: sum(self.stages[name]['seconds'] for name in names
+                             if name in self.stages)
+                  for group, names in STAGE_GROUPS.items()}
+        bound = max(groups, key=groups.get) if any(groups.values()) else None
+        return {'stages': stages, 'groups': groups, 'bound': bound}
+
+
+def format_report(report):
+    """ One line summary of a StageTimer report. """
+    groups = ', '.join(f'{group} {t:.1f}s'
+                       for group, t in report['groups'].items() if t)
+    return f'{groups}: {report["bound"]} bound' if report['bound'] else ''
+
+
+class Progress:
+    """ Throttle a progress callback and add the rolling rate and ETA.
+
+    Passed to the conversion as callback(done, total). The wrapped callback
+    is called as callback(done, total, status) at most once per interval
+    seconds, and always for the last unit. status holds 'elapsed' and 'eta'
+    in seconds, 'mb_per_s' and 'units_per_s' over the last window seconds.
+
+    Parameters
+    ----------
+    callback: callable
+        Called as callback(done, total, status).
+    bytes_per_unit: int
+        Bytes moved per unit of progress, e.g. per track.
+    interval: float
+        Minimum seconds between calls.
+    window: float
+        Seconds of history for the rolling rate.
+    """
+
+    def __init__(self, callback, bytes_per_unit, interval=DEFAULT_UPDATE_INTERVAL,
+                 window=DEFAULT_RATE_WINDOW):
+        self.callback = callback
+        self.bytes_per_unit = bytes_per_unit
+        self.interval = interval
+        self.window = window
+        self.start = time.monotonic()
+        self._last = None
+        self._history = collections.deque()
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        self._history.append((now, done))
+        while len(self._history) > 2 and now - self._history[1][0] > self.window:
+            self._history.popleft()
+        if self._last is not None and now - self._last < self.interval \
+                and done < total:
+            return
+        self._last = now
+        self.callback(done, total, self.status(total))
+
+    def status(self, total):
+        """ Return the status dict for the updates seen so far. """
+        now, done = self._history[-1]
+        t0, done0 = self._history[0]
+        if len(self._history) == 1:
+            # a single update, use the whole run
+            t0, done0 = self.start, 0
+        units_per_s = (done - done0) / (now - t0) if now > t0 else 0.
+        eta = (total - done) / units_per_s if units_per_s > 0 else None
+        return {'elapsed': now - self.start, 'eta': eta,
+                'units_per_s': units_per_s,
+                'mb_per_s': units_per_s * self.bytes_per_unit / 1e6}
+
+
+def format_status(status):
+    """ Short text for a Progress status, e.g. for a progress line. """
+    text = f'{status["mb_per_s"]:.1f} MB/s'
+    if status['eta'] is not None:
+        text += f', ETA {time.strftime("%H:%M:%S", time.gmtime(status["eta"]))}'
+    return text
@@ -0,0 +1,361 @@
+""" Conversion job queue for the web interface.
+
+Jobs are manifest entries, as taken by convert.run_entry, kept in a SQLite
+job table shared by every session of the server. A JobScheduler runs up to
+workers jobs at a time, each in its own process, so a conversion survives
+reruns of the Streamlit script and several users convert concurrently.
+
+A job goes from queued to running to done, failed or cancelled. Running jobs
+report their progress to the table and check it for cancellation on every
+progress update. Jobs left running by a server that died are queued again
+with resume, so they continue from their journal. Conversions to VT start
+over when the output VT cannot be journaled, see utils.vt_resumable.
+
+Usage
+-----
+    scheduler = get_scheduler()
+    job_id = scheduler.submit({'operation': 'vt2aaspi', 'inputvt': 'a.vt',
+                               'outputpath': 'out'})
+    scheduler.table.get(job_id)['state']
+    scheduler.cancel(job_id)
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+from geoio import GeoIoVolume
+from convert import entry_name, run_entry
+from usage import get_tracker, pid_alive, track_usage
+from utils import vt_resumable
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# job table of the server, shared by all sessions
+DEFAULT_DB = os.environ.get(
+    'VT_AASPI_JOBS_DB',
+    os.path.join(os.path.expanduser('~'), '.vt_aaspi_jobs.sqlite'))
+
+# jobs run at once, conversions are mostly I/O bound so half the cores
+DEFAULT_WORKERS = int(os.environ.get(
+    'VT_AASPI_JOB_WORKERS', max((os.cpu_count() or 2) // 2, 1)))
+
+# seconds between checks of the table for new jobs and cancellations
+_POLL = 1.
+
+# seconds a cancelled job gets to stop at its next progress update before
+# its process is terminated
+_CANCEL_GRACE = 30.
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL,
+    state TEXT NOT NULL,
+    resume INTEGER NOT NULL DEFAULT 0,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    submitted REAL,
+    started REAL,
+    finished REAL,
+    done REAL NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,
+    status TEXT,
+    result TEXT,
+    error TEXT
+)'''
+
+_JSON_COLUMNS = ('entry', 'status', 'result')
+
+
+class JobCancelled(Exception):
+    """ Raised from the progress callback of a cancelled job. """
+
+
+class JobTable:
+    """ The persistent job table.
+
+    Every call opens its own connection, so a JobTable can be used from any
+    thread and process.
+
+    Parameters
+    ----------
+    path: str
+        Path of the SQLite database, created if missing.
+    """
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30., isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return _Connection(db)
+
+    def submit(self, entry, resume=False):
+        """ Queue a manifest entry, returns the job id. """
+        with self._connect() as db:
+            return db.execute(
+                'INSERT INTO jobs (entry, state, resume, submitted) '
+                'VALUES (?, ?, ?, ?)',
+                (json.dumps(entry), QUEUED, int(resume), time.time())
+            ).lastrowid
+
+    def get(self, job_id):
+        """ Return a job as a dict, None if there is no such job. """
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?',
+                             (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def list(self, states=None, limit=50):
+        """ Return the newest jobs, optionally only those in states. """
+        query, args = 'SELECT * FROM jobs', ()
+        if states:
+            query += f' WHERE state IN ({",".join("?" * len(states))})'
+            args = tuple(states)
+        with self._connect() as db:
+            rows = db.execute(query + ' ORDER BY id DESC LIMIT ?',
+                              args + (limit,)).fetchall()
+        return [_job(row) for row in rows]
+
+    def claim(self):
+        """ Mark the oldest queued job running and return it, None if the
+        queue is empty. """
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT * FROM jobs WHERE state = ? '
+                             'ORDER BY id LIMIT 1', (QUEUED,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE jobs SET state = ?, started = ? '
+                           'WHERE id = ?', (RUNNING, time.time(), row['id']))
+            db.execute('COMMIT')
+        return self.get(row['id']) if row else None
+
+    def set_pid(self, job_id, pid):
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET pid = ? WHERE id = ?', (pid, job_id))
+
+    def progress(self, job_id, done, total, status=None):
+        """ Record the progress of a running job, returns True if the job was
+        cancelled. """
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET done = ?, total = ?, status = ? '
+                       'WHERE id = ?',
+                       (done, total, json.dumps(status), job_id))
+            return bool(db.execute('SELECT cancel FROM jobs WHERE id = ?',
+                                   (job_id,)).fetchone()['cancel'])
+
+    def finish(self, job_id, state, result=None, error=None):
+        """ Record the end of a job, unless it already ended. """
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET state = ?, finished = ?, result = ?, '
+                       'error = ? WHERE id = ? AND state IN (?, ?)',
+                       (state, time.time(), json.dumps(result), error, job_id)
+                       + ACTIVE_STATES)
+
+    def cancel(self, job_id):
+        """ Cancel a job. A queued job is cancelled at once, a running one at
+        its next progress update. """
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET cancel = 1 WHERE id = ? '
+                       'AND state IN (?, ?)', (job_id,) + ACTIVE_STATES)
+            db.execute('UPDATE jobs SET state = ?, finished = ? '
+                       'WHERE id = ? AND state = ?',
+                       (CANCELLED, time.time(), job_id, QUEUED))
+
+    def cancel_requested(self, job_id):
+        with self._connect() as db:
+            row = db.execute('SELECT cancel FROM jobs WHERE id = ?',
+                             (job_id,)).fetchone()
+        return bool(row and row['cancel'])
+
+    def recover(self):
+        """ Queue jobs again whose process is gone, with resume so they
+        continue from their journal. Returns their ids. """
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            rows = db.execute('SELECT id, pid, cancel FROM jobs '
+                              'WHERE state = ?', (RUNNING,)).fetchall()
+            lost = [row for row in rows if not pid_alive(row['pid'])]
+            for row in lost:
+                if row['cancel']:
+                    db.execute('UPDATE jobs SET state = ?, finished = ? '
+                               'WHERE id = ?',
+                               (CANCELLED, time.time(), row['id']))
+                else:
+                    db.execute('UPDATE jobs SET state = ?, resume = 1, '
+                               'pid = NULL WHERE id = ?', (QUEUED, row['id']))
+            db.execute('COMMIT')
+        return [row['id'] for row in lost]
+
+
+class _Connection:
+    # closes the connection at the end of a with statement, sqlite3's own
+    # context manager only commits
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *exc):
+        if self.db.in_transaction:
+            self.db.rollback()
+        self.db.close()
+
+
+def _job(row):
+    job = dict(row)
+    for key in _JSON_COLUMNS:
+        job[key] = json.loads(job[key]) if job[key] else None
+    job['name'] = entry_name(job['entry'])
+    return job
+
+
+def _track_job(entry):
+    vt = GeoIoVolume(entry['inputvt'])
+    if entry.get('operation', 'vt2aaspi') == 'vt2aaspi':
+        msg = {'Operation': 'VT to AASPI',
+               'VT Name': vt.get_filename(),
+               'VT Size': str(os.path.getsize(vt.get_filename())),
+               'Survey Location': str(vt.get_survey().epsg_code())}
+    else:
+        msg = {'Operation': 'AASPI to VT',
+               'VT Name': vt.get_filename(),
+               'Survey Location': str(vt.get_survey().epsg_code())}
+    track_usage(msg)
+
+
+def run_job(path, job_id):
+    """ Run a claimed job and record its outcome, the body of a job
+    process. """
+    table = JobTable(path)
+    job = table.get(job_id)
+
+    def callback(done, total, status):
+        if table.progress(job_id, done, total, status):
+            raise JobCancelled(f'job {job_id} cancelled')
+
+    resume = bool(job['resume'])
+    if job['entry'].get('operation', 'vt2aaspi') == 'aaspi2vt' and \
+            not vt_resumable():
+        # no journal is kept for VT outputs that cannot be synced
+        resume = False
+    try:
+        result = run_entry(job['entry'], callback, resume=resume)
+    except JobCancelled:
+        table.finish(job_id, CANCELLED)
+        return
+    except Exception as e:
+        table.finish(job_id, FAILED, error=str(e))
+        return
+    table.finish(job_id, DONE, result=result)
+    _track_job(job['entry'])
+
+
+class JobScheduler:
+    """ Pool of worker threads running the jobs of a JobTable.
+
+    Each worker claims the oldest queued job and runs it in a new process,
+    watching the table to terminate the process if it ignores a cancel.
+    Jobs of a scheduler that died are recovered on start.
+
+    Parameters
+    ----------
+    path: str
+        Path of the job table.
+    workers: int
+        Number of jobs run at once.
+    """
+
+    def __init__(self, path=DEFAULT_DB, workers=DEFAULT_WORKERS):
+        self.table = JobTable(path)
+        self.workers = workers
+        self._stop = threading.Event()
+        self._threads = []
+        # spawn, forking the threaded server process is not safe
+        self._context = multiprocessing.get_context('spawn')
+
+    def start(self):
+        self.table.recover()
+        # job processes exit right after spooling their usage, the server
+        # sends the spool
+        get_tracker().start()
+        for n in range(self.workers):
+            t = threading.Thread(target=self._worker, daemon=True,
+                                 name=f'job-worker-{n}')
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        """ Stop taking jobs, running jobs are left to finish. """
+        self._stop.set()
+
+    def submit(self, entry, resume=False):
+        return self.table.submit(entry, resume)
+
+    def cancel(self, job_id):
+        self.table.cancel(job_id)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            job = self.table.claim()
+            if job is None:
+                self._stop.wait(_POLL)
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                self.table.finish(job['id'], FAILED, error=str(e))
+
+    def _run(self, job):
+        # not a daemon, vt2aaspi jobs start their own worker processes
+        process = self._context.Process(target=run_job,
+                                        args=(self.table.path, job['id']),
+                                        name=f'job-{job["id"]}')
+        process.start()
+        self.table.set_pid(job['id'], process.pid)
+        cancelled_at = None
+        while process.is_alive():
+            process.join(_POLL)
+            if cancelled_at is None and \
+                    self.table.cancel_requested(job['id']):
+                cancelled_at = time.monotonic()
+            if cancelled_at is not None and process.is_alive() and \
+                    time.monotonic() - cancelled_at > _CANCEL_GRACE:
+                process.terminate()
+                process.join()
+        if cancelled_at is not None:
+            self.table.finish(job['id'], CANCELLED)
+        elif process.exitcode:
+            # run_job records its own errors, this is a crash
+            self.table.finish(job['id'], FAILED,
+                              error=f'exit code {process.exitcode}')
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(path=DEFAULT_DB, workers=DEFAULT_WORKERS):
+    """ Return the scheduler of this process, started on the first call.
+
+    Streamlit reruns app.py for every interaction but imports modules once,
+    so the scheduler outlives the reruns.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(path, workers).start()
+        return _scheduler
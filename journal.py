@@ -0,0 +1,155 @@
+import json
+import os
+import time
+
+from stats import AmplitudeStats
+
+JOURNAL_SUFFIX = '.journal'
+
+# seconds between checkpoints, every checkpoint syncs the outputs to disk
+DEFAULT_CHECKPOINT_INTERVAL = 30.
+
+
+def source_info(path):
+    """ Size and modification time of an input, a changed input invalidates a
+    journal. """
+    st = os.stat(path)
+    return {'source': os.path.abspath(path), 'source_size': st.st_size,
+            'source_mtime': st.st_mtime}
+
+
+class TrackJournal:
+    """ Append only record of the output tracks durably written by a conversion.
+
+    The first line of the journal describes the conversion, every further line
+    is a checkpoint listing track ranges [t0, t1) and the AmplitudeStats of
+    their data. Tracks are only journaled after the outputs have been synced,
+    so after a crash every journaled track is on disk and the conversion can
+    resume with the tracks from pending. A torn last line is ignored.
+
+    Parameters
+    ----------
+    path: str
+        Path of the journal file, usually the output name plus JOURNAL_SUFFIX.
+    meta: dict
+        Description of the conversion. A journal is only resumed with the
+        same meta.
+    files: list, optional
+        Outputs synced before each checkpoint. Objects with a fileno are
+        fsynced, others are flushed if they have a flush method.
+    interval: float
+        Seconds between checkpoints.
+    """
+
+    def __init__(self, path, meta, files=(), interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.meta = meta
+        self.files = list(files)
+        self.interval = interval
+        self.done = []
+        self.stats = AmplitudeStats()
+        self._queued = []
+        self._queued_stats = AmplitudeStats()
+        self._last = time.monotonic()
+        self._f = None
+
+    def start(self):
+        """ Start a new journal, replacing any old one. """
+        self._f = open(self.path, 'w')
+        self._append(self.meta)
+        return self
+
+    def resume(self):
+        """ Load the journaled tracks and continue the journal.
+
+        Returns False, without opening the journal, if there is no journal or
+        it was written for a different conversion.
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.read().split('\n')
+        except OSError:
+            return False
+        try:
+            meta = json.loads(lines[0])
+        except ValueError:
+            return False
+        if meta != json.loads(json.dumps(self.meta)):
+            return False
+
+        good = lines[:1]
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # torn write at the crash, everything after it is lost
+                break
+            self.done.extend(tuple(r) for r in record['tracks'])
+            self.stats.merge(AmplitudeStats.from_dict(record['stats']))
+            good.append(line)
+
+        # rewrite without a torn last line so new checkpoints start on a
+        # fresh line
+        self._f = open(self.path, 'w')
+        self._f.write(''.join(line + '\n' for line in good))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        return True
+
+    def pending(self, ntrk):
+        """ Return the track ranges [t0, t1) not journaled yet. """
+        ranges = []
+        t = 0
+        for t0, t1 in sorted(self.done):
+            if t0 > t:
+                ranges.append((t, t0))
+            t = max(t, t1)
+        if t < ntrk:
+            ranges.append((t, ntrk))
+        return ranges
+
+    def add(self, t0, t1, stats=None):
+        """ Queue tracks t0..t1-1 as written, checkpointing if it is due. """
+        self._queued.append((t0, t1))
+        if stats is not None:
+            self._queued_stats.merge(stats)
+        if time.monotonic() - self._last >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """ Sync the outputs and journal the queued tracks. """
+        self._last = time.monotonic()
+        if not self._queued:
+            return
+        for f in self.files:
+            if hasattr(f, 'fileno'):
+                f.flush()
+                os.fsync(f.fileno())
+            elif hasattr(f, 'flush'):
+                f.flush()
+        self._append({'tracks': self._queued,
+                      'stats': self._queued_stats.to_dict()})
+        self.done.extend(self._queued)
+        self.stats.merge(self._queued_stats)
+        self._queued = []
+        self._queued_stats = AmplitudeStats()
+
+    def _append(self, record):
+        self._f.write(json.dumps(record) + '\n')
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        """ Checkpoint and close the journal. """
+        if self._f is not None:
+            self.checkpoint()
+            self._f.close()
+            self._f = None
+
+    def remove(self):
+        """ Close and delete the journal once the conversion is complete. """
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
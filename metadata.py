@@ -0,0 +1,122 @@
+""" Cache of volume metadata for the web interface.
+
+Streamlit reruns app.py on every click. Opening a VT and reading its header
+and survey can take seconds on NFS, so the parsed metadata is kept per
+process, keyed on the path, modification time and size of the file. A
+changed file is read again, the least recently used entries are dropped
+beyond DEFAULT_CACHE_SIZE.
+"""
+import collections
+import os
+import threading
+
+from geoio import GeoIoVolume
+from aaspi import read_aaspi_header
+from utils import make_params, set_vt_params
+
+# volumes kept per cache
+DEFAULT_CACHE_SIZE = 32
+
+
+def file_key(path):
+    """ (path, mtime, size) identifying the current contents of a file. """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+class MetadataCache:
+    """ LRU cache of metadata loaded from files.
+
+    Parameters
+    ----------
+    load: callable
+        load(path) returns the metadata of the file at path.
+    maxsize: int
+        Number of files kept.
+    """
+
+    def __init__(self, load, maxsize=DEFAULT_CACHE_SIZE):
+        self.load = load
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        # path -> (key, metadata), oldest first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Return the metadata of path, loading it if the file is new or
+        changed since it was cached. """
+        key = file_key(path)
+        with self._lock:
+            entry = self._entries.get(key[0])
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(key[0])
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # loaded outside the lock, a slow volume does not hold up the others
+        metadata = self.load(path)
+        with self._lock:
+            self._entries[key[0]] = (key, metadata)
+            self._entries.move_to_end(key[0])
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_vt_metadata(path):
+    """ Open a VT and return its set_vt_params parameters, with the geoio
+    header, check and EPSG code, and summary, a dict for display. """
+    vt = GeoIoVolume(path)
+    p = set_vt_params(vt)
+    p.header, p.check = vt.get_header_info()
+    p.epsg_code = vt.get_survey().epsg_code()
+    p.summary = {
+        'VT': p.vt_filename,
+        'Size (MB)': '%.1f' % (os.path.getsize(path) / 1e6),
+        'Domain': p.volume_domain,
+        'Survey Location': str(p.epsg_code),
+        'Tracks': '%g to %g by %g (%d)' % (p.ftrk, p.ltrk, p.dtrk, p.ntrk),
+        'Bins': '%g to %g by %g (%d)%s' % (p.fbin, p.lbin, p.dbin, p.nbin,
+                                           ', descending' if p.negbin else ''),
+        'Samples': '%g to %g by %g (%d)' % (p.fsmp, p.lsmp, p.dsmp, p.nsmp),
+        'Clip': '%g to %g' % (p.header.min_clip_amp, p.header.max_clip_amp),
+    }
+    return p
+
+
+def load_aaspi_metadata(path):
+    """ Return a make_params object with hdr, the header dict of an AASPI .H
+    file, and summary, a dict for display. """
+    p = make_params()
+    p.hdr = hdr = read_aaspi_header(path)
+    n = [int(hdr.get(f'n{i}', 1)) for i in (1, 2, 3)]
+    o = [float(hdr.get(f'o{i}', 0)) for i in (1, 2, 3)]
+    d = [float(hdr.get(f'd{i}', 1)) for i in (1, 2, 3)]
+    p.summary = summary = {'AASPI': os.path.abspath(path)}
+    for label, axis in (('Tracks', 2), ('Bins', 1), ('Samples', 0)):
+        summary[label] = '%g to %g by %g (%d)' % (
+            o[axis], o[axis] + d[axis] * (n[axis] - 1), d[axis], n[axis])
+    if 'min_amplitude' in hdr and 'max_amplitude' in hdr:
+        summary['Amplitude'] = '%s to %s' % (hdr['min_amplitude'],
+                                             hdr['max_amplitude'])
+    return p
+
+
+_vt_cache = MetadataCache(load_vt_metadata)
+_aaspi_cache = MetadataCache(load_aaspi_metadata)
+
+
+def vt_metadata(path):
+    """ Cached load_vt_metadata. """
+    return _vt_cache.get(path)
+
+
+def aaspi_metadata(path):
+    """ Cached load_aaspi_metadata. """
+    return _aaspi_cache.get(path)
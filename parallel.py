@@ -0,0 +1,325 @@
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from geoio import GeoIoVolume
+from aaspi import AaspiDataset
+from checksums import TraceChecksums
+from chunks import DEFAULT_MEMORY_BUDGET, DEFAULT_WRITE_SIZE, TrackLayout
+from instrument import StageTimer
+from stats import AmplitudeStats
+from utils import (aaspi_names, decode_vt_block, make_params,
+                   open_aaspi_journal, write_aaspi_bins, write_aaspi_tracks)
+
+# number of track ranges handed to each worker, more ranges give smoother
+# progress and better load balance at the cost of more task overhead
+_TASKS_PER_WORKER = 8
+
+# per process state set up by the pool initializer
+_worker = {}
+
+
+def _picklable_params(vt_params):
+    # the survey transforms are geoio objects - workers rebuild them from
+    # their own volume
+    return {k: v for k, v in vars(vt_params).items()
+            if not k.startswith('xform_')}
+
+
+def _init_vt_worker(vt_filename, vp_state, aaspi_params, memory_budget,
+                    pipelined, write_size, padded, read_order, write_idents,
+                    checksum, old_checksums):
+    v = GeoIoVolume(vt_filename)
+    survey = v.get_survey()
+    vp = make_params(**vp_state)
+    vp.xform_ijk_tbt = survey.get_ijk_to_track_bin_time_transform()
+    vp.xform_ijk_xyz = survey.get_ijk_to_xyz_transform()
+
+    ap = aaspi_params
+    _, binary_name, _, idents_binary_name = aaspi_names(ap, padded)
+    checksums = None
+    if checksum:
+        # checksums of every trace this worker reads, returned per range
+        checksums = TraceChecksums(None, None, (vp.ntrk, vp.nbin))
+        checksums.old = old_checksums
+    _worker.update(
+        v=v, vp=vp, ap=ap, memory_budget=memory_budget, pipelined=pipelined,
+        write_size=write_size, read_order=read_order, checksums=checksums,
+        write_range=write_aaspi_bins if read_order == 'bins' else write_aaspi_tracks,
+        fb=open(os.path.join(ap.output_dir, binary_name), 'r+b',
+                buffering=0),
+        fib=open(os.path.join(ap.output_dir, idents_binary_name),
+                 'r+b', buffering=0) if write_idents else None)
+
+
+def _write_vt_tracks(t_start, t_stop):
+    # a range of tracks, or of bins for read order 'bins'
+    w = _worker
+    stats = AmplitudeStats()
+    timer = StageTimer()
+    checksums = w['checksums']
+    if checksums is not None:
+        counts = checksums.rewritten, checksums.skipped
+    times = w['write_range'](w['v'], w['vp'], w['ap'], w['fb'], w['fib'],
+                             t_start, t_stop,
+                             memory_budget=w['memory_budget'],
+                             pipelined=w['pipelined'],
+                             write_size=w['write_size'], stats=stats,
+                             timer=timer, checksums=checksums)
+    # the parent journals the range as soon as it is returned, so it
+    # must be on disk by then
+    with timer.time('checkpoint'):
+        os.fsync(w['fb'].fileno())
+        if w['fib'] is not None:
+            os.fsync(w['fib'].fileno())
+    part = None
+    if checksums is not None:
+        part = (checksums.sums[_region(w['read_order'], t_start, t_stop)],
+                checksums.rewritten - counts[0], checksums.skipped - counts[1])
+    return t_start, t_stop, times, stats, timer.stages, part
+
+
+def _region(read_order, start, stop):
+    # the tracks, or the bins of every track, of a range
+    if read_order == 'bins':
+        return np.s_[:, start:stop]
+    return np.s_[start:stop]
+
+
+def split_tracks(ntrk, ntasks):
+    """ Split ntrk output tracks into at most ntasks contiguous ranges. """
+    ntasks = max(min(ntasks, ntrk), 1)
+    bounds = [ntrk * n // ntasks for n in range(ntasks + 1)]
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def split_ranges(ranges, ntasks):
+    """ Split track ranges into about ntasks contiguous ranges in total. """
+    total = sum(b - a for a, b in ranges)
+    return [(a + c, a + d) for a, b in ranges
+            for c, d in split_tracks(b - a, -(-ntasks * (b - a) // max(total, 1)))]
+
+
+def write_aaspi_binaries_parallel(vt_vol, vt_params, aaspi_params, workers=None,
+                                  callback=None,
+                                  memory_budget=DEFAULT_MEMORY_BUDGET,
+                                  pipelined=False,
+                                  write_size=DEFAULT_WRITE_SIZE,
+                                  padded=False, resume=False, timer=None,
+                                  read_order='auto', write_idents=True,
+                                  checksums=None):
+    """ Parallel version of utils.write_aaspi_binaries_from_vt.
+
+    Both binaries are preallocated to their final size and the tracks are
+    split across worker processes. Each worker opens its own GeoIoVolume and
+    writes its tracks at their fixed offsets, so the output is byte identical
+    to the serial path. Tracks are journaled as the workers finish them, as
+    in the serial path.
+
+    Parameters
+    ----------
+    vt_vol: GeoIoVolume
+        The input VT. Only its filename is passed to the workers.
+    vt_params, aaspi_params: _Params
+        Output of set_vt_params and set_aaspi_params.
+    workers: int, optional
+        Number of worker processes, defaults to the number of cores.
+    callback: callable, optional
+        Called as callback(done, total) with the number of tracks written.
+    memory_budget: int
+        Upper bound in bytes for one read in each worker.
+    pipelined: bool
+        Overlap reads and writes within each worker.
+    write_size: int
+        Size in bytes of a single write to the binaries.
+    padded: bool
+        Write the final padded names instead of the _nopad names.
+    resume: bool
+        Continue a journaled earlier run, see open_aaspi_journal.
+    timer: StageTimer, optional
+        Updated with the stage times summed over all workers.
+    read_order: str
+        'tracks', 'bins' or 'auto', see utils.write_aaspi_binaries_from_vt.
+        With 'bins' the workers get ranges of bins instead of tracks.
+    write_idents: bool
+        Write the idents binary, see utils.write_aaspi_binaries_from_vt.
+    checksums: TraceChecksums, optional
+        Checksum every trace for an incremental conversion, see
+        utils.write_aaspi_binaries_from_vt. The workers get the stored
+        checksums and send back those of their ranges.
+
+    Returns
+    -------
+    tuple
+        run_pipeline stage times summed over all workers and the merged
+        AmplitudeStats of the data.
+    """
+    vp, ap = vt_params, aaspi_params
+    workers = workers or os.cpu_count() or 1
+
+    # preallocates both binaries so workers can write anywhere in them
+    if read_order == 'auto':
+        read_order = TrackLayout(vp).read_order
+    journal = open_aaspi_journal(vt_vol, vp, ap, padded, resume, read_order,
+                                 write_idents, checksums)
+    outputs = [os.path.join(ap.output_dir, name)
+               for name in journal.meta['outputs']]
+    old_checksums = None
+    if checksums is not None and checksums.old is not None:
+        # the idents binary is kept, see open_aaspi_journal
+        write_idents = False
+        old_checksums = checksums.old
+    # progress is reported in tracks whatever the unit of the ranges
+    n = vp.nbin if read_order == 'bins' else vp.ntrk
+    pending = journal.pending(n)
+
+    print(f'Writing tracks: {vp.ftrk} to {vp.ltrk} delta {vp.dtrk} '
+          f'with {workers} workers')
+
+    ranges = split_ranges(pending, workers * _TASKS_PER_WORKER)
+    initargs = (vt_vol.get_filename(), _picklable_params(vp), ap,
+                memory_budget, pipelined, write_size, padded, read_order,
+                write_idents, checksums is not None, old_checksums)
+    done = n - sum(b - a for a, b in pending)
+    times = {}
+    with ProcessPoolExecutor(workers, initializer=_init_vt_worker,
+                             initargs=initargs) as pool:
+        futures = [pool.submit(_write_vt_tracks, a, b) for a, b in ranges]
+        try:
+            for future in as_completed(futures):
+                t_start, t_stop, task_times, task_stats, stages, part = \
+                    future.result()
+                done += t_stop - t_start
+                if part is not None:
+                    checksums.merge(_region(read_order, t_start, t_stop), *part)
+                journal.add(t_start, t_stop, task_stats)
+                if timer is not None:
+                    timer.merge(stages)
+                for stage, t in task_times.items():
+                    times[stage] = times.get(stage, 0.) + t
+                if callback is not None:
+                    callback(done * vp.ntrk / n, vp.ntrk)
+        except BaseException:
+            # a failed task or a cancelling callback, only wait for the
+            # running tasks on the way out
+            for future in futures:
+                future.cancel()
+            raise
+    # the journal holds the statistics of the tracks of earlier runs too
+    journal.close()
+    if checksums is not None:
+        checksums.save(outputs)
+    return times, journal.stats
+
+
+def _init_aaspi_worker(inputaaspi, shm_name, block_size, window, ks, nk,
+                       quantizer):
+    _worker.update(aaspi=AaspiDataset(inputaaspi), shm=SharedMemory(shm_name),
+                   block_size=block_size, window=window, ks=ks, nk=nk,
+                   quantizer=quantizer)
+
+
+def _slot(shm, slot, block_size, shape=None):
+    # float32 view of one block slot of the shared memory
+    view = np.ndarray(block_size, dtype=np.float32, buffer=shm.buf,
+                      offset=slot * block_size * 4)
+    return view if shape is None else view[:int(np.prod(shape))].reshape(shape)
+
+
+def _decode_vt_block(task, slot):
+    w = _worker
+    timer = StageTimer()
+    result = decode_vt_block(w['aaspi'], task,
+                             _slot(w['shm'], slot, w['block_size']),
+                             w['window'], w['ks'], w['nk'], timer,
+                             w['quantizer'])
+    return (slot, result['block'].shape, result['i'], result['j'],
+            result['stats'], result.get('error'), timer.stages)
+
+
+def decode_vt_blocks_parallel(inputaaspi, tasks, write, window, ks, nk,
+                              block_size, nbuffers, workers, timer=None,
+                              quantizer=None):
+    """ Decode AASPI blocks in worker processes and write them in order.
+
+    The parallel read stage of utils.write_vt_data. Each worker memory maps
+    the AASPI binary and decodes whole blocks, see utils.decode_vt_block,
+    into one of nbuffers slots of a shared memory buffer. This process is the
+    only writer: it waits for the blocks in task order, calls write on each
+    and hands the slot back, so the VT is written exactly as in the serial
+    path.
+
+    Parameters
+    ----------
+    inputaaspi: str
+        Path of the AASPI .H header.
+    tasks: list
+        plan_put_blocks blocks, in AASPI tracks.
+    write: callable
+        write(task, buf) with buf holding the decode_vt_block result.
+    window, ks, nk:
+        Passed to decode_vt_block.
+    block_size: int
+        Samples of the largest decoded block.
+    nbuffers: int
+        Blocks decoded or written at once.
+    workers: int
+        Number of worker processes.
+    timer: StageTimer, optional
+        Updated with the decode stages of the workers.
+    quantizer: quantize.Quantizer, optional
+        Quantize the blocks as they are decoded, passed to decode_vt_block.
+
+    Returns
+    -------
+    dict
+        Stage times as returned by pipeline.run_pipeline. 'read' is the
+        decode time summed over the workers, 'write_blocked' the time the
+        writer waited for them.
+    """
+    times = {'read': 0., 'write': 0., 'read_blocked': 0., 'write_blocked': 0.}
+    shm = SharedMemory(create=True, size=max(nbuffers * block_size * 4, 1))
+    try:
+        initargs = (inputaaspi, shm.name, block_size, window, ks, nk,
+                    quantizer)
+        with ProcessPoolExecutor(workers, initializer=_init_aaspi_worker,
+                                 initargs=initargs) as pool:
+            free = list(range(nbuffers))
+            pending = collections.deque()
+            n = 0
+            try:
+                while n < len(tasks) or pending:
+                    while free and n < len(tasks):
+                        pending.append((tasks[n], pool.submit(
+                            _decode_vt_block, tasks[n], free.pop())))
+                        n += 1
+                    task, future = pending.popleft()
+                    tic = time.perf_counter()
+                    slot, shape, i, j, stats, error, stages = future.result()
+                    toc = time.perf_counter()
+                    times['write_blocked'] += toc - tic
+                    times['read'] += sum(s['seconds'] for s in stages.values())
+                    if timer is not None:
+                        timer.merge(stages)
+                    write(task, {'block': _slot(shm, slot, block_size, shape),
+                                 'i': i, 'j': j, 'stats': stats,
+                                 'error': error})
+                    times['write'] += time.perf_counter() - toc
+                    free.append(slot)
+            except BaseException:
+                # only wait for the blocks being decoded on the way out
+                for _, future in pending:
+                    future.cancel()
+                raise
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # a block view is still held by the traceback of an error
+            pass
+        shm.unlink()
+    return times
@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+
+# seconds between checks for a failed stage while waiting on a queue
+_POLL = 0.1
+
+
+def run_pipeline(tasks, read, write, buffers, threaded=True):
+    """ Run read and write stages over a list of tasks.
+
+    With threaded=True a reader thread fills the preallocated buffers and a
+    writer thread drains them through a bounded queue, so reading task n+1
+    overlaps writing task n. With a single buffer or threaded=False the stages
+    run one after the other in the calling thread.
+
+    Parameters
+    ----------
+    tasks: iterable
+        Work items passed to read and write in order.
+    read: callable
+        read(task, buffer) fills buffer for task.
+    write: callable
+        write(task, buffer) writes a filled buffer. Called in task order.
+    buffers: list
+        Preallocated buffers, len(buffers) tasks can be in flight.
+    threaded: bool
+        Overlap the stages in separate threads.
+
+    Returns
+    -------
+    dict
+        Seconds spent in each stage ('read', 'write') and blocked waiting for
+        the other stage ('read_blocked', 'write_blocked'). A reader blocked
+        much longer than the writer means the run was write bound and the
+        other way round.
+    """
+    times = {'read': 0., 'write': 0., 'read_blocked': 0., 'write_blocked': 0.}
+
+    if not threaded or len(buffers) < 2:
+        buf = buffers[0]
+        for task in tasks:
+            tic = time.perf_counter()
+            read(task, buf)
+            toc = time.perf_counter()
+            write(task, buf)
+            times['read'] += toc - tic
+            times['write'] += time.perf_counter() - toc
+        return times
+
+    free = queue.Queue()
+    for buf in buffers:
+        free.put(buf)
+    # room for every buffer plus the end marker so puts never block
+    full = queue.Queue(maxsize=len(buffers) + 1)
+    failed = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            for task in tasks:
+                tic = time.perf_counter()
+                buf = None
+                while buf is None:
+                    if failed.is_set():
+                        return
+                    try:
+                        buf = free.get(timeout=_POLL)
+                    except queue.Empty:
+                        pass
+                toc = time.perf_counter()
+                read(task, buf)
+                times['read_blocked'] += toc - tic
+                times['read'] += time.perf_counter() - toc
+                full.put((task, buf))
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            full.put(None)
+
+    def writer():
+        try:
+            while True:
+                tic = time.perf_counter()
+                item = full.get()
+                toc = time.perf_counter()
+                times['write_blocked'] += toc - tic
+                if item is None:
+                    break
+                task, buf = item
+                write(task, buf)
+                times['write'] += time.perf_counter() - toc
+                free.put(buf)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+    threads = [threading.Thread(target=reader, name='pipeline-reader'),
+               threading.Thread(target=writer, name='pipeline-writer')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return times
+
+
+def format_stage_times(times):
+    """ One line summary of run_pipeline stage times. """
+    bound = 'write' if times['read_blocked'] > times['write_blocked'] \
+        else 'read'
+    return (f"read {times['read']:.1f}s (blocked {times['read_blocked']:.1f}s)"
+            f", write {times['write']:.1f}s "
+            f"(blocked {times['write_blocked']:.1f}s), {bound} bound")
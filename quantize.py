@@ -0,0 +1,183 @@
+""" Quantized 8 and 16 bit VT output.
+
+A VT stored with 1 or 2 bytes per sample is assumed to hold unsigned codes
+spread linearly between the clip values of its header: code 0 is
+min_clip_amp and the top code max_clip_amp. This has not been checked
+against an 8 or 16 bit VT written by geoio, fakegeoio.py encodes the same
+way so the benchmark cannot tell either. Attribute volumes rarely need
+more, and the smaller samples cut the output size and the cost of reading
+it again by 2 to 4 times.
+
+Samples are quantized block by block as they are decoded, in place and
+vectorized, to the amplitude of their code. If geoio encodes as assumed it
+stores them without a further rounding, and the error of the output is the
+one measured here and reported by QuantizationError. Otherwise the error
+reported is a lower bound.
+"""
+import numpy as np
+
+from stats import AmplitudeStats
+
+# bits per VT sample, 32 is float
+PRECISIONS = (8, 16, 32)
+
+# where the quantization range comes from: the amplitude range of the data
+# or its clip values, see quantization_range
+SCALES = ('range', 'clip')
+
+# AASPI header keys of the amplitude range and the clip values, see
+# stats.AmplitudeStats.header_entries
+_HEADER_KEYS = {'range': ('min_amplitude', 'max_amplitude'),
+                'clip': ('low_clip_amplitude', 'high_clip_amplitude')}
+
+# samples quantized at once, small enough for the passes over a piece to
+# stay in cache
+_PIECE = 1 << 16
+
+# samples read at once by the statistics pass of quantization_range
+_STATS_READ = 1 << 24
+
+
+def quantization_range(aaspi, scale='range', window=None):
+    """ (low, high, source) amplitudes spanned by the codes of a quantized VT.
+
+    The range comes from the AASPI header, written by vt2aaspi from the
+    statistics gathered while streaming the data. Volumes without it get
+    their statistics in one streaming pass over the AASPI data inside window,
+    ((t_lo, t_hi), (b_lo, b_hi), (s_lo, s_hi)) index ranges, see
+    utils.aaspi_window.
+
+    scale 'range' covers every sample, 'clip' only the samples between the
+    clip percentiles and clips the others, for a finer step.
+    """
+    if scale not in SCALES:
+        raise ValueError(f'Unknown quantization scale: {scale}')
+    low_key, high_key = _HEADER_KEYS[scale]
+    if low_key in aaspi.hdr and high_key in aaspi.hdr:
+        return float(aaspi.hdr[low_key]), float(aaspi.hdr[high_key]), 'header'
+
+    (t_lo, t_hi), (b_lo, b_hi), (s_lo, s_hi) = window or (
+        (0, aaspi.n3), (0, aaspi.n2), (0, aaspi.n1))
+    stats = AmplitudeStats()
+    ntracks = max(_STATS_READ // max((b_hi - b_lo) * (s_hi - s_lo), 1), 1)
+    for t in range(t_lo, t_hi, ntracks):
+        stats.update(aaspi.data[t:min(t + ntracks, t_hi), b_lo:b_hi, s_lo:s_hi])
+    if scale == 'clip':
+        low, high = stats.clip()
+    else:
+        low, high = stats.min, stats.max
+    if stats.min > stats.max:
+        # no finite sample
+        low, high = 0., 0.
+    return low, high, 'stats'
+
+
+class Quantizer:
+    """ Round samples to the 2**bits codes between low and high.
+
+    Parameters
+    ----------
+    bits: int
+        8 or 16.
+    low, high: float
+        Amplitudes of the lowest and the highest code, the clip values of
+        the VT.
+    """
+
+    def __init__(self, bits, low, high):
+        if bits not in (8, 16):
+            raise ValueError(f'Cannot quantize to {bits} bits')
+        self.bits = bits
+        self.low = float(low)
+        self.high = float(max(high, low))
+        self.top = (1 << bits) - 1
+        # a constant volume has a single amplitude, any step will do
+        self.step = (self.high - self.low) / self.top or 1.
+
+    def quantize(self, block, signal=None):
+        """ Replace the float32 samples of block, in place, by the amplitude
+        of their code.
+
+        signal is the sum of squares of the samples if known, e.g. from
+        their AmplitudeStats, for the signal to noise ratio.
+
+        Returns the QuantizationError of the block.
+        """
+        error = QuantizationError()
+        flat = block.reshape(-1)
+        scratch = np.empty(min(flat.size, _PIECE), dtype=np.float32)
+        low, step, top = np.float32(self.low), np.float32(self.step), self.top
+        for start in range(0, flat.size, _PIECE):
+            x = flat[start:start + _PIECE]
+            q = scratch[:x.size]
+            np.subtract(x, low, out=q)
+            q /= step
+            np.rint(q, out=q)
+            clipped = 0
+            if q.min() < 0 or q.max() > top:
+                clipped = np.count_nonzero(q < 0) + np.count_nonzero(q > top)
+                np.clip(q, 0, top, out=q)
+            q *= step
+            q += low
+            if signal is None:
+                error.signal += float(x @ x)
+            # x becomes the error, then the quantized samples
+            x -= q
+            error.add(x, clipped)
+            x[...] = q
+        if signal is not None:
+            error.signal = signal
+        return error
+
+
+class QuantizationError:
+    """ Running error of the quantized samples, combined with merge. """
+
+    def __init__(self):
+        self.count = 0
+        self.clipped = 0
+        self.max = 0.
+        self.sumsq = 0.
+        self.signal = 0.
+
+    def add(self, error, clipped=0):
+        """ Add the errors of a block of samples and the number of them
+        clipped. signal, the sum of squares of the samples, is kept by the
+        caller. """
+        if error.size:
+            self.max = max(self.max, float(error.max()), -float(error.min()))
+            self.sumsq += float(error @ error)
+        self.count += error.size
+        self.clipped += int(clipped)
+
+    def merge(self, other):
+        self.count += other.count
+        self.clipped += other.clipped
+        self.max = max(self.max, other.max)
+        self.sumsq += other.sumsq
+        self.signal += other.signal
+        return self
+
+    @property
+    def rms(self):
+        return float(np.sqrt(self.sumsq / self.count)) if self.count else 0.
+
+    def report(self, quantizer=None):
+        """ JSON serializable summary, with the scaling of quantizer. """
+        report = {'samples': self.count, 'clipped': self.clipped,
+                  'max_error': self.max, 'rms_error': self.rms,
+                  'snr_db': (10 * float(np.log10(self.signal / self.sumsq))
+                             if self.sumsq and self.signal else None)}
+        if quantizer is not None:
+            report.update(bits=quantizer.bits, low=quantizer.low,
+                          high=quantizer.high, step=quantizer.step)
+        return report
+
+
+def format_quantization(report):
+    """ One line summary of a QuantizationError report. """
+    snr = f', SNR {report["snr_db"]:.1f} dB' if report['snr_db'] is not None \
+        else ''
+    return f'{report["bits"]} bit, step {report["step"]:.4g}, ' \
+        f'max error {report["max_error"]:.4g}, rms error ' \
+        f'{report["rms_error"]:.4g}{snr}, {report["clipped"]} clipped'
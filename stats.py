@@ -0,0 +1,183 @@
+import numpy as np
+
+# samples processed at once, bounds the native copy of big endian data
+_BLOCK = 1 << 20
+
+# the histogram bins are the top bits of the float32 bit pattern: sign,
+# 8 exponent bits and _MANTISSA_BITS mantissa bits, i.e. 2**_MANTISSA_BITS
+# bins per octave of amplitude in each sign. The bins are the same for every
+# volume, so histograms of any blocks and workers add up exactly.
+_MANTISSA_BITS = 4
+_SHIFT = 23 - _MANTISSA_BITS
+_NBINS = 1 << (32 - _SHIFT)
+
+# only every _HIST_STRIDE'th sample goes into the histogram - binning is
+# the slowest part of update and a systematic sample of millions of values
+# gives the same percentiles
+_HIST_STRIDE = 8
+
+# position of the upper 16 bits of a native float32 in its uint16 view
+_HIGH = 1 if np.little_endian else 0
+
+# percentiles written as the clip values of the headers
+DEFAULT_CLIP_PERCENTILE = 99.5
+
+
+def _bin_edges(index):
+    # lower and upper edge of histogram bins, negative bins have their edges
+    # swapped so lower < upper
+    bits = np.asarray(index, dtype=np.uint32) << _SHIFT
+    lower = bits.view(np.float32).astype(np.float64)
+    upper = (bits + (1 << _SHIFT)).view(np.float32).astype(np.float64)
+    return np.minimum(lower, upper), np.maximum(lower, upper)
+
+
+class AmplitudeStats:
+    """ Running amplitude statistics of the data streamed through a conversion.
+
+    Blocks are added with update as they pass through memory, so no second
+    pass over the volume is needed. Statistics from several workers are
+    combined with merge.
+
+    Besides count, min and max the mean and RMS are kept, and a histogram
+    with fixed, logarithmically spaced bins of every eighth sample from which
+    percentiles are estimated to within one bin, about 6% of the amplitude.
+    min, max, mean and RMS are those of the finite samples, NaN and inf are
+    only counted in invalid.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.invalid = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.
+        self.sumsq = 0.
+        self.hist = np.zeros(_NBINS, dtype=np.int64)
+
+    def update(self, data):
+        """ Add a block of samples of any shape and byte order. """
+        if data.size == 0:
+            return
+        flat = data.reshape(-1)
+        for start in range(0, flat.size, _BLOCK):
+            x = np.ascontiguousarray(flat[start:start + _BLOCK],
+                                     dtype=np.float32)
+            finite = x
+            lo, hi = x.min(), x.max()
+            if not (np.isfinite(lo) and np.isfinite(hi)):
+                # NaN or inf samples, a block without finite ones leaves the
+                # range as it is
+                finite = x[np.isfinite(x)]
+                self.invalid += x.size - finite.size
+                lo, hi = ((finite.min(), finite.max()) if finite.size
+                          else (np.inf, -np.inf))
+            self.min = min(self.min, float(lo))
+            self.max = max(self.max, float(hi))
+            # float32 sums of one block, accumulated in float64
+            self.sum += float(finite.sum())
+            self.sumsq += float(finite @ finite)
+            high = x.view(np.uint16)[_HIGH::2 * _HIST_STRIDE]
+            self.hist += np.bincount(high >> (_SHIFT - 16), minlength=_NBINS)
+        self.count += data.size
+
+    def merge(self, other):
+        """ Add the statistics of another AmplitudeStats. """
+        self.count += other.count
+        self.invalid += other.invalid
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.hist += other.hist
+        return self
+
+    @property
+    def mean(self):
+        n = self.count - self.invalid
+        return self.sum / n if n else 0.
+
+    @property
+    def rms(self):
+        n = self.count - self.invalid
+        return float(np.sqrt(self.sumsq / n)) if n else 0.
+
+    def histogram(self):
+        """ Return the (lower, upper, count) of every non empty bin in
+        ascending amplitude order. NaN and inf samples are left out. """
+        index = np.flatnonzero(self.hist)
+        lower, upper = _bin_edges(index)
+        # the top finite bin ends at inf, the bins above hold inf and NaN
+        finite = np.isfinite(lower)
+        index, lower, upper = index[finite], lower[finite], upper[finite]
+        order = np.argsort(lower, kind='stable')
+        return lower[order], upper[order], self.hist[index[order]]
+
+    def percentiles(self, q):
+        """ Estimate percentiles q, in 0 to 100, from the histogram.
+
+        Values are interpolated linearly within a bin and limited to the
+        exact min and max.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        lower, upper, counts = self.histogram()
+        if not len(counts):
+            return np.full(q.shape, np.nan)
+        cum = np.cumsum(counts)
+        target = q / 100. * cum[-1]
+        n = np.minimum(np.searchsorted(cum, target, side='left'),
+                       len(cum) - 1)
+        below = np.where(n > 0, cum[n - 1], 0)
+        frac = np.clip((target - below) / counts[n], 0., 1.)
+        values = lower[n] + frac * (upper[n] - lower[n])
+        return np.clip(values, self.min, self.max)
+
+    def clip(self, percentile=DEFAULT_CLIP_PERCENTILE):
+        """ Return the (low, high) clip values at percentile and 100 -
+        percentile. """
+        low, high = self.percentiles([100. - percentile, percentile])
+        return float(low), float(high)
+
+    def header_entries(self, percentile=DEFAULT_CLIP_PERCENTILE):
+        """ AASPI header key/values for the statistics, none without a
+        finite sample. """
+        if not self.count or self.min > self.max:
+            return {}
+        low, high = self.clip(percentile)
+        return {'min_amplitude': self.min, 'max_amplitude': self.max,
+                'mean_amplitude': self.mean, 'rms_amplitude': self.rms,
+                'clip_percentile': percentile, 'low_clip_amplitude': low,
+                'high_clip_amplitude': high}
+
+    def report(self, percentiles=(0.1, 0.5, 1, 5, 50, 95, 99, 99.5, 99.9)):
+        """ JSON serializable summary for the run report. """
+        if not self.count:
+            return {'count': 0}
+        lower, upper, counts = self.histogram()
+        return {'count': self.count, 'invalid': self.invalid,
+                'min': self.min, 'max': self.max,
+                'mean': self.mean, 'rms': self.rms,
+                'percentiles': dict(zip(map(str, percentiles),
+                                        self.percentiles(percentiles).tolist())),
+                'histogram': {'lower': lower.tolist(), 'upper': upper.tolist(),
+                              'counts': counts.tolist()}}
+
+    def to_dict(self):
+        """ JSON serializable form, see from_dict. """
+        if not self.count:
+            return {'count': 0}
+        index = np.flatnonzero(self.hist)
+        return {'count': self.count, 'invalid': self.invalid,
+                'min': self.min, 'max': self.max, 'sum': self.sum, 'sumsq': self.sumsq,
+                'hist': [index.tolist(), self.hist[index].tolist()]}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        if d['count']:
+            stats.count, stats.min, stats.max = d['count'], d['min'], d['max']
+            stats.sum, stats.sumsq = d['sum'], d['sumsq']
+            stats.invalid = d.get('invalid', 0)
+            index, counts = d['hist']
+            stats.hist[index] = counts
+        return stats
@@ -0,0 +1,253 @@
+""" Usage tracking that never holds up a conversion.
+
+track_usage appends a usage record to a local spool file, a JSON line per
+record, and returns. The long running server starts a background thread,
+see UsageTracker.start, which sends the spooled records in batches through
+a sender, a callable taking a list of records that raises if they were not
+sent. Records that fail to send stay in the spool and are tried again
+later, by any process using the same spool.
+
+Processes that exit right after recording, such as job processes, never
+start the thread: they only spool their records and leave them for the
+server to send, so no record is lost with a process exiting mid send.
+
+Usage
+-----
+    track_usage({'Operation': 'VT to AASPI', 'VT Name': 'a.vt'})
+
+    # a local stand-in for the mail sender, e.g. for tests
+    set_tracker(UsageTracker('spool.jsonl', FileSender('sent.jsonl')))
+"""
+import fcntl
+import getpass
+import json
+import os
+import subprocess
+import threading
+from datetime import datetime
+
+# spool of the records not sent yet, shared by every process of the user
+DEFAULT_SPOOL = os.environ.get(
+    'VT_AASPI_USAGE_SPOOL',
+    os.path.join(os.path.expanduser('~'), '.vt_aaspi_usage.jsonl'))
+
+# address the usage records are mailed to, empty to keep them in the spool
+DEFAULT_ADDRESS = os.environ.get('VT_AASPI_USAGE_MAIL', 'jie.hou@shell.com')
+
+# records per call of the sender
+DEFAULT_BATCH_SIZE = 50
+
+# seconds between attempts to send the spool
+DEFAULT_INTERVAL = 60.
+
+# seconds the mail command gets before it counts as failed
+_MAIL_TIMEOUT = 60.
+
+# suffix of a spool being sent by a process, with its pid
+_SENDING = '.sending'
+
+
+class MailSender:
+    """ Send records with the mail command, one message per batch.
+
+    The message is passed on stdin and the arguments without a shell, so
+    nothing in a record is interpreted. A failing or hanging mail command
+    raises, leaving the records in the spool.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, subject='VT-AASPI Converter',
+                 timeout=_MAIL_TIMEOUT):
+        self.address = address
+        self.subject = subject
+        self.timeout = timeout
+
+    def __call__(self, records):
+        body = '\n'.join(''.join(f'{key}: {value}\n'
+                                 for key, value in record.items())
+                         for record in records)
+        subprocess.run(['mail', '-s', self.subject, self.address],
+                       input=body.encode(), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, timeout=self.timeout,
+                       check=True)
+
+
+class FileSender:
+    """ Local stand-in sender appending the records to a JSON lines file. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, records):
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(r) + '\n' for r in records))
+
+
+class UsageTracker:
+    """ Spool of usage records with a background sender.
+
+    Parameters
+    ----------
+    spool: str
+        Path of the spool file, created if missing.
+    sender: callable, optional
+        sender(records) sends a list of record dicts, raising if they were not
+        sent. None keeps the records in the spool.
+    batch_size: int
+        Records per call of sender.
+    interval: float
+        Seconds between attempts to send the spool once the thread runs.
+    """
+
+    def __init__(self, spool=DEFAULT_SPOOL, sender=None,
+                 batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL):
+        self.spool = spool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.interval = interval
+        self.errors = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, msg):
+        """ Spool a usage record of msg, a dict of strings, with the user
+        name and date, and wake the sender thread if this process started
+        it. """
+        record = {'User Name': getpass.getuser(),
+                  'Run Time': datetime.today().strftime('%Y-%m-%d')}
+        record.update(msg)
+        self._append([json.dumps(record) + '\n'])
+        self._wake.set()
+
+    def start(self):
+        """ Start the sender thread of this process, if there is a sender.
+        Only for long running processes, the thread is killed mid send when
+        the process exits. """
+        with self._start_lock:
+            if self.sender is not None and self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='usage-sender')
+                self._thread.start()
+        return self
+
+    def flush(self):
+        """ Send every spooled record, returns the number sent. Records left
+        by a sender that failed, or by a process that died while sending,
+        are sent too. """
+        if self.sender is None:
+            return 0
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        # take the spool, records spooled meanwhile go to a new one
+        taken = f'{self.spool}{_SENDING}.{os.getpid()}'
+        with self._lock():
+            if os.path.exists(self.spool):
+                os.replace(self.spool, taken)
+        # spools of processes that died while sending, looked for on every
+        # flush since a process can die at any time
+        paths = self._orphans() + ([taken] if os.path.exists(taken) else [])
+        sent = 0
+        for path in paths:
+            with open(path) as f:
+                lines = [line for line in f if line.endswith('\n')]
+            try:
+                for start in range(0, len(lines), self.batch_size):
+                    batch = lines[start:start + self.batch_size]
+                    self.sender([json.loads(line) for line in batch])
+                    sent += len(batch)
+            except Exception:
+                self.errors += 1
+                # the records of the failed and later batches
+                self._append(lines[start:])
+                os.remove(path)
+                break
+            os.remove(path)
+        return sent
+
+    def _orphans(self):
+        # spools taken by processes that died while sending
+        directory, name = os.path.split(os.path.abspath(self.spool))
+        prefix = name + _SENDING + '.'
+        return [os.path.join(directory, entry) for entry in os.listdir(directory)
+                if entry.startswith(prefix) and entry[len(prefix):].isdigit()
+                and not pid_alive(int(entry[len(prefix):]))]
+
+    def _lock(self):
+        return _FileLock(self.spool + '.lock')
+
+    def _append(self, lines):
+        if not lines:
+            return
+        with self._lock(), open(self.spool, 'a') as f:
+            f.write(''.join(lines))
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the spool is kept, try again next time
+                self.errors += 1
+
+
+class _FileLock:
+    # exclusive lock between the processes sharing a spool
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._f = open(self.path, 'a')
+        fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+def pid_alive(pid):
+    """ Whether a process with this pid exists, False for no pid. """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    """ Return the tracker of this process, mailing to DEFAULT_ADDRESS. """
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker(
+                sender=MailSender() if DEFAULT_ADDRESS else None)
+        return _tracker
+
+
+def set_tracker(tracker):
+    """ Replace the tracker of this process, e.g. with a local sender. """
+    global _tracker
+    with _tracker_lock:
+        _tracker = tracker
+
+
+def track_usage(msg):
+    """ Record the usage of the application, see UsageTracker.record. Never
+    raises, usage tracking must not fail a conversion. """
+    try:
+        get_tracker().record(msg)
+    except Exception:
+        pass
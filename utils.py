@@ -1,42 +1,34 @@
 import time
-import os, getpass
-from datetime import datetime
+import os
+import shutil
 import numpy as np
 import os
-import tkinter as tk
-from tkinter import filedialog
 from geoio import GeoIoVolume
+from idents import IdentEngine, affine_matrix
+from geometry import analyze_geometry, format_geometry, vt_shape
+from aaspi import AaspiDataset
+from stats import AmplitudeStats
+from journal import JOURNAL_SUFFIX, TrackJournal, source_info
+from checksums import CHECKSUM_SUFFIX, TraceChecksums, true_runs
+from quantize import (PRECISIONS, QuantizationError, Quantizer,
+                      format_quantization, quantization_range)
+from instrument import StageTimer
+from pipeline import format_stage_times, run_pipeline
+from chunks import (DEFAULT_MEMORY_BUDGET, DEFAULT_WRITE_SIZE, TrackLayout,
+                    plan_bin_chunks, plan_chunks, plan_put_blocks, to_vt_block,
+                    write_at)
 
 
 class _Params:
     pass
 
 
-def select_vt():
-
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askopenfilename(master=root, title="Select VT File",
-                                           filetypes=(("vt files", "*.vt"), ("all files", "*.*")))
-    return file_path
-
-
-def select_aaspi():
-
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askopenfilename(master=root, title="Select AASPI File",
-                                           filetypes=(("aaspi files", "*.H"), ("all files", "*.*")))
-    return file_path
-
-
-def select_output():
-
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askdirectory(
-        master=root, title="Select Output Path")
-    return file_path
+def make_params(**values):
+    """ Return a parameter object, as built by set_vt_params and
+    set_aaspi_params, with values as its attributes. """
+    p = _Params()
+    vars(p).update(values)
+    return p
 
 
 def set_vt_params(vt_vol):
@@ -82,9 +74,111 @@ def set_vt_params(vt_vol):
     p.nsmp, p.dsmp, p.fsmp = check.num_samples, check.digi, check.zero_time
     p.lsmp = p.fsmp + p.dsmp * (p.nsmp - 1)
 
+    # every track, bin and sample, see set_roi
+    p.trk_dec, p.bin_dec, p.smp_dec = 1, 1, 1
+
     return p
 
 
+def _grid_range(first, delta, n, window=None, step=1):
+    """ Return the (k0, k1) indices, end exclusive, of the points
+    first + k * delta inside window = (lo, hi), keeping every step'th. """
+    if window is None:
+        k0, k1 = 0, n - 1
+    else:
+        lo, hi = sorted(window)
+        # tolerate rounding in sample values
+        k0 = max(int(np.ceil((lo - first) / delta - 1e-6)), 0)
+        k1 = min(int(np.floor((hi - first) / delta + 1e-6)), n - 1)
+    if k1 < k0:
+        raise ValueError(f'Window {window} is outside {first} to '
+                         f'{first + delta * (n - 1)}')
+    return k0, k0 + (k1 - k0) // step * step + 1
+
+
+def set_roi(vt_params, tracks=None, bins=None, samples=None, decimation=None):
+    """ Restrict the output of set_vt_params to a region of interest.
+
+    Parameters
+    ----------
+    vt_params: _Params
+        Output of set_vt_params.
+    tracks, bins: tuple, optional
+        (first, last) track and bin numbers to keep, inclusive and in any
+        order. Defaults to all.
+    samples: tuple, optional
+        (first, last) time or depth to keep, inclusive. Defaults to all.
+    decimation: tuple, optional
+        Keep every n'th (track, bin, sample) of the region.
+
+    Returns
+    -------
+    _Params
+        A copy of vt_params describing the region. The AASPI headers, idents
+        and reads all follow from it, so only the region is read and written.
+    """
+    vp = vt_params
+    trk_dec, bin_dec, smp_dec = decimation or (1, 1, 1)
+    p = _Params()
+    vars(p).update(vars(vp))
+
+    k0, k1 = _grid_range(vp.ftrk, vp.dtrk, vp.ntrk, tracks, trk_dec)
+    p.ftrk, p.dtrk = vp.ftrk + k0 * vp.dtrk, vp.dtrk * trk_dec
+    p.ntrk = (k1 - 1 - k0) // trk_dec + 1
+    p.ltrk = p.ftrk + p.dtrk * (p.ntrk - 1)
+
+    # bins are kept in VT order, fbin > lbin for negbin volumes
+    bin0 = vp.lbin if vp.negbin else vp.fbin
+    k0, k1 = _grid_range(bin0, vp.dbin, vp.nbin, bins, bin_dec)
+    bin0, p.dbin = bin0 + k0 * vp.dbin, vp.dbin * bin_dec
+    p.nbin = (k1 - 1 - k0) // bin_dec + 1
+    p.fbin, p.lbin = bin0, bin0 + p.dbin * (p.nbin - 1)
+    if vp.negbin:
+        p.fbin, p.lbin = p.lbin, p.fbin
+
+    k0, k1 = _grid_range(vp.fsmp, vp.dsmp, vp.nsmp, samples, smp_dec)
+    p.fsmp, p.dsmp = vp.fsmp + k0 * vp.dsmp, vp.dsmp * smp_dec
+    p.nsmp = (k1 - 1 - k0) // smp_dec + 1
+    p.lsmp = p.fsmp + p.dsmp * (p.nsmp - 1)
+
+    p.trk_dec, p.bin_dec, p.smp_dec = (vp.trk_dec * trk_dec, vp.bin_dec * bin_dec,
+                                       vp.smp_dec * smp_dec)
+    return p
+
+
+def grid_differences(vt_params, other):
+    """ Compare the output grids of two set_vt_params or set_roi results.
+
+    Volumes of the same survey converted over the same region have identical
+    AASPI idents and headers apart from the names, see link_idents.
+
+    Returns
+    -------
+    list
+        Descriptions of the differences, empty if the grids match.
+    """
+    diffs = [f'{key}: {getattr(vt_params, key)} != {getattr(other, key)}'
+             for key in ('ntrk', 'ftrk', 'dtrk', 'nbin', 'fbin', 'dbin', 'negbin',
+                         'nsmp', 'fsmp', 'dsmp', 'trk_dec', 'bin_dec', 'smp_dec')
+             if getattr(vt_params, key) != getattr(other, key)]
+    a, b = grid_corners(vt_params), grid_corners(other)
+    for name in a:
+        if not np.allclose(a[name], b[name], rtol=1e-9, atol=0):
+            diffs.append(f'{name} transforms differ')
+    return diffs
+
+
+def grid_corners(vt_params):
+    """ The survey transforms at the corners of the survey, {name: list of
+    points}, exact for the affine transforms of real surveys. """
+    vp = vt_params
+    n = max(vp.ntrk * vp.trk_dec, vp.nbin * vp.bin_dec, 2) - 1
+    corners = [(i, j, 0) for i in (0, n) for j in (0, n)]
+    return {name[len('xform_'):]:
+            [[float(x) for x in getattr(vp, name).to_target(c)] for c in corners]
+            for name in ('xform_ijk_tbt', 'xform_ijk_xyz')}
+
+
 def set_aaspi_params(vt_filename, output_dir, horizontal_units, vertical_units):
     p = _Params()
 
@@ -124,14 +218,29 @@ def set_aaspi_params(vt_filename, output_dir, horizontal_units, vertical_units):
     return p
 
 
+def aaspi_names(aaspi_params, padded=False):
+    """ Return the (header, binary, idents header, idents binary) names.
+
+    padded=True gives the final names written by the native padding stage,
+    otherwise the _nopad names read by pad3d.
+    """
+    p = aaspi_params
+    if padded:
+        return (p.header_name, p.binary_name, p.idents_header_name,
+                p.idents_binary_name)
+    return (p.nopad_header_name, p.nopad_binary_name,
+            p.nopad_idents_header_name, p.nopad_idents_binary_name)
+
+
 def _volume_domain(domain_):
     domain = {0: "Time", 1: "Seismic Depth", 2: "Depth", 4: "Unknown"}
     return domain.get(domain_, "Invalid domain")
 
 
-def write_aaspi_header(vp_params, ap_params):
+def write_aaspi_header(vp_params, ap_params, padded=False, stats=None):
     vp = vp_params
     ap = ap_params
+    header_name, binary_name, idents_header_name, _ = aaspi_names(ap, padded)
 
     localtime = time.asctime(time.localtime(time.time()))
     hostname = os.uname().nodename
@@ -157,8 +266,8 @@ def write_aaspi_header(vp_params, ap_params):
     # architecture such as x86 Linux and Windows.
     aaspi_header = f'vt_to_aaspi.py:  {localtime} host:{hostname}\n\n'
     aaspi_header += f'input_vt_filename={vp.vt_filename}\n'
-    aaspi_header += f'in="{ap.nopad_binary_name}"\n'
-    aaspi_header += f'hff="{ap.nopad_idents_header_name}"\n'
+    aaspi_header += f'in="{binary_name}"\n'
+    aaspi_header += f'hff="{idents_header_name}"\n'
     aaspi_header += 'esize=4\n'
     aaspi_header += 'data_format="xdr_float"\n'
     aaspi_header += f'n1={n1} n2={n2} n3={n3}\n'
@@ -168,16 +277,27 @@ def write_aaspi_header(vp_params, ap_params):
     aaspi_header += f'label2={l2}\n'
     aaspi_header += f'label3={l3}\n'
     aaspi_header += f'unit1={u1}\n'
+    if padded:
+        # entries otherwise added by pad3d
+        aaspi_header += f'unique_project_name="{ap.uniq_proj}"\n'
+        aaspi_header += f'horizontal_units="{ap.horizontal_units}"\n'
+        aaspi_header += f'vertical_units="{ap.vertical_units}"\n'
+    # amplitude range gathered while the data was written, used to set the
+    # clip values when converting back to VT
+    if stats is not None:
+        for key, value in stats.header_entries().items():
+            aaspi_header += f'{key}={value}\n'
 
     # print(aaspi_header)
-    with open(os.path.join(ap.output_dir, ap.nopad_header_name), 'w') as f:
+    with open(os.path.join(ap.output_dir, header_name), 'w') as f:
         f.write(aaspi_header)
         f.close()
 
 
-def write_aaspi_idents_header(vp_params, ap_params):
+def write_aaspi_idents_header(vp_params, ap_params, padded=False):
     vp = vp_params
     ap = ap_params
+    _, _, idents_header_name, idents_binary_name = aaspi_names(ap, padded)
 
     localtime = time.asctime(time.localtime(time.time()))
     hostname = os.uname().nodename
@@ -189,7 +309,7 @@ def write_aaspi_idents_header(vp_params, ap_params):
 
     aaspi_header = f'vt_to_aaspi.py: {localtime} host:{hostname}\n\n'
     aaspi_header += f'input_vt_filename={vp.vt_filename}\n'
-    aaspi_header += f'in="{ap.nopad_idents_binary_name}"\n'
+    aaspi_header += f'in="{idents_binary_name}"\n'
     aaspi_header += 'esize=4\n'
     aaspi_header += 'data_format="xdr_float"\n'
     aaspi_header += f'n1={n1} n2={n2} n3={n3}\n'
@@ -201,167 +321,751 @@ def write_aaspi_idents_header(vp_params, ap_params):
 
     # print(aaspi_header)
     with open(os.path.join(ap.output_dir,
-                           ap.nopad_idents_header_name), 'w') as f:
+                           idents_header_name), 'w') as f:
         f.write(aaspi_header)
         f.close()
 
 
-def write_aaspi_binaries_from_vt(vt_vol, vt_params, aaspi_params, progress, status_text):
+def aaspi_journal_path(aaspi_params, padded=False):
+    """ Path of the track journal kept next to the AASPI data binary. """
+    binary_name = aaspi_names(aaspi_params, padded)[1]
+    return os.path.join(aaspi_params.output_dir, binary_name + JOURNAL_SUFFIX)
+
+
+def aaspi_checksums_path(aaspi_params, padded=False):
+    """ Path of the trace checksums kept next to the AASPI data binary. """
+    binary_name = aaspi_names(aaspi_params, padded)[1]
+    return os.path.join(aaspi_params.output_dir, binary_name + CHECKSUM_SUFFIX)
+
+
+def aaspi_checksums(vt_params, aaspi_params, padded=False):
+    """ TraceChecksums of the AASPI data binary for an incremental conversion,
+    see open_aaspi_journal. The stored checksums are used for the same output
+    grid and survey only. """
+    vp = vt_params
+    meta = dict(ntrk=vp.ntrk, nbin=vp.nbin, nsmp=vp.nsmp, negbin=vp.negbin,
+                roi=[vp.ftrk, vp.dtrk, vp.fbin, vp.dbin, vp.fsmp, vp.dsmp],
+                decimation=[vp.trk_dec, vp.bin_dec, vp.smp_dec],
+                corners=grid_corners(vp))
+    return TraceChecksums(aaspi_checksums_path(aaspi_params, padded), meta,
+                          (vp.ntrk, vp.nbin))
+
+
+def open_aaspi_journal(vt_vol, vt_params, aaspi_params, padded=False, resume=False,
+                       order='tracks', write_idents=True, checksums=None):
+    """ Preallocate the AASPI binaries and start their track journal.
+
+    With resume=True an existing journal of the same conversion is continued
+    instead, provided both binaries are still there at their full size.
+
+    The journal counts output tracks, or output bins for order='bins', see
+    write_aaspi_bins. With write_idents=False only the data binary is
+    written.
+
+    For an incremental conversion checksums is the TraceChecksums of the
+    data binary, see aaspi_checksums. If the stored checksums describe the
+    binaries on disk they are loaded and the binaries are kept as they are,
+    only the traces whose checksum changed are written. The checksum file is
+    removed either way until the conversion saves it again.
+
+    Returns the TrackJournal, see journal.TrackJournal.pending for the tracks
+    or bins left to write.
+    """
+    vp, ap = vt_params, aaspi_params
+    _, binary_name, _, idents_binary_name = aaspi_names(ap, padded)
+    ntraces = vp.ntrk * vp.nbin
+    sizes = {os.path.join(ap.output_dir, binary_name): ntraces * 4 * vp.nsmp}
+    if write_idents:
+        sizes[os.path.join(ap.output_dir, idents_binary_name)] = \
+            ntraces * 4 * len(ap.idents)
+
+    meta = dict(source_info(vt_vol.get_filename()), direction='vt2aaspi',
+                ntrk=vp.ntrk, nbin=vp.nbin, nsmp=vp.nsmp,
+                roi=[vp.ftrk, vp.dtrk, vp.fbin, vp.dbin, vp.fsmp, vp.dsmp],
+                outputs=[os.path.basename(path) for path in sizes], order=order)
+    journal = TrackJournal(aaspi_journal_path(ap, padded), meta)
+    if resume and all(os.path.isfile(path) and os.path.getsize(path) == size
+                      for path, size in sizes.items()) and journal.resume():
+        n = vp.nbin if order == 'bins' else vp.ntrk
+        ndone = n - sum(b - a for a, b in journal.pending(n))
+        print(f'Resuming: {ndone} of {n} {order} already written')
+        return journal
+
+    if checksums is not None and checksums.load(sizes):
+        print(f'Incremental: writing only the traces that changed since '
+              f'{os.path.basename(checksums.path)}')
+        os.remove(checksums.path)
+        return journal.start()
+    # the binaries are written again, old checksums no longer describe them
+    if os.path.exists(aaspi_checksums_path(ap, padded)):
+        os.remove(aaspi_checksums_path(ap, padded))
+
+    # preallocate both binaries so tracks can be written in any order. Old
+    # files are removed first, an idents binary may be linked to those of
+    # other volumes, see link_idents
+    for path, size in sizes.items():
+        if os.path.lexists(path):
+            os.remove(path)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    return journal.start()
+
+
+def write_aaspi_binaries_from_vt(vt_vol, vt_params, aaspi_params, callback=None,
+                                 memory_budget=DEFAULT_MEMORY_BUDGET, pipelined=False,
+                                 write_size=DEFAULT_WRITE_SIZE, padded=False,
+                                 resume=False, timer=None, read_order='auto',
+                                 write_idents=True, checksums=None):
+    """ Write the AASPI data and idents binaries from a VT.
+
+    The VT is read in read_order, 'tracks' or 'bins', see write_aaspi_tracks
+    and write_aaspi_bins. 'auto' takes the cheap order for the storage of the
+    VT, see chunks.TrackLayout.read_order.
+
+    With padded=True the binaries get their final names and no pad3d pass is
+    needed - VT volumes are always a full rectangular grid so there are no
+    missing traces to fill.
+
+    Written tracks are recorded in a journal next to the binaries. With
+    resume=True a journaled earlier run is continued and only the tracks it
+    did not finish are written. The journal is left in place, remove it with
+    aaspi_journal_path once the headers are written.
+
+    If given, the StageTimer timer is updated with the time of every stage.
+
+    With write_idents=False only the data binary is written, for volumes
+    sharing the idents binary of another volume of the same survey, see
+    link_idents.
+
+    With checksums, a TraceChecksums from aaspi_checksums, every trace is
+    checksummed and the conversion is incremental, see open_aaspi_journal.
+    The idents binary is kept when the stored checksums are used, the grid
+    and so the idents are those it was written with. The checksums are saved
+    at the end.
+
+    Returns the run_pipeline stage times and the AmplitudeStats of the data.
+    """
     ap = aaspi_params
     vp = vt_params
     v = vt_vol
-    xform_ijk_tbt = vp.xform_ijk_tbt
-    xform_ijk_xyz = vp.xform_ijk_xyz
+    _, binary_name, _, idents_binary_name = aaspi_names(ap, padded)
+    if read_order == 'auto':
+        read_order = TrackLayout(vp).read_order
+    journal = open_aaspi_journal(v, vp, ap, padded, resume, read_order,
+                                 write_idents, checksums)
+    outputs = [os.path.join(ap.output_dir, name)
+               for name in journal.meta['outputs']]
+    if checksums is not None and checksums.old is not None:
+        write_idents = False
 
     # Write traces and idents together in same routine to prevent getting them
     # out of sync
-    # open binary files for the data and idents
+    # open binary files for the data and idents, unbuffered as every write is
+    # a large aligned piece of a chunk
     fb = open(os.path.join(ap.output_dir,
-                           ap.nopad_binary_name), 'wb')
-    fib = open(os.path.join(ap.output_dir,
-                            ap.nopad_idents_binary_name), 'wb')
-
-    idents = ap.idents
-    # array to hold the idents - need 4 byte integer
-    hdr_idents = np.zeros((vp.nbin, len(idents)), dtype='i4')
-
-    # set the idents which are the same for every trace
-    hdr_idents[:, idents.get("muts")] = 0
-    hdr_idents[:, idents.get("mute")] = 0
-    hdr_idents[:, idents.get("trid")] = 1
-    hdr_idents[:, idents.get("laga")] = 0
-    hdr_idents[:, idents.get("scaleco")] = 1
-    hdr_idents[:, idents.get("ns")] = vp.nsmp
-    hdr_idents[:, idents.get("dt")] = vp.dsmp
+                           binary_name), 'r+b', buffering=0)
+    fib = None
+    if write_idents:
+        fib = open(os.path.join(ap.output_dir,
+                                idents_binary_name), 'r+b', buffering=0)
+    journal.files = [f for f in (fb, fib) if f is not None]
 
     # Always write out samples, bins, then tracks regardless of input data sort
     # Always write out bins and tracks in positive direction regardless of
     # input data sort
-    num = 0
     print(f'Writing tracks: {vp.ftrk} to {vp.ltrk} delta {vp.dtrk}')
     if vp.negbin:
         print(f'Flipping bins : {vp.lbin} to {vp.fbin} delta {vp.dbin}')
-
-    for trk in range(vp.ftrk, vp.ltrk + vp.dtrk, vp.dtrk):
-        # print progress messages - print track number every 100 tracks
-        # .'s for the other tracks. print all on same line
-        progress.progress((trk-vp.ftrk)/(vp.ltrk+vp.dtrk-vp.ftrk))
-
-        num += 1
-
-        status_text.text('Conversion Progress : %d/%d' %
-                         (num, abs(vp.ltrk-vp.ftrk)/vp.dtrk+1))
-
-        #
-        beg = (trk, vp.fbin, vp.fsmp)
-        end = (trk, vp.lbin, vp.lsmp)
-        bijk = xform_ijk_tbt.from_target(beg)
-        eijk = xform_ijk_tbt.from_target(end)
-
-        # write one track at a time in big endian order
-        dataslice = np.array(v.get_float(bijk, eijk), dtype=np.float32)
-        if vp.negbin:
-            np.flip(dataslice, axis=0).byteswap().tofile(fb)
-        else:
-            dataslice.byteswap().tofile(fb)
-
-        # now the idents - make sure the idents match the track just written
-        start_i, end_i = int(bijk[0]), int(eijk[0]) + 1
-        start_j, end_j = int(bijk[1]), int(eijk[1]) + 1
-        # xyz, and tbt should always be a 2D array because one of i or j is the
-        # track direction and start - end will be 1
-        xyz = np.array([xform_ijk_xyz.to_target((i, j, 0))
-                        for i in range(start_i, end_i)
-                        for j in range(start_j, end_j)])
-        tbt = np.array([xform_ijk_tbt.to_target((i, j, 0))
-                        for i in range(start_i, end_i)
-                        for j in range(start_j, end_j)])
-
-        # track is always line_no, bin is always cdp_no
-        # map x and y to cdp_x and cdp_y
-        hdr_idents[:, idents.get("line_no")] = tbt[:, 0]
-        hdr_idents[:, idents.get("cdp_no")] = tbt[:, 1]
-        hdr_idents[:, idents.get("cdp_x")] = xyz[:, 0]
-        hdr_idents[:, idents.get("cdp_y")] = xyz[:, 1]
-        # write the idents for this track in big endian order
-        if vp.negbin:
-            np.flip(hdr_idents, axis=0).byteswap().tofile(fib)
-
-        else:
-            hdr_idents.byteswap().tofile(fib)
+    if read_order == 'bins':
+        print('Reading bin slabs, the VT stores tracks along j')
+        write_range, n = write_aaspi_bins, vp.nbin
+    else:
+        write_range, n = write_aaspi_tracks, vp.ntrk
+
+    times = {}
+    for start, stop in journal.pending(n):
+        range_times = write_range(v, vp, ap, fb, fib, start, stop,
+                                  callback=callback, memory_budget=memory_budget,
+                                  pipelined=pipelined, write_size=write_size,
+                                  journal=journal, timer=timer,
+                                  checksums=checksums)
+        for stage, t in range_times.items():
+            times[stage] = times.get(stage, 0.) + t
+    # the journal holds the statistics of the tracks of earlier runs too
+    with (timer or StageTimer()).time('checkpoint'):
+        journal.close()
+    stats = journal.stats
 
     # print new line after progress messages
     print('')
+    if pipelined and times:
+        print(format_stage_times(times))
 
     # close the binary files
-    fb.close()
-    fib.close()
-
-
-def write_vt_data(session_state, progress, status_text):
-
-    inputvt = GeoIoVolume(session_state.inputvt)
-    header, check = inputvt.get_header_info()
-    survey = inputvt.get_survey()
-
-    hdr = {}
-    with open(session_state.inputaaspi) as f:
-        for line in f:
-            arr = line.split()
-            for item in arr:
-                if "=" in item:
-                    hdr[item.split('=')[0].replace('"', '').replace("'", "")] = item.split('=')[
-                        1].replace('"', '').replace("'", "")
-
-    hdr['hff'] = os.path.join('/'.join(session_state.inputaaspi.split('/')[:-1]), hdr['hff'])
-    hdr['in'] = os.path.join('/'.join(session_state.inputaaspi.split('/')[:-1]), hdr['in'])
+    for f in journal.files:
+        f.close()
+    if checksums is not None:
+        checksums.save(outputs)
+    return times, stats
 
-    hff = {}
-    with open(hdr['hff']) as f:
-        for line in f:
-            arr = line.split()
-            for item in arr:
-                if "=" in item:
-                    hff[item.split('=')[0].replace('"', '').replace("'", "")] = item.split('=')[
-                        1].replace('"', '').replace("'", "")
 
-    hff['in'] = os.path.join(
-        '/'.join(session_state.inputaaspi.split('/')[:-1]), hff['in'])
+def link_idents(idents_binary, aaspi_params, padded=False):
+    """ Reuse the idents binary of another volume of the same survey and
+    region as the idents binary of aaspi_params.
 
-    header.min_clip_amp = float(hdr['min_amplitude'])
-    header.max_clip_amp = float(hdr['max_amplitude'])
+    The idents only depend on the survey, so volumes converted from VTs of
+    one survey have identical idents binaries. A hard link costs nothing,
+    across filesystems the file is copied instead.
+    """
+    target = os.path.join(aaspi_params.output_dir,
+                          aaspi_names(aaspi_params, padded)[3])
+    if os.path.abspath(target) == os.path.abspath(idents_binary):
+        return target
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(idents_binary, target)
+    except OSError:
+        shutil.copyfile(idents_binary, target)
+    return target
+
+
+def write_aaspi_tracks(vt_vol, vt_params, aaspi_params, fb, fib, t_start=0, t_stop=None,
+                       callback=None, memory_budget=DEFAULT_MEMORY_BUDGET, pipelined=False,
+                       write_size=DEFAULT_WRITE_SIZE, stats=None, journal=None,
+                       timer=None, checksums=None):
+    """ Write output tracks t_start..t_stop-1 at their offsets in the binaries.
+
+    Every trace has a fixed place in the data and idents binaries, so any
+    range of tracks can be written independently of the others. With
+    pipelined=True reading the next chunk overlaps writing the current one.
+
+    Data and idents are filled in place into reusable big endian buffers,
+    with bins and tracks reversed through views, and written straight from
+    the buffers in write_size pieces. No per chunk copies are made. If given,
+    stats is updated with every chunk while it is in memory, every
+    completed track is added to journal once written and the StageTimer timer
+    is updated with the time of every stage. With fib None no idents are
+    computed or written. With checksums, a TraceChecksums, every trace is
+    checksummed and only the traces it reports as changed are written.
+
+    Returns the run_pipeline stage times.
+    """
+    vp = vt_params
+    t_stop = vp.ntrk if t_stop is None else t_stop
+    # read as many tracks per get_float call as fit in the memory budget, or
+    # part of a track if a single track does not fit
+    chunks = list(plan_chunks(vp, memory_budget, t_start, t_stop))
+
+    def done(t0, t1, b0, b1):
+        # tracks split over several chunks are journaled with their last
+        return (t0, t1) if b1 == vp.nbin else None
+
+    def progress(t0, t1, b0, b1):
+        return t1 - 1 + b1 / vp.nbin
+
+    return _write_aaspi_chunks(vt_vol, vp, aaspi_params, fb, fib, chunks, done,
+                               progress, callback, pipelined, write_size, stats,
+                               journal, timer, checksums)
+
+
+def write_aaspi_bins(vt_vol, vt_params, aaspi_params, fb, fib, b_start=0, b_stop=None,
+                     callback=None, memory_budget=DEFAULT_MEMORY_BUDGET, pipelined=False,
+                     write_size=DEFAULT_WRITE_SIZE, stats=None, journal=None,
+                     timer=None, checksums=None):
+    """ Write output bins b_start..b_stop-1 of every track, reading the VT in
+    bin slabs.
+
+    The bin order counterpart of write_aaspi_tracks for VT volumes stored
+    with tracks along j, where a slab of bins is a sequential read. Each slab
+    is transposed out of core: every track of it is one contiguous run of the
+    binaries and is written at its offset, so memory stays within the budget
+    whatever the size of the volume. Completed bins are added to journal,
+    progress is reported in tracks as for write_aaspi_tracks.
+
+    Returns the run_pipeline stage times.
+    """
+    vp = vt_params
+    b_stop = vp.nbin if b_stop is None else b_stop
+    chunks = list(plan_bin_chunks(vp, memory_budget, b_start, b_stop))
+
+    def done(t0, t1, b0, b1):
+        # bins split over several chunks are journaled with their last
+        return (b0, b1) if t1 == vp.ntrk else None
+
+    def progress(t0, t1, b0, b1):
+        return vp.ntrk * (b0 + (b1 - b0) * t1 / vp.ntrk) / vp.nbin
+
+    return _write_aaspi_chunks(vt_vol, vp, aaspi_params, fb, fib, chunks, done,
+                               progress, callback, pipelined, write_size, stats,
+                               journal, timer, checksums)
+
+
+def _write_aaspi_chunks(vt_vol, vp, aaspi_params, fb, fib, chunks, done, progress,
+                        callback, pipelined, write_size, stats, journal, timer,
+                        checksums):
+    # read, convert and write (t0, t1, b0, b1) chunks. done(*chunk) gives the
+    # journal range completed by a chunk, or None, and progress(*chunk) the
+    # tracks written for the callback
+    timer = timer or StageTimer()
+    nident = len(aaspi_params.idents) if fib is not None else 0
+
+    # idents for every trace of a chunk are computed in one go from the
+    # affine survey transforms
+    engine = IdentEngine(vp, aaspi_params) if nident else None
+    layout = TrackLayout(vp)
+    ntraces = max([(t1 - t0) * (b1 - b0) for t0, t1, b0, b1 in chunks], default=1)
+
+    # big endian buffers reused for every chunk, one per chunk in flight
+    # the statistics of a chunk travel with its buffer so only written data
+    # ends up in stats and the journal
+    buffers = [[np.empty(ntraces * vp.nsmp, dtype='>f4'),
+                np.empty(ntraces * nident, dtype='>i4'), None]
+               for _ in range(2 if pipelined else 1)]
+    done_stats = AmplitudeStats()
+
+    def views(chunk, buf):
+        t0, t1, b0, b1 = chunk
+        n = (t1 - t0) * (b1 - b0)
+        return (buf[0][:n * vp.nsmp].reshape(t1 - t0, b1 - b0, vp.nsmp),
+                buf[1][:n * nident].reshape(t1 - t0, b1 - b0, nident))
+
+    def read(chunk, buf):
+        data, idents = views(chunk, buf)
+        with timer.time('vt_read', data.nbytes):
+            raw = vt_vol.get_float(*layout.box(*chunk))
+        # tracks and bins ascending, converted to big endian in place - the
+        # only pass over the data
+        with timer.time('byteswap', data.nbytes):
+            data[...] = layout.to_output(raw, *chunk)
+        # the statistics do not depend on the order of the samples, so use
+        # the native get_float result unless it holds decimated samples
+        with timer.time('stats', data.nbytes):
+            buf[2] = AmplitudeStats()
+            buf[2].update(data if layout.decimated else raw)
+        # now the idents - make sure the idents match the traces just read
+        if nident:
+            with timer.time('idents', idents.nbytes):
+                engine.block_idents(*chunk, out=idents)
+
+    def write(chunk, buf):
+        nonlocal done_stats
+        t0, t1, b0, b1 = chunk
+        data, idents = views(chunk, buf)
+        # whole tracks or a single track are one run of the binaries,
+        # otherwise every track is a run of its own
+        n = (t1 - t0) * (b1 - b0)
+        if b1 - b0 == vp.nbin or t1 - t0 == 1:
+            runs = [(t0 * vp.nbin + b0, data.reshape(n, vp.nsmp),
+                     idents.reshape(n, nident))]
+        else:
+            runs = [(t * vp.nbin + b0, d, i)
+                    for t, d, i in zip(range(t0, t1), data, idents)]
+        if checksums is not None:
+            with timer.time('checksum', data.nbytes):
+                changed = checksums.update(*chunk, data)
+            if changed is not None:
+                # only the runs of changed traces within each run
+                runs = [(trace + a, d[a:b], i[a:b]) for (trace, d, i), mask in
+                        zip(runs, changed.reshape(len(runs), -1))
+                        for a, b in true_runs(mask)]
+        nbytes = sum(d.nbytes + i.nbytes for _, d, i in runs)
+        with timer.time('file_write', nbytes):
+            for trace, d, i in runs:
+                write_at(fb, trace * data.itemsize * vp.nsmp, d, write_size)
+                if nident:
+                    write_at(fib, trace * idents.itemsize * nident, i,
+                             write_size)
+        if stats is not None:
+            stats.merge(buf[2])
+        if journal is not None:
+            done_stats.merge(buf[2])
+            completed = done(*chunk)
+            if completed is not None:
+                with timer.time('checkpoint'):
+                    journal.add(*completed, done_stats)
+                done_stats = AmplitudeStats()
+        if callback is not None:
+            callback(progress(*chunk), vp.ntrk)
+
+    return run_pipeline(chunks, read, write, buffers, pipelined)
+
+
+def aaspi_window(aaspi, tracks=None, bins=None, samples=None):
+    """ Return the (first, stop) track, bin and sample indices of an
+    AaspiDataset inside a window, see write_vt_data. """
+    return (_grid_range(aaspi.o3, aaspi.d3, aaspi.n3, tracks),
+            _grid_range(aaspi.o2, aaspi.d2, aaspi.n2, bins),
+            _grid_range(aaspi.o1, aaspi.d1, aaspi.n1, samples))
+
+
+def vt_samples(aaspi, check, s_lo, s_hi, vt_name=''):
+    """ Return the slice of VT sample indices of AASPI samples s_lo..s_hi-1.
+
+    Raises ValueError if the AASPI samples do not fall on the VT samples
+    of the VT with check, named vt_name in the message.
+    """
+    nk = check.num_samples
+    k0 = (aaspi.o1 + s_lo * aaspi.d1 - check.zero_time) / check.digi
+    dk = aaspi.d1 / check.digi
+    k1 = k0 + dk * (s_hi - s_lo - 1)
+    if not (np.isclose(k0, round(k0)) and np.isclose(dk, round(dk))
+            and round(k0) >= 0 and round(k1) < nk):
+        raise ValueError(f'AASPI samples o1={aaspi.o1} d1={aaspi.d1} do not '
+                         f'fall on the VT samples of {vt_name}')
+    k0, dk = int(round(k0)), int(round(dk))
+    return slice(k0, k0 + dk * (s_hi - s_lo), dk)
+
+
+def write_vt_data(inputaaspi, inputvt, outputpath, callback=None, pipelined=False,
+                  resume=False, tracks=None, bins=None, samples=None, timer=None,
+                  stats=None, report=None, workers=1,
+                  memory_budget=DEFAULT_MEMORY_BUDGET, precision=None,
+                  scale='range', block_put=False):
+    """ Write an AASPI volume into a new VT using the survey of inputvt.
+
+    With pipelined=True decoding the next block of tracks overlaps writing the
+    current one into the VT. With workers > 1 the blocks are decoded by that
+    many processes and written in order by this one, see
+    parallel.decode_vt_blocks_parallel. memory_budget bounds the decoded
+    blocks held at once.
+
+    If the output VT can be synced, see vt_resumable, written tracks are
+    recorded in a journal next to it, which is removed once the VT is
+    complete. With resume=True the output VT of a journaled earlier run is
+    kept, if its size and header are those of the journaled run, and only the
+    tracks it did not finish are written. resume=True raises ValueError for
+    outputs that cannot be synced, no journal is kept for them.
+
+    tracks, bins and samples are optional (first, last) windows in track and
+    bin numbers and time or depth. Only the traces inside the window are
+    written, with zeros outside the sample window. The AASPI samples are
+    placed at their time in the VT, so a sample window converted to AASPI
+    with set_roi converts back into the full survey.
+
+    If given, the StageTimer timer is updated with the time of every stage
+    and the AmplitudeStats stats with the samples written.
+
+    The idents of all traces are mapped to the VT at once, see
+    analyze_geometry. Traces outside the survey are not written. The
+    geometry report is printed and, if report is a dict, stored under
+    report['geometry'].
+
+    The VT clip values come from the amplitude range in the AASPI header. The
+    VT header is written before the data, so for AASPI volumes without it
+    the clip values of inputvt are kept.
+
+    precision sets the bits per VT sample, 32 for float or 8 and 16 for a
+    quantized VT, see quantize.py. None keeps the sample size of inputvt.
+    The codes of a quantized VT span the clip values, set to the range of
+    quantization_range for scale. The samples are quantized as they are
+    decoded and the error is stored under report['quantization'].
+
+    Traces are put one at a time unless block_put is True, which puts runs of
+    planes with a single put, see put_block.
+
+    Returns the name of the output VT and the run_pipeline stage times.
+    """
+    timer = timer or StageTimer()
+    with timer.time('header'):
+        inputvt = GeoIoVolume(inputvt)
+        header, check = inputvt.get_header_info()
+        survey = inputvt.get_survey()
+
+        # parse the headers once and memory map the data and idents binaries
+        aaspi = AaspiDataset(inputaaspi)
+
+    if 'min_amplitude' in aaspi.hdr and 'max_amplitude' in aaspi.hdr:
+        header.min_clip_amp = float(aaspi.hdr['min_amplitude'])
+        header.max_clip_amp = float(aaspi.hdr['max_amplitude'])
+    else:
+        print(f'No amplitude range in {inputaaspi}, keeping the clip values of '
+              f'{inputvt.get_filename()}')
+
+    (t_lo, t_hi), (b_lo, b_hi), (s_lo, s_hi) = aaspi_window(aaspi, tracks, bins,
+                                                            samples)
+    quantizer = None
+    if precision is not None:
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown VT precision: {precision}')
+        header.bytes_per_sample = precision // 8
+        if precision < 32:
+            with timer.time('stats'):
+                low, high, source = quantization_range(
+                    aaspi, scale, ((t_lo, t_hi), (b_lo, b_hi), (s_lo, s_hi)))
+            quantizer = Quantizer(precision, low, high)
+            header.min_clip_amp, header.max_clip_amp = quantizer.low, quantizer.high
+            print(f'Quantizing to {precision} bits between {quantizer.low:g} '
+                  f'and {quantizer.high:g}, the {scale} from the {source}')
+    nk = check.num_samples
+    ks = vt_samples(aaspi, check, s_lo, s_hi, inputvt.get_filename())
 
     outputvt_name = os.path.join(
-        session_state.outputpath, session_state.inputaaspi.split('/')[-1].replace(".H", "_aaspi.vt"))
+        outputpath, os.path.basename(inputaaspi).replace(".H", "_aaspi.vt"))
+
+    meta = dict(source_info(aaspi.binary_path), direction='aaspi2vt',
+                survey=os.path.abspath(inputvt.get_filename()),
+                n1=aaspi.n1, n2=aaspi.n2, n3=aaspi.n3,
+                window=[t_lo, t_hi, b_lo, b_hi, s_lo, s_hi])
+    journal = None
+    if vt_resumable():
+        journal = TrackJournal(outputvt_name + JOURNAL_SUFFIX, meta)
+    elif resume:
+        raise ValueError(f'Cannot resume {outputvt_name}, VT outputs cannot '
+                         'be synced so no journal is kept')
+    outputvt = None
+    if resume and os.path.isfile(outputvt_name):
+        # the journal holds the size of the output as created, an output
+        # changed since or of another header is written again
+        journal.meta['output_size'] = os.path.getsize(outputvt_name)
+        existing = GeoIoVolume(outputvt_name)
+        if same_vt_header(existing, header, check) and journal.resume():
+            outputvt = existing
+            ndone = aaspi.n3 - sum(b - a for a, b in journal.pending(aaspi.n3))
+            print(f'Resuming: {ndone} of {aaspi.n3} tracks already written')
+        existing = None
+    if outputvt is None:
+        try:
+            os.remove(outputvt_name)
+            os.remove(outputvt_name+'.slm')
+        except:
+            pass
+
+        outputvt = GeoIoVolume(outputvt_name, header, check, survey)
+        if journal is not None:
+            journal.meta['output_size'] = os.path.getsize(outputvt_name)
+            journal.start()
+    if journal is not None:
+        journal.files = [outputvt]
 
-    try:
-        os.remove(outputvt_name)
-        os.remove(outputvt_name+'.slm')
-    except:
-        pass
+    xform_ijk_tbt = survey.get_ijk_to_track_bin_time_transform()
+    matrix = affine_matrix(xform_ijk_tbt, (max(check.num_tracks, check.num_bins),) * 2
+                           + (check.num_samples,))
+
+    # track is always line_no, bin is always cdp_no. Map every trace in one
+    # go, a regular grid gives the planes of all tracks without looking at
+    # single traces, irregular tracks keep their precomputed (i, j)
+    with timer.time('idents'):
+        line_no = np.array(aaspi.ident('line_no', 1)[t_lo:t_hi, b_lo:b_hi])
+        cdp_no = np.array(aaspi.ident('cdp_no', 0)[t_lo:t_hi, b_lo:b_hi])
+        geometry = analyze_geometry(xform_ijk_tbt, line_no, cdp_no,
+                                    vt_shape(xform_ijk_tbt, check), matrix)
+        planes = geometry.planes()
+    geometry_report = geometry.report(line_no, cdp_no)
+    print(f'Geometry: {format_geometry(geometry_report)}')
+    if report is not None:
+        report['geometry'] = geometry_report
+
+    # write runs of adjacent planes with a single put, fall back to one put per
+    # trace for irregular tracks or if the volume only takes single traces.
+    # blocks are planned the same way on every run, skip those already
+    # journaled
+    todo = np.zeros(aaspi.n3, dtype=bool)
+    for a, b in journal.pending(aaspi.n3) if journal else [(0, aaspi.n3)]:
+        todo[a:b] = True
+    # every block in flight holds a decoded copy
+    nbuffers = 2 * workers if workers > 1 else 2 if pipelined else 1
+    blocks = [(t_lo + i0, t_lo + i1, plane, step)
+              for i0, i1, plane, step in plan_put_blocks(
+                  planes, b_hi - b_lo, nk, memory_budget // nbuffers)
+              if todo[t_lo + i0:t_lo + i1].any()]
+    ntracks = max([i1 - i0 for i0, i1, _, _ in blocks], default=1)
+    window = (b_lo, b_hi, s_lo, s_hi)
+    # the first block put whole is read back, see put_block
+    state = {'block_put': block_put, 'check': block_put}
+
+    error = QuantizationError()
+    # statistics of the blocks written, kept by the journal if there is one
+    written = AmplitudeStats()
+
+    def read(task, buf):
+        buf.update(decode_vt_block(aaspi, task, buf['data'], window, ks, nk,
+                                   timer, quantizer))
+
+    def write(task, buf):
+        i0, i1, plane = task[:3]
+        with timer.time('vt_put', buf['block'].nbytes):
+            if plane is not None:
+                state['block_put'] = put_block(
+                    outputvt, buf['block'], buf['i'], buf['j'],
+                    state['block_put'], state['check'])
+                state['check'] = False
+            else:
+                for ii, traces in zip(range(i0, i1), buf['block']):
+                    put_traces(outputvt, traces, geometry.track_ij(ii - t_lo))
+        if journal is not None:
+            with timer.time('checkpoint'):
+                journal.add(i0, i1, buf['stats'])
+        else:
+            written.merge(buf['stats'])
+        if quantizer is not None:
+            error.merge(buf['error'])
+        if callback is not None:
+            callback(i1 - t_lo, t_hi - t_lo)
+
+    block_size = ntracks * (b_hi - b_lo) * nk
+    if workers > 1:
+        # imported here, parallel builds on this module
+        from parallel import decode_vt_blocks_parallel
+        times = decode_vt_blocks_parallel(inputaaspi, blocks, write, window, ks,
+                                          nk, block_size, nbuffers, workers,
+                                          timer, quantizer)
+    else:
+        buffers = [{'data': np.empty(block_size, dtype=np.float32)}
+                   for _ in range(nbuffers)]
+        times = run_pipeline(blocks, read, write, buffers, pipelined)
+    if pipelined or workers > 1:
+        print(format_stage_times(times))
+
+    aaspi.close()
+    if quantizer is not None:
+        # the blocks written by this run, a resumed run misses earlier ones
+        error_report = dict(error.report(quantizer), scale=scale, source=source)
+        print(f'Quantization: {format_quantization(error_report)}')
+        if report is not None:
+            report['quantization'] = error_report
+    if journal is not None:
+        with timer.time('checkpoint'):
+            journal.remove()
+        # the journal holds the statistics of the tracks of earlier runs too
+        written = journal.stats
+    if stats is not None:
+        stats.merge(written)
+    return outputvt_name, times
+
+
+def vt_resumable():
+    """ Whether a conversion to VT can be journaled and resumed.
+
+    Tracks are only journaled once the output has been synced to disk, which
+    needs a flush method on the output volume. Without one a journal could
+    list tracks that never reached the disk.
+    """
+    return hasattr(GeoIoVolume, 'flush')
 
-    outputvt = GeoIoVolume(outputvt_name, header, check, survey)
 
-    xform_ijk_tbt = survey.get_ijk_to_track_bin_time_transform()
+def same_vt_header(vt_vol, header, check):
+    """ Whether the VT vt_vol has the dimensions, sample size and clip values
+    of header and check. """
+    vt_header, vt_check = vt_vol.get_header_info()
+    return (all(getattr(vt_check, name) == getattr(check, name)
+                for name in ('num_tracks', 'num_bins', 'num_samples'))
+            and all(getattr(vt_header, name, None) == getattr(header, name, None)
+                    for name in ('bytes_per_sample', 'min_clip_amp',
+                                 'max_clip_amp')))
 
-    hffdata = np.fromfile(hff['in'], dtype='>i4').reshape(
-        int(hdr['n3']), int(hdr['n2']), int(hff['n1']))
 
-    for ii in range(int(hdr['n3'])):
-        progress.progress(ii/int(hdr['n3']))
-        status_text.text('Conversion Progress : %d/%d' %
-                         (ii+1, int(hdr['n3'])))
-        for jj in range(int(hdr['n2'])):
-            trk, bin = hffdata[ii, jj, 1], hffdata[ii, jj, 0]
-            i, j, _ = xform_ijk_tbt.from_target((trk, bin, 0))
-            trace = np.fromfile(hdr['in'], dtype='>f4', count=int(
-                hdr['n1']), offset=int(hdr['n1'])*(jj+int(hdr['n2'])*ii)*4)
-            outputvt.put(trace.astype(np.float32), int(i), int(j))
+def decode_vt_block(aaspi, task, out, window, ks, nk, timer=None, quantizer=None):
+    """ Decode the AASPI tracks of a plan_put_blocks block for the VT.
 
+    Parameters
+    ----------
+    aaspi: AaspiDataset
+        The input.
+    task: tuple
+        (i0, i1, plane, track_step) from plan_put_blocks, in AASPI tracks.
+    out: ndarray
+        1D float32 buffer of at least (i1 - i0) * nb * nk samples.
+    window: tuple
+        (b_lo, b_hi, s_lo, s_hi) AASPI bin and sample index ranges.
+    ks: slice
+        VT sample indices of the AASPI samples.
+    nk: int
+        Samples per VT trace.
+    timer: StageTimer, optional
+    quantizer: quantize.Quantizer, optional
+        Quantize the block in place for an 8 or 16 bit VT.
 
-def run_pad3d(aaspi_params):
+    Returns
+    -------
+    dict
+        'block', a view of out holding the native float32 traces oriented by
+        to_vt_block with its origin 'i' and 'j', or (ntr, nb, nk) in AASPI
+        order for an irregular track, 'stats', the AmplitudeStats of the
+        AASPI samples, and with a quantizer 'error', the QuantizationError of
+        the AASPI samples. The zeros outside the sample window are not
+        quantized.
+    """
+    timer = timer or StageTimer()
+    i0, i1, plane, step = task
+    b_lo, b_hi, s_lo, s_hi = window
+    full_traces = (ks.start, ks.step, s_hi - s_lo) == (0, 1, nk)
+    data = aaspi.data[i0:i1, b_lo:b_hi, s_lo:s_hi]
+    result = {'i': None, 'j': None}
+    if plane is not None:
+        block, result['i'], result['j'] = to_vt_block(data, plane, step)
+    else:
+        block = data
+    # decode from big endian into the native float buffer, at the VT
+    # samples of the AASPI samples. The binary is memory mapped so this
+    # is also where it is read, a separate read costs an extra copy
+    shape = block.shape[:2] + (nk,)
+    result['block'] = out[:shape[0] * shape[1] * nk].reshape(shape)
+    with timer.time('aaspi_read', block.nbytes):
+        if full_traces:
+            result['block'][...] = block
+        else:
+            result['block'][...] = 0
+            result['block'][..., ks] = block
+    with timer.time('stats', block.nbytes):
+        result['stats'] = AmplitudeStats()
+        result['stats'].update(result['block'] if full_traces else block)
+    if quantizer is not None:
+        # only the samples of the window, the zeros around them are no data
+        with timer.time('quantize', block.nbytes):
+            if full_traces:
+                result['error'] = quantizer.quantize(result['block'],
+                                                     result['stats'].sumsq)
+            else:
+                samples = np.ascontiguousarray(result['block'][..., ks])
+                result['error'] = quantizer.quantize(samples,
+                                                     result['stats'].sumsq)
+                result['block'][..., ks] = samples
+    return result
+
+
+def put_block(outputvt, block, i, j, block_put=False, check=False):
+    """ Write an (ni, nj, nk) block with its first trace at (i, j).
+
+    The block is written one trace at a time, unless block_put is True. A put
+    of a whole block is not documented by geoio, so it is only tried on
+    request. With check=True the block is read back and written again trace
+    by trace if it did not land where it should.
+
+    Returns False if the block was written one trace at a time. Pass the
+    result back as block_put to skip the block attempt on later calls.
+    """
+    block = np.ascontiguousarray(block, dtype=np.float32)
+    ni, nj, nk = block.shape
+    if block_put:
+        try:
+            outputvt.put(block, i, j)
+            if not check or np.array_equal(outputvt.get_float(
+                    (i, j, 0), (i + ni - 1, j + nj - 1, nk - 1)), block,
+                    equal_nan=True):
+                return True
+            print('Block puts misplace data, writing one trace at a time')
+        except (TypeError, ValueError):
+            pass
+    for a in range(ni):
+        for b in range(nj):
+            outputvt.put(block[a, b], i + a, j + b)
+    return False
+
+
+def put_traces(outputvt, traces, ij):
+    """ Write (n, nk) traces one at a time at their (i, j) indices, skipping
+    traces at negative indices. """
+    for trace, (i, j) in zip(traces, ij):
+        if i >= 0 and j >= 0:
+            outputvt.put(np.asarray(trace, dtype=np.float32), int(i), int(j))
+
+
+def run_pad3d(aaspi_params, keep_idents=False):
     # Assumes AASPIHOME env variable is set correctly
     # Make a list of argument needed by pad3d
+    # keep_idents leaves the _nopad idents binary for other volumes of the
+    # survey to link, see convert.convert_vt_batch
     p = aaspi_params
     pad3d_script = 'LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:${AASPIHOME}/lib64:${AASPIHOME}/ext_lib64/intel64 \n'
     pad3d_script += '${AASPIHOME}/bin64/pad3d '
@@ -380,7 +1084,8 @@ def run_pad3d(aaspi_params):
     pad3d_script += f'   rm {p.nopad_header_name}\n'
     pad3d_script += f'   rm {p.nopad_binary_name}\n'
     pad3d_script += f'   rm {p.nopad_idents_header_name}\n'
-    pad3d_script += f'   rm {p.nopad_idents_binary_name}\n'
+    if not keep_idents:
+        pad3d_script += f'   rm {p.nopad_idents_binary_name}\n'
     pad3d_script += 'fi\n'
 
     #    print(pad3d_script)
@@ -393,31 +1098,3 @@ def run_pad3d(aaspi_params):
     os.chdir(p.output_dir)
     os.system("./pad3d.sh")
     os.chdir(curr_dir)
-
-def track_usage(msg, email_address='jie.hou@shell.com'):
-    """ Track the usage for this application.
-    
-    Parameters
-    ----------
-    email_address: str
-        The email address will receive the information about the usage.
-    msg: dict
-        A dictionary including all the messages will be included in the email.
-        
-    Returns
-    -------
-    """
-    
-    current_username = getpass.getuser()
-    email_subject = '"VT-AASPI Converter"'
-    body_text = '"User Name: '+current_username + '\n'
-    body_text+= 'Run Time:' + datetime.today().strftime('%Y-%m-%d') +'\n'
-    for key, value in msg.items():
-        body_text += key + ': '+value +'\n'
-        
-    body_text += '"'
-    
-    try:
-        os.system('echo {} | mail -s {} {}'.format(body_text, email_subject, email_address))
-    except:
-        pass 
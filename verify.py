@@ -0,0 +1,352 @@
+""" Verify a conversion by comparing a VT with an AASPI volume.
+
+Works in either direction, a VT and the AASPI volume converted from it or an
+AASPI volume and the VT converted from it: every AASPI trace is compared with
+the VT trace its line_no and cdp_no idents map to, see analyze_geometry, at
+the VT samples of the AASPI samples. Decimated and windowed AASPI volumes
+are verified against the traces and samples they were taken from.
+
+For every trace the samples are compared within a tolerance and the cdp
+idents against those the survey transforms give for its VT position. Every
+AASPI track gets a CRC32 checksum of its big endian samples, as stored in
+the AASPI binary, and of the matching VT samples in the same form, so equal
+checksums mean bit identical tracks.
+
+The AASPI tracks are streamed in chunks that fit the memory budget, each
+with a single VT read of the box covering its traces, and split across
+worker processes.
+
+Usage
+-----
+    result = verify_conversion('input.vt', 'output/input.H', workers=8)
+    print(format_verify(result))
+"""
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geoio import GeoIoVolume
+from aaspi import AaspiDataset
+from chunks import DEFAULT_MEMORY_BUDGET
+from geometry import analyze_geometry, vt_shape
+from idents import affine_matrix, ij_idents
+from instrument import Progress
+from parallel import split_tracks
+from utils import vt_samples
+
+# mismatching traces listed in the result
+DEFAULT_MAX_MISMATCHES = 10
+
+# largest difference of cdp_x and cdp_y from the transforms. AASPI volumes
+# written before the idents were snapped, or padded by pad3d, can have
+# coordinates truncated to one below. Such traces are counted in
+# xy_off_by_one, line_no and cdp_no are always compared exactly.
+_XY_TOLERANCE = 1
+
+# AASPI track ranges handed to each worker
+_TASKS_PER_WORKER = 8
+
+# per process state set up by the pool initializer
+_worker = {}
+
+
+def track_checksums(tracks):
+    """ CRC32 of the big endian float32 samples of every track of a
+    (ntr, nb, ns) array, the checksum of the track in an AASPI binary. """
+    return [zlib.crc32(np.ascontiguousarray(track, dtype='>f4'))
+            for track in tracks]
+
+
+class _Verifier:
+    # compares ranges of AASPI tracks with the VT, one per process
+
+    def __init__(self, inputvt, inputaaspi, tolerance, max_mismatches,
+                 memory_budget):
+        self.vt = GeoIoVolume(inputvt)
+        _, check = self.vt.get_header_info()
+        survey = self.vt.get_survey()
+        self.aaspi = AaspiDataset(inputaaspi)
+        self.nk = check.num_samples
+        self.ks = vt_samples(self.aaspi, check, 0, self.aaspi.n1, inputvt)
+        self.tolerance = tolerance
+        self.max_mismatches = max_mismatches
+        self.memory_budget = memory_budget
+
+        extent = (max(check.num_tracks, check.num_bins),) * 2 + (self.nk,)
+        self.xforms = (survey.get_ijk_to_track_bin_time_transform(),
+                       survey.get_ijk_to_xyz_transform())
+        self.matrices = tuple(affine_matrix(x, extent) for x in self.xforms)
+        self.idents = {name: self.aaspi.ident_index(name)
+                       for name in ('line_no', 'cdp_no', 'cdp_x', 'cdp_y')}
+        if self.aaspi.idents is None:
+            self.idents = {}
+
+    def verify(self, t0, t1, i, j):
+        """ Verify AASPI tracks t0..t1-1, with (i, j) the VT indices of
+        their traces, -1 outside the survey. """
+        result = _empty_result()
+        # the AASPI chunk, the VT box and its big endian copy
+        nb, ns = self.aaspi.n2, self.aaspi.n1
+        track_bytes = 4 * nb * (ns + 2 * self.nk)
+        step = max(int(self.memory_budget) // track_bytes, 1)
+        for a in range(t0, t1, step):
+            b = min(a + step, t1)
+            _merge(result, self._chunk(a, b, i[a - t0:b - t0],
+                                       j[a - t0:b - t0]), self.max_mismatches)
+        return result
+
+    def _vt_traces(self, i, j):
+        # (ntr, nb, nk) VT traces at (i, j), zeros outside the survey. One
+        # get_float of the box around the traces if it fits the budget,
+        # otherwise the tracks are split
+        inside = i >= 0
+        shape = i.shape + (self.nk,)
+        if not inside.any():
+            return np.zeros(shape, dtype=np.float32)
+        iv, jv = i[inside], j[inside]
+        lo = (int(iv.min()), int(jv.min()))
+        hi = (int(iv.max()), int(jv.max()))
+        nj = hi[1] - lo[1] + 1
+        box_bytes = 4 * self.nk * (hi[0] - lo[0] + 1) * nj
+        if box_bytes <= max(self.memory_budget, 4 * self.nk * i.size):
+            box = self.vt.get_float((lo[0], lo[1], 0),
+                                    (hi[0], hi[1], self.nk - 1))
+            box = box.reshape(-1, self.nk)
+            flat = (iv - lo[0]) * nj + (jv - lo[1])
+            if iv.size < i.size:
+                traces = np.zeros(shape, dtype=np.float32)
+                traces[inside] = box[flat]
+                return traces
+            # ascending tracks along i are the box itself
+            if box.shape[0] == i.size and (flat == np.arange(i.size)).all():
+                return box.reshape(shape)
+            return box[flat].reshape(shape)
+
+        traces = np.zeros(shape, dtype=np.float32)
+        if len(i) > 1:
+            half = len(i) // 2
+            traces[:half] = self._vt_traces(i[:half], j[:half])
+            traces[half:] = self._vt_traces(i[half:], j[half:])
+        else:
+            # scattered traces of a single track, one read each
+            traces[inside] = [self.vt.get_float((a, b, 0), (a, b, self.nk - 1))
+                              .reshape(self.nk) for a, b in zip(iv, jv)]
+        return traces
+
+    def _chunk(self, t0, t1, i, j):
+        aaspi = self.aaspi
+        result = _empty_result()
+        # both sides as stored in an AASPI binary, the AASPI side is usually
+        # the memory map itself
+        data = np.ascontiguousarray(aaspi.data[t0:t1], dtype='>f4')
+        vt = self._vt_traces(i, j)[..., self.ks].astype('>f4')
+        inside = i >= 0
+
+        result['checksums'] = [list(c) for c in zip(track_checksums(data),
+                                                     track_checksums(vt))]
+        result['traces'] = int(i.size)
+        result['compared'] = int(np.count_nonzero(inside))
+        result['out_of_survey'] = int(i.size) - result['compared']
+        # ((track, bin), mismatch) of every kind, sorted at the end
+        found = [((t, b), self._mismatch(t0 + t, b, 'out of survey'))
+                 for t, b in np.argwhere(~inside)[:self.max_mismatches]]
+
+        for n, (crc, (a, v)) in enumerate(zip(result['checksums'],
+                                              zip(data, vt))):
+            # bit identical tracks need no closer look
+            if crc[0] == crc[1] and np.array_equal(a.view(np.uint32),
+                                                   v.view(np.uint32)):
+                continue
+            a = a.astype(np.float32)
+            v = v.astype(np.float32)
+            diff = np.abs(a - v)
+            # NaN on both sides is a match, on one side the worst mismatch
+            nan = np.isnan(diff)
+            diff[nan] = np.where(np.isnan(a[nan]) & np.isnan(v[nan]), 0, np.inf)
+            diff[~inside[n]] = 0
+            worst = diff.max(axis=-1)
+            result['max_diff'] = max(result['max_diff'], float(worst.max()))
+            for b in np.flatnonzero(worst > self.tolerance):
+                result['data_mismatches'] += 1
+                if result['data_mismatches'] > self.max_mismatches:
+                    continue
+                k = int(np.argmax(diff[b] > self.tolerance))
+                found.append(((n, b), dict(
+                    self._mismatch(t0 + n, b, 'data'),
+                    max_diff=float(worst[b]),
+                    first_sample=aaspi.o1 + k * aaspi.d1,
+                    aaspi=float(a[b, k]), vt=float(v[b, k]))))
+
+        if self.idents and result['compared']:
+            expected = ij_idents(i[inside], j[inside], *self.xforms,
+                                 *self.matrices)
+            bad = np.zeros(result['compared'], dtype=bool)
+            near = np.zeros(result['compared'], dtype=bool)
+            for name, index in self.idents.items():
+                if index is None:
+                    continue
+                got = np.asarray(aaspi.idents[t0:t1, :, index])[inside]
+                diff = np.abs(got.astype(np.int64) - expected[name])
+                if name in ('cdp_x', 'cdp_y'):
+                    bad |= diff > _XY_TOLERANCE
+                    near |= diff > 0
+                else:
+                    bad |= diff > 0
+            result['ident_mismatches'] = int(np.count_nonzero(bad))
+            result['xy_off_by_one'] = int(np.count_nonzero(near & ~bad))
+            found += [((t, b), self._mismatch(t0 + t, b, 'idents'))
+                      for t, b in np.argwhere(inside)[bad][:self.max_mismatches]]
+        found.sort(key=lambda f: tuple(f[0]))
+        result['mismatches'] = [m for _, m in found[:self.max_mismatches]]
+        return result
+
+    def _mismatch(self, t, b, kind):
+        aaspi = self.aaspi
+        return {'kind': kind, 'track': aaspi.o3 + int(t) * aaspi.d3,
+                'bin': aaspi.o2 + int(b) * aaspi.d2}
+
+
+def _empty_result():
+    return {'traces': 0, 'compared': 0, 'out_of_survey': 0,
+            'data_mismatches': 0, 'ident_mismatches': 0, 'xy_off_by_one': 0,
+            'max_diff': 0.,
+            'mismatches': [], 'checksums': []}
+
+
+def _add_mismatch(result, mismatch, max_mismatches):
+    if len(result['mismatches']) < max_mismatches:
+        result['mismatches'].append(mismatch)
+
+
+def _merge(result, other, max_mismatches):
+    # add the result of the next tracks
+    for key in ('traces', 'compared', 'out_of_survey', 'data_mismatches',
+                'ident_mismatches', 'xy_off_by_one'):
+        result[key] += other[key]
+    result['max_diff'] = max(result['max_diff'], other['max_diff'])
+    for m in other['mismatches']:
+        _add_mismatch(result, m, max_mismatches)
+    result['checksums'].extend(other['checksums'])
+    return result
+
+
+def _init_worker(*args):
+    _worker['verifier'] = _Verifier(*args)
+
+
+def _verify_tracks(t0, t1, i, j):
+    return _worker['verifier'].verify(t0, t1, i, j)
+
+
+def verify_conversion(inputvt, inputaaspi, tolerance=0.,
+                      max_mismatches=DEFAULT_MAX_MISMATCHES, workers=1,
+                      memory_budget=DEFAULT_MEMORY_BUDGET, callback=None):
+    """ Compare a VT with an AASPI volume converted to or from it.
+
+    Parameters
+    ----------
+    inputvt: str
+        Path of the VT.
+    inputaaspi: str
+        Path of the AASPI .H header.
+    tolerance: float
+        Largest absolute difference of matching samples.
+    max_mismatches: int
+        Mismatching traces listed in the result, the first in track order.
+    workers: int
+        Number of worker processes. 1 verifies in this process.
+    memory_budget: int
+        Upper bound in bytes for one chunk in each worker.
+    callback: callable, optional
+        Called as callback(done, total, status) with the number of AASPI
+        tracks verified, throttled and with the rate and ETA in status, see
+        instrument.Progress.
+
+    Returns
+    -------
+    dict
+        Summary with the number of traces, compared traces, traces outside
+        the survey, off the grid, with mismatching samples or idents, the
+        largest sample difference, the first mismatches, the per track
+        [aaspi, vt] checksums, and ok, True if nothing mismatched.
+    """
+    tic = time.perf_counter()
+    vt = GeoIoVolume(inputvt)
+    _, check = vt.get_header_info()
+    xform_ijk_tbt = vt.get_survey().get_ijk_to_track_bin_time_transform()
+    with AaspiDataset(inputaaspi) as aaspi:
+        n3, nbytes = aaspi.n3, aaspi.data.nbytes
+        line_no = np.array(aaspi.ident('line_no', 1))
+        cdp_no = np.array(aaspi.ident('cdp_no', 0))
+    if callback is not None:
+        callback = Progress(callback, nbytes // max(n3, 1))
+    matrix = affine_matrix(xform_ijk_tbt, (max(check.num_tracks, check.num_bins),) * 2
+                           + (check.num_samples,))
+    geometry = analyze_geometry(xform_ijk_tbt, line_no, cdp_no,
+                                vt_shape(xform_ijk_tbt, check), matrix)
+    i, j = geometry.i, geometry.j
+
+    args = (inputvt, inputaaspi, tolerance, max_mismatches, memory_budget)
+    result = _empty_result()
+    done = 0
+    if workers > 1:
+        ranges = split_tracks(n3, workers * _TASKS_PER_WORKER)
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=args) as pool:
+            # in track order, so the first mismatches come first
+            futures = [pool.submit(_verify_tracks, a, b, i[a:b], j[a:b])
+                       for a, b in ranges]
+            for (a, b), future in zip(ranges, futures):
+                _merge(result, future.result(), max_mismatches)
+                done += b - a
+                if callback is not None:
+                    callback(done, n3)
+    else:
+        verifier = _Verifier(*args)
+        for a, b in split_tracks(n3, _TASKS_PER_WORKER):
+            _merge(result, verifier.verify(a, b, i[a:b], j[a:b]),
+                   max_mismatches)
+            done += b - a
+            if callback is not None:
+                callback(done, n3)
+
+    seconds = time.perf_counter() - tic
+    result.update(
+        operation='verify', input=os.path.abspath(inputvt),
+        output=os.path.abspath(inputaaspi), tolerance=tolerance,
+        off_grid=int(np.count_nonzero(geometry.off_grid)),
+        checksum_mismatches=sum(a != v for a, v in result['checksums']),
+        seconds=seconds, bytes=nbytes,
+        mb_per_s=nbytes / 1e6 / seconds if seconds else 0.)
+    result['ok'] = not (result['out_of_survey'] or result['data_mismatches']
+                        or result['ident_mismatches'])
+    return result
+
+
+def format_verify(result):
+    """ Summary lines of a verify_conversion result. """
+    lines = [f'{result["output"]} against {result["input"]}: '
+             f'{"OK" if result["ok"] else "MISMATCH"}',
+             f'  {result["compared"]} of {result["traces"]} traces compared, '
+             f'{result["out_of_survey"]} outside the survey, '
+             f'{result["off_grid"]} off the grid',
+             f'  {result["data_mismatches"]} traces with samples off by more '
+             f'than {result["tolerance"]:g}, largest difference '
+             f'{result["max_diff"]:g}',
+             f'  {result["ident_mismatches"]} traces with idents not matching '
+             f'the survey, {result["xy_off_by_one"]} more with cdp_x or cdp_y '
+             f'off by one',
+             f'  {result["checksum_mismatches"]} of {len(result["checksums"])} '
+             f'track checksums differ',
+             f'  {result["seconds"]:.1f} s, {result["mb_per_s"]:.1f} MB/s']
+    for m in result['mismatches']:
+        detail = ''
+        if m['kind'] == 'data':
+            detail = (f' at {m["first_sample"]:g}: {m["aaspi"]:g} != '
+                      f'{m["vt"]:g}, max difference {m["max_diff"]:g}')
+        lines.append(f'  track {m["track"]:g} bin {m["bin"]:g}: '
+                     f'{m["kind"]}{detail}')
+    return '\n'.join(lines)